@@ -0,0 +1,74 @@
+# Saving and loading of a large CDF experiment description.
+#
+# The experiment has 100 sensing devices, 50 interferers with 10 programs
+# each and 100 iterations.
+#
+# Run with: python -m bench.bench_cdf
+
+import datetime
+
+try:
+	from StringIO import StringIO as BytesIO
+except ImportError:
+	from io import BytesIO
+
+import vesna.cdf
+from vesna.cdf.xml import CDFXMLExperiment
+
+from bench import common
+
+def _get_experiment():
+	e = vesna.cdf.CDFExperiment(
+			title="Benchmark experiment",
+			summary="Experiment summary",
+			release_date=datetime.datetime(2020, 1, 1),
+			methodology="Collection methodology",
+			related_experiments="Related experiments",
+			notes="Notes")
+
+	e.add_author(vesna.cdf.CDFAuthor(name="John", email="john@example.com"))
+	e.set_frequency_range(start_hz=2400e6, stop_hz=2500e6, step_hz=1e6)
+	e.set_duration(60)
+
+	base_url = "http://example.com/communicator"
+
+	for addr in range(100):
+		e.add_device(vesna.cdf.CDFDevice(base_url, 10001, addr))
+
+	for addr in range(100, 150):
+		i = vesna.cdf.CDFInterferer(vesna.cdf.CDFDevice(base_url, 10001, addr))
+		for n in range(10):
+			i.add_program(vesna.cdf.CDFInterfererProgram(
+				center_hz=2450e6, power_dbm=0,
+				start_time=n * 5, end_time=n * 5 + 4))
+		e.add_interferer(i)
+
+	for n in range(100):
+		i = vesna.cdf.CDFExperimentIteration()
+		i.start_time = datetime.datetime(2020, 1, 1, 0, 0, 0) + datetime.timedelta(minutes=n)
+		i.end_time = i.start_time + datetime.timedelta(seconds=60)
+		i.tracefiles = [ "data_%d_node_%d.dat" % (n, addr) for addr in range(10) ]
+		e.iterations.append(i)
+
+	return CDFXMLExperiment(e)
+
+def bench_save():
+	e = _get_experiment()
+
+	def func():
+		e.save(BytesIO())
+
+	return func
+
+def bench_load():
+	f = BytesIO()
+	_get_experiment().save(f)
+	data = f.getvalue()
+
+	def func():
+		CDFXMLExperiment.load(BytesIO(data))
+
+	return func
+
+if __name__ == "__main__":
+	common.main(globals())
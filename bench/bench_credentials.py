@@ -0,0 +1,52 @@
+# Per-request overhead of looking up HTTP credentials in ALHWeb.
+#
+# "uncached" re-reads all alhrc files on each request, as ALHWeb did before
+# credentials were cached. "cached" is the current behavior.
+#
+# Run with: python -m bench.bench_credentials
+
+import os
+import shutil
+import tempfile
+import atexit
+
+from vesna.alh import ALHWeb
+from vesna.alh.credentials import ALHRCCredentials
+
+from bench import common
+
+def _get_alh(check_interval):
+	d = tempfile.mkdtemp()
+	atexit.register(shutil.rmtree, d)
+
+	paths = []
+	for n in range(3):
+		path = os.path.join(d, "alhrc%d" % (n,))
+		with open(path, "w") as f:
+			for m in range(10):
+				f.write("Host host%d.example.com\nUser foo\nPassword bar\n" % (m,))
+
+		paths.append(path)
+
+	creds = ALHRCCredentials(paths, check_interval=check_interval)
+	return ALHWeb("https://example.com/communicator", 1, credentials=creds)
+
+def bench_passwd_uncached():
+	alh = _get_alh(0)
+
+	def func():
+		alh.credentials.invalidate()
+		alh._get_passwd()
+
+	return func
+
+def bench_passwd_cached():
+	alh = _get_alh(1.0)
+	return alh._get_passwd
+
+def bench_passwd_cached_mtime_check():
+	alh = _get_alh(0)
+	return alh._get_passwd
+
+if __name__ == "__main__":
+	common.main(globals())
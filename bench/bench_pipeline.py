@@ -0,0 +1,98 @@
+# Request throughput of ALHTerminal with and without pipelining.
+#
+# The fake serial device delays each request and response by a fixed link
+# latency and processes requests one at a time with a fixed processing
+# time, like the firmware on a coordinator does. Each benchmark sends 40
+# requests from 8 threads.
+#
+# Run with: python -m bench.bench_pipeline
+
+import collections
+import threading
+import time
+
+from vesna.alh import ALHTerminal
+
+from bench import common
+
+class FakeSerialDevice(object):
+	def __init__(self, latency=1e-3, processing_time=1e-3):
+		self.latency = latency
+		self.processing_time = processing_time
+
+		self._cond = threading.Condition()
+		self._requests = collections.deque()
+		# list of (time response becomes readable, response)
+		self._responses = collections.deque()
+		self._busy_until = 0.
+
+	def write(self, data):
+		with self._cond:
+			arrival = time.time() + self.latency
+
+			done = max(arrival, self._busy_until) + self.processing_time
+			self._busy_until = done
+
+			self._responses.append((done + self.latency, b"ok\r\nOK\r\n"))
+			self._cond.notify_all()
+
+	def _pop_ready(self, size):
+		now = time.time()
+
+		r = b""
+		while self._responses and self._responses[0][0] <= now and len(r) < size:
+			r += self._responses.popleft()[1]
+
+		return r
+
+	@property
+	def in_waiting(self):
+		with self._cond:
+			now = time.time()
+			return sum(len(resp) for t, resp in self._responses if t <= now)
+
+	def read(self, size=1):
+		while True:
+			with self._cond:
+				r = self._pop_ready(size)
+				if r:
+					return r
+
+				if self._responses:
+					wait = self._responses[0][0] - time.time()
+				else:
+					wait = None
+
+			if wait is None:
+				with self._cond:
+					self._cond.wait(.1)
+			elif wait > 0:
+				time.sleep(wait)
+
+def _get_func(pipeline_depth):
+	alh = ALHTerminal(FakeSerialDevice(), pipeline_depth=pipeline_depth)
+
+	def worker():
+		for n in range(5):
+			alh.get("hello")
+
+	def func():
+		threads = [ threading.Thread(target=worker) for n in range(8) ]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+	return func
+
+def bench_40_requests_depth_1():
+	return _get_func(1)
+
+def bench_40_requests_depth_2():
+	return _get_func(2)
+
+def bench_40_requests_depth_4():
+	return _get_func(4)
+
+if __name__ == "__main__":
+	common.main(globals())
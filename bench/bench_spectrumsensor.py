@@ -0,0 +1,202 @@
+# Decoding of spectrum sensor responses and results on large synthetic
+# inputs.
+#
+# The slot benchmarks decode 1 MB of sensing/slotDataBinary data (100
+# channels per sweep). The read slot benchmarks assemble 1 to 50 MB
+# slots from 512 byte chunks, without decoding. The sweep benchmark
+# parses a sensing/quickSweepBin response with 1000 channels.
+#
+# "concat" benchmarks use the old implementation that appended each chunk
+# to an immutable bytes object. Its time grows with the square of the slot
+# size, so it is only run for small slots (10 MB takes about a minute).
+#
+# Run with: python -m bench.bench_spectrumsensor
+
+import atexit
+import binascii
+import os
+import random
+import shutil
+import struct
+import tempfile
+
+from vesna.alh import ALHResponse
+from vesna.alh.spectrumsensor import SpectrumSensor, SpectrumSensorProgram
+from vesna.spectrumsensor import Device, DeviceConfig, SweepConfig
+
+from bench import common
+
+def _get_sweep_config(num_channels):
+	d = Device(0, "test")
+
+	dc = DeviceConfig(0, "test", d)
+	dc.base = 2400000000
+	dc.spacing = 1000
+	dc.bw = 1000
+	dc.num = num_channels
+	dc.time = 1
+
+	return SweepConfig(dc, 0, num_channels, 1)
+
+def _get_slot_data(num_channels, size):
+	rand = random.Random(42)
+
+	fmt = "<i%dh" % (num_channels,)
+	num_sweeps = size // struct.calcsize(fmt)
+
+	chunks = []
+	for n in range(num_sweeps):
+		values = [ rand.randint(-10000, -9000) for m in range(num_channels) ]
+		chunks.append(struct.pack(fmt, n * num_channels, *values))
+
+	return b"".join(chunks)
+
+def _get_program():
+	sweep_config = _get_sweep_config(100)
+	return SpectrumSensorProgram(sweep_config, 0, 60, 1)
+
+def bench_decode_1mb():
+	program = _get_program()
+	data = _get_slot_data(program.sweep_config.num_channels, 1000000)
+
+	def func():
+		SpectrumSensor._decode(program, data)
+
+	return func
+
+def _get_result():
+	program = _get_program()
+	data = _get_slot_data(program.sweep_config.num_channels, 1000000)
+	return SpectrumSensor._decode(program, data)
+
+def bench_result_get_data_1mb():
+	result = _get_result()
+
+	def func():
+		result.get_data()
+
+	return func
+
+def bench_result_write_1mb():
+	result = _get_result()
+
+	d = tempfile.mkdtemp()
+	atexit.register(shutil.rmtree, d)
+	path = os.path.join(d, "result.dat")
+
+	def func():
+		result.write(path)
+
+	return func
+
+class FakeSlotALH(object):
+	def __init__(self, data, chunk_size):
+		self.data = data
+
+		self.crcs = {}
+		for p in range(0, len(data), chunk_size):
+			chunk = data[p:p+chunk_size]
+			self.crcs[p] = struct.pack("<I", binascii.crc32(chunk) & 0xffffffff)
+
+	def get(self, resource, *args):
+		if resource == "sensing/slotInformation":
+			return ALHResponse(("status=COMPLETE,size=%d" % (len(self.data),)).encode('ascii'))
+
+		params = dict(arg.split("=") for arg in args[0].split("&"))
+		start = int(params['start'])
+		size = int(params['size'])
+
+		return ALHResponse(self.data[start:start+size] + self.crcs[start])
+
+class ConcatSpectrumSensor(SpectrumSensor):
+	def _read_slot(self, program, spool_dir=None):
+		total_size = self._get_slot_size(program)
+
+		data = b""
+		for p, chunk_data in self._iter_chunks(program, total_size):
+			data += chunk_data
+
+		return data
+
+def _bench_read_slot(size, cls=SpectrumSensor):
+	program = _get_program()
+	data = os.urandom(size)
+	sensor = cls(FakeSlotALH(data, SpectrumSensor.SLOT_CHUNK_SIZE))
+
+	def func():
+		sensor._read_slot(program)
+
+	return func
+
+def bench_read_slot_1mb_concat():
+	return _bench_read_slot(1000000, ConcatSpectrumSensor)
+
+def bench_read_slot_2mb_concat():
+	return _bench_read_slot(2000000, ConcatSpectrumSensor)
+
+def bench_read_slot_1mb():
+	return _bench_read_slot(1000000)
+
+def bench_read_slot_2mb():
+	return _bench_read_slot(2000000)
+
+def bench_read_slot_10mb():
+	return _bench_read_slot(10000000)
+
+def bench_read_slot_50mb():
+	return _bench_read_slot(50000000)
+
+class FakeSweepALH(object):
+	def __init__(self, num_channels):
+		rand = random.Random(42)
+		data = struct.pack("<%dh" % (num_channels,),
+				*[ rand.randint(-10000, -9000) for n in range(num_channels) ])
+		crc = binascii.crc32(data) & 0xffffffff
+		self.response = ALHResponse(data + struct.pack("<I", crc))
+
+	def post(self, resource, data, *args):
+		return self.response
+
+def bench_sweep_1000ch():
+	sweep_config = _get_sweep_config(1000)
+	sensor = SpectrumSensor(FakeSweepALH(1000))
+
+	def func():
+		sensor._sweep(sweep_config)
+
+	return func
+
+def bench_sweep_1000ch_raw():
+	sweep_config = _get_sweep_config(1000)
+	sensor = SpectrumSensor(FakeSweepALH(1000))
+
+	def func():
+		sensor._sweep(sweep_config, raw=True)
+
+	return func
+
+class FakeConfigListALH(object):
+	def __init__(self, num_devices, num_configs):
+		lines = []
+		for dev_id in range(num_devices):
+			lines.append("dev #%d, Device %d, %d configs:" % (dev_id, dev_id, num_configs))
+			for cfg_id in range(num_configs):
+				lines.append("  cfg #%d: Config %d:" % (cfg_id, cfg_id))
+				lines.append("     base: %d Hz, spacing: 1000 Hz, bw: 1000 Hz, "
+						"channels: 1000, time: 1 ms" % (2400000000 + cfg_id * 1000000,))
+
+		self.response = ALHResponse("\n".join(lines).encode('ascii'))
+
+	def get(self, resource, *args):
+		return self.response
+
+def bench_get_config_list_200():
+	sensor = SpectrumSensor(FakeConfigListALH(20, 10))
+
+	def func():
+		sensor.get_config_list()
+
+	return func
+
+if __name__ == "__main__":
+	common.main(globals())
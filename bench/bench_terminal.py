@@ -0,0 +1,69 @@
+# Throughput of reading responses in ALHTerminal from a fake serial port.
+#
+# "bytewise" benchmarks use the old implementation that read one byte at a
+# time and appended it to an immutable bytes object.
+#
+# Run with: python -m bench.bench_terminal
+
+from vesna.alh import ALHTerminal, TerminalError
+
+from bench import common
+
+class FakeSerial(object):
+	"""Fake serial port that answers each write with the same response."""
+	def __init__(self, response):
+		self.response = response
+		self.buf = b""
+		self.pos = 0
+
+	@property
+	def in_waiting(self):
+		return len(self.buf) - self.pos
+
+	def read(self, size=1):
+		r = self.buf[self.pos:self.pos+size]
+		self.pos += len(r)
+		return r
+
+	def write(self, data):
+		self.buf = self.response
+		self.pos = 0
+
+class BytewiseALHTerminal(ALHTerminal):
+	def _send(self, data):
+		self.f.write(data)
+
+		resp = b""
+		while not resp.endswith(self.RESPONSE_TERMINATOR):
+			d = self.f.read()
+			if d:
+				resp += d
+			else:
+				raise TerminalError
+
+		return resp[:-len(self.RESPONSE_TERMINATOR)]
+
+def _get_func(cls, size):
+	# binary payload, CRC and terminator, as returned by sensing/slotDataBinary
+	response = bytes(bytearray(n % 251 for n in range(size))) + b"\r\nOK\r\n"
+	alh = cls(FakeSerial(response))
+
+	def func():
+		alh._send(b"get sensing/slotDataBinary?id=1&start=0&size=512\r\n")
+
+	return func
+
+def bench_read_512b_bytewise():
+	return _get_func(BytewiseALHTerminal, 516)
+
+def bench_read_512b_buffered():
+	return _get_func(ALHTerminal, 516)
+
+def bench_read_64kb_bytewise():
+	return _get_func(BytewiseALHTerminal, 65536)
+
+def bench_read_64kb_buffered():
+	return _get_func(ALHTerminal, 65536)
+
+if __name__ == "__main__":
+	common.main(globals())
@@ -0,0 +1,44 @@
+# Parsing of UWB node measurement responses.
+#
+# The CIR benchmark parses a full 1016-point channel impulse response.
+#
+# Run with: python -m bench.bench_uwb
+
+import random
+import struct
+
+from vesna.alh.uwbnode import parseCIR2Complex, dataLineToDictionary
+
+from bench import common
+
+def bench_parse_cir_1016():
+	rand = random.Random(42)
+	data = b"".join(struct.pack(">hh", rand.randint(-2000, 2000), rand.randint(-2000, 2000))
+			for n in range(1016))
+
+	def func():
+		parseCIR2Complex(data)
+
+	return func
+
+def bench_data_line_to_dictionary():
+	line = ("SRC:0000000000000001\n"
+		"DEST:0000000000000002\n"
+		"DIST:012.5\n"
+		"FP_INDEX:745\n"
+		"FP_AMPL1:04512\n"
+		"FP_AMPL2:03315\n"
+		"FP_AMPL3:02211\n"
+		"CIR_PWR:08812\n"
+		"PRFR:64\n"
+		"RXPACC:01010\n"
+		"STD_NOISE:00032\n"
+		"MAX_NOISE:00521\n")
+
+	def func():
+		dataLineToDictionary(line)
+
+	return func
+
+if __name__ == "__main__":
+	common.main(globals())
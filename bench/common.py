@@ -0,0 +1,38 @@
+import sys
+import timeit
+
+def measure(func, repeat=5, min_time=0.2):
+	"""Return the best time per call of func in seconds.
+
+	The number of calls per measurement is increased until a single
+	measurement takes at least `min_time` seconds.
+	"""
+	number = 1
+	while True:
+		t = timeit.timeit(func, number=number)
+		if t >= min_time:
+			break
+
+		number *= 10
+
+	times = timeit.repeat(func, number=number, repeat=repeat)
+
+	return min(times) / number
+
+def get_benchmarks(namespace):
+	"""Return a sorted list of (name, function) pairs for all benchmarks
+	in the given namespace.
+
+	Benchmarks are functions with names starting with `bench_`. A benchmark
+	function performs any necessary set up and returns a function without
+	arguments that is timed.
+	"""
+	return sorted(	(name, func) for name, func in namespace.items()
+			if name.startswith("bench_") and callable(func) )
+
+def main(namespace):
+	for name, bench in get_benchmarks(namespace):
+		func = bench()
+		t = measure(func)
+
+		sys.stdout.write("%-40s %12.3f us\n" % (name, t*1e6))
@@ -0,0 +1,143 @@
+# Run the benchmark suite and compare results with recorded baselines.
+#
+# All bench_*.py modules in this directory are run, unless module names
+# are given on the command line. A single benchmark can be selected with
+# module.benchmark (for example bench_terminal.bench_read_512b_buffered).
+# A benchmark regresses if it is slower than its baseline by more than
+# the threshold. The exit status is 1 if any benchmark regressed.
+#
+# Baselines depend on the machine they were recorded on. Record new ones
+# before comparing results from a different machine.
+#
+# Run with: python -m bench.run [options] [module[.benchmark] ...]
+
+import json
+import os
+import pkgutil
+import platform
+import sys
+from optparse import OptionParser
+
+from bench import common
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+def get_modules():
+	return sorted(name for loader, name, ispkg in pkgutil.iter_modules([BENCH_DIR])
+			if name.startswith("bench_"))
+
+def run_module(module_name, repeat, min_time, bench_names=None):
+	module = __import__("bench." + module_name, fromlist=["*"])
+
+	results = []
+	for name, bench in common.get_benchmarks(vars(module)):
+		if bench_names is not None and name not in bench_names:
+			continue
+
+		func = bench()
+		t = common.measure(func, repeat=repeat, min_time=min_time)
+
+		results.append(("%s.%s" % (module_name, name), t))
+
+	return results
+
+def load_baseline(path):
+	try:
+		with open(path) as f:
+			return json.load(f)['benchmarks']
+	except IOError:
+		return {}
+
+def write_json(path, benchmarks):
+	d = {
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'benchmarks': benchmarks,
+	}
+
+	with open(path, "w") as f:
+		json.dump(d, f, indent=1, sort_keys=True)
+		f.write("\n")
+
+def main():
+	parser = OptionParser(usage="python -m bench.run [options] [module[.benchmark] ...]")
+	parser.add_option("-b", "--baseline", dest="baseline", metavar="PATH",
+			default=DEFAULT_BASELINE,
+			help="Compare with baselines in PATH [default: %default]")
+	parser.add_option("-t", "--threshold", dest="threshold", metavar="FRACTION",
+			type="float", default=0.25,
+			help="Report a regression if slower than baseline by more than FRACTION [default: %default]")
+	parser.add_option("-o", "--output", dest="output", metavar="PATH",
+			help="Write results as JSON to PATH")
+	parser.add_option("-s", "--save-baseline", dest="save_baseline", action="store_true",
+			help="Update baselines with results of this run")
+	parser.add_option("-r", "--repeat", dest="repeat", type="int", default=5,
+			help="Number of measurements for each benchmark [default: %default]")
+	parser.add_option("-m", "--min-time", dest="min_time", type="float", default=0.2,
+			help="Minimum time of a single measurement in seconds [default: %default]")
+
+	(options, args) = parser.parse_args()
+
+	# module name -> list of benchmark names, or None to run all
+	selected = {}
+	if args:
+		module_names = []
+		for arg in args:
+			module_name, sep, bench_name = arg.partition(".")
+			if module_name not in selected:
+				module_names.append(module_name)
+				selected[module_name] = []
+
+			if not bench_name:
+				selected[module_name] = None
+			elif selected[module_name] is not None:
+				selected[module_name].append(bench_name)
+	else:
+		module_names = get_modules()
+
+	baseline = load_baseline(options.baseline)
+
+	results = {}
+	regressions = []
+
+	for module_name in module_names:
+		for name, t in run_module(module_name, options.repeat, options.min_time,
+				selected.get(module_name)):
+			result = { 'time': t }
+
+			t0 = baseline.get(name)
+			if t0 is None:
+				status = "new"
+			else:
+				result['baseline'] = t0
+				result['ratio'] = t / t0
+
+				if t > t0 * (1. + options.threshold):
+					status = "REGRESSION"
+					regressions.append(name)
+				else:
+					status = "ok"
+
+			result['status'] = status
+			results[name] = result
+
+			if t0 is None:
+				sys.stdout.write("%-50s %12.3f us %10s %s\n" % (name, t*1e6, "", status))
+			else:
+				sys.stdout.write("%-50s %12.3f us %9.2fx %s\n" % (name, t*1e6, t/t0, status))
+
+	if options.output:
+		write_json(options.output, results)
+
+	if options.save_baseline:
+		baseline.update((name, result['time']) for name, result in results.items())
+		write_json(options.baseline, baseline)
+
+	if regressions:
+		sys.stdout.write("%d benchmarks regressed by more than %.0f%%\n" % (
+			len(regressions), options.threshold * 100))
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
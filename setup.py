@@ -27,5 +27,5 @@ setup(name='vesna-alhtools',
 
       install_requires = [ 'vesna-spectrumsensor', 'numpy', 'python-dateutil', 'lxml', 'requests' ],
 
-      test_suite = 'test',
+      test_suite = 'test.suite',
 )
@@ -0,0 +1,19 @@
+import os
+import sys
+import unittest
+
+# Test modules for code that requires Python 3.5 or newer. They can not
+# even be compiled by older versions.
+PY35_MODULES = [ "test_aio", "test_endpoint" ]
+
+def suite():
+	"""Return a suite with all tests that can run on this Python version.
+	"""
+	names = sorted(	f[:-3] for f in os.listdir(os.path.dirname(__file__))
+			if f.startswith("test_") and f.endswith(".py") )
+
+	if sys.version_info < (3, 5):
+		names = [ name for name in names if name not in PY35_MODULES ]
+
+	loader = unittest.TestLoader()
+	return loader.loadTestsFromNames([ __name__ + "." + name for name in names ])
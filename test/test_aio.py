@@ -0,0 +1,291 @@
+import asyncio
+import threading
+import unittest
+
+try:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from vesna.alh import aio
+from vesna.alh import CorruptedData, TerminalError
+
+def run(coro):
+	loop = asyncio.new_event_loop()
+	try:
+		return loop.run_until_complete(coro)
+	finally:
+		loop.close()
+
+class MockStream(object):
+	"""Pair of asyncio streams that answer each write with the next
+	response from a list."""
+	def __init__(self, reads):
+		self.reads = list(reads)
+		self.writes = []
+		self.reader = asyncio.StreamReader()
+
+	def write(self, d):
+		assert isinstance(d, bytes)
+		self.writes.append(d)
+
+		if self.reads:
+			self.reader.feed_data(self.reads.pop(0))
+		else:
+			self.reader.feed_eof()
+
+	async def drain(self):
+		pass
+
+	def close(self):
+		pass
+
+class TestAsyncALHTerminal(unittest.TestCase):
+
+	def _request(self, reads, method, *args):
+		async def f():
+			stream = MockStream(reads)
+			alh = aio.AsyncALHTerminal(stream.reader, stream)
+			r = await getattr(alh, method)(*args)
+			return r, stream.writes
+
+		return run(f())
+
+	def test_get_ascii(self):
+		r, writes = self._request([b"bar\r\nOK\r\n"], "get", "foo", "arg1")
+
+		self.assertEqual(r.text, "bar")
+		self.assertEqual(writes, [b"get foo?arg1\r\n"])
+
+	def test_post_ascii_retry(self):
+		r, writes = self._request([
+				b"CORRUPTED-DATA\r\n\r\nOK\r\n",
+				b"bar\r\nOK\r\n"], "post", "foo", "datadata", "arg1")
+
+		self.assertEqual(r.text, "bar")
+		self.assertEqual(writes,
+				[b"post foo?arg1\r\nlength=8\r\ndatadata\r\ncrc=417676333\r\n",
+				 b"post foo?arg1\r\nlength=8\r\ndatadata\r\ncrc=417676333\r\n"])
+
+	def test_post_ascii_recover(self):
+		r, writes = self._request([
+				b"JUNK-INPUT\r\n\r\nOK\r\n",
+				b"\r\nOK\r\n",
+				b"bar\r\nOK\r\n"], "post", "foo", "datadata", "arg1")
+
+		self.assertEqual(r.text, "bar")
+		self.assertEqual(writes,
+				[b"post foo?arg1\r\nlength=8\r\ndatadata\r\ncrc=417676333\r\n",
+				 b"\r\n\r\n\r\n\r\n\r\n",
+				 b"post foo?arg1\r\nlength=8\r\ndatadata\r\ncrc=417676333\r\n"])
+
+	def test_retries_exhausted(self):
+		reads = [b"CORRUPTED-DATA\r\n\r\nOK\r\n"] * 5
+		self.assertRaises(CorruptedData, self._request, reads, "get", "foo")
+
+	def test_hooks(self):
+		events = []
+
+		async def f():
+			stream = MockStream([
+				b"CORRUPTED-DATA\r\n\r\nOK\r\n",
+				b"bar\r\nOK\r\n"])
+			alh = aio.AsyncALHTerminal(stream.reader, stream)
+			alh.HOOKS = [events.append]
+			return await alh.get("foo", "arg1")
+
+		r = run(f())
+
+		self.assertEqual(r.text, "bar")
+		self.assertEqual(len(events), 1)
+
+		event = events[0]
+		self.assertEqual(event.method, "get")
+		self.assertEqual(event.node, None)
+		self.assertEqual(event.resource, b"foo")
+		self.assertEqual(event.bytes_out, 7)
+		self.assertEqual(event.bytes_in, 3)
+		self.assertEqual(event.retries, 1)
+		self.assertGreaterEqual(event.latency, 0.)
+
+class TestAsyncALHProxy(unittest.TestCase):
+	def test_post(self):
+		async def f():
+			stream = MockStream([b"Node #5 return;bar\r\nOK\r\n"])
+			coor = aio.AsyncALHTerminal(stream.reader, stream)
+			node = aio.AsyncALHProxy(coor, 5)
+
+			r = await node.post("foo", "data", "arg1")
+			return r, stream.writes
+
+		r, writes = run(f())
+
+		self.assertEqual(r.text, "bar")
+		self.assertEqual(writes,
+				[b"post nodes?5/foo?arg1\r\nlength=4\r\ndata\r\ncrc=883330991\r\n"])
+
+	def test_hooks(self):
+		events = []
+
+		async def f():
+			stream = MockStream([b"Node #5 return;bar\r\nOK\r\n"])
+			coor = aio.AsyncALHTerminal(stream.reader, stream)
+			coor.HOOKS = [events.append]
+			node = aio.AsyncALHProxy(coor, 5)
+			node.HOOKS = [events.append]
+
+			return await node.post("foo", "data")
+
+		run(f())
+
+		self.assertEqual(len(events), 1)
+		self.assertEqual(events[0].node, 5)
+		self.assertEqual(events[0].resource, b"foo")
+
+	def test_junk_state(self):
+		async def f():
+			stream = MockStream([
+				b"NODES:Node 5 parser is in junk state\r\nERROR\r\nOK\r\n",
+				b"\r\nOK\r\n",
+				b"bar\r\nOK\r\n"])
+			coor = aio.AsyncALHTerminal(stream.reader, stream)
+			coor.RETRIES = 1
+			node = aio.AsyncALHProxy(coor, 5)
+
+			try:
+				await node.get("foo")
+			except aio.ALHRandomError:
+				pass
+			else:
+				self.fail()
+
+			r = await node.get("foo")
+			return r, stream.writes
+
+		r, writes = run(f())
+
+		self.assertEqual(r.text, "bar")
+		self.assertEqual(writes[1][:30], b"post radio/noderesetparser?5\r\n")
+
+class TestAsyncALHWeb(unittest.TestCase):
+	def setUp(self):
+
+		self.paths = paths = []
+
+		class MockHTTPRequestHandler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				paths.append(self.path)
+
+				self.send_response(200)
+				self.end_headers()
+
+				self.wfile.write(b'\x00\x01bar')
+
+			def log_message(self, format, *args):
+				pass
+
+		server_address = ('localhost', 12347)
+		self.httpd = HTTPServer(server_address, MockHTTPRequestHandler)
+		self.t = threading.Thread(target=self.httpd.serve_forever)
+		self.t.start()
+
+	def tearDown(self):
+		self.httpd.shutdown()
+		self.t.join()
+		self.httpd.server_close()
+
+	def test_get(self):
+		async def f():
+			alh = aio.AsyncALHWeb("http://localhost:12347", "id")
+			rs = await asyncio.gather(alh.get("foo"), alh.get("bar"))
+			alh.close()
+			return rs
+
+		rs = run(f())
+
+		self.assertEqual([ r.content for r in rs ], [b'\x00\x01bar'] * 2)
+		self.assertEqual(sorted(self.paths), [
+			'/?method=get&resource=bar%3F&cluster=id',
+			'/?method=get&resource=foo%3F&cluster=id'])
+
+class TestAsyncALHWebReconnect(unittest.TestCase):
+
+	def _run(self, responses):
+		# Each connection answers the first request normally. The
+		# second request on the same connection gets the given response
+		# before the connection is closed.
+		requests = []
+
+		async def handle(reader, writer):
+			n = 0
+			while True:
+				try:
+					line = await reader.readuntil(b"\r\n\r\n")
+				except asyncio.IncompleteReadError:
+					break
+
+				requests.append(line.split(b" ")[1])
+
+				if n == 0:
+					writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nfoo")
+					await writer.drain()
+				else:
+					writer.write(responses.pop(0))
+					break
+
+				n += 1
+
+			writer.close()
+
+		async def f():
+			server = await asyncio.start_server(handle, "localhost", 0)
+			port = server.sockets[0].getsockname()[1]
+
+			alh = aio.AsyncALHWeb("http://localhost:%d" % (port,), "id", pool_size=1)
+			try:
+				r1 = await alh.get("foo")
+				try:
+					r2 = await alh.post("prog/doRestart", "1")
+				except TerminalError as e:
+					r2 = e
+			finally:
+				alh.close()
+				# let the handlers see the connections closed
+				await asyncio.sleep(.01)
+				server.close()
+				await server.wait_closed()
+
+			return r1, r2
+
+		r1, r2 = run(f())
+		self.assertEqual(r1.content, b"foo")
+
+		return r2, requests
+
+	def test_stale_connection(self):
+		r, requests = self._run([b""])
+
+		self.assertEqual(r.content, b"foo")
+		self.assertEqual(len(requests), 3)
+
+	def test_partial_response(self):
+		r, requests = self._run([b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nfo"])
+
+		# request might have been executed, so it must not be repeated
+		self.assertIsInstance(r, TerminalError)
+		self.assertEqual(len(requests), 2)
+
+	def test_connection_refused(self):
+		async def f():
+			server = await asyncio.start_server(lambda r, w: None, "localhost", 0)
+			port = server.sockets[0].getsockname()[1]
+			server.close()
+			await server.wait_closed()
+
+			alh = aio.AsyncALHWeb("http://localhost:%d" % (port,), "id")
+			try:
+				await alh.get("foo")
+			finally:
+				alh.close()
+
+		self.assertRaises(TerminalError, run, f())
@@ -1,6 +1,10 @@
+import numpy
+import os
+import shutil
+import struct
 import unittest
 
-from vesna.alh import CRCError
+from vesna.alh import CRCError, ALHRandomError
 from vesna.alh import ALHResponse
 from vesna.alh import signalgenerator
 from vesna.alh import cast_args_to_bytes
@@ -20,6 +24,38 @@ class TestMisc(unittest.TestCase):
 		t.get(b'test')
 		t.get(u'test')
 
+class TestALHResponse(unittest.TestCase):
+	def test_text(self):
+		r = ALHResponse(b"foo\xffbar")
+
+		self.assertIsNone(r._text)
+		self.assertEqual(r.text, "foo?bar")
+		self.assertEqual(str(r), "foo?bar")
+
+	def test_slots(self):
+		r = ALHResponse(b"foo")
+
+		self.assertRaises(AttributeError, setattr, r, "foo", 1)
+
+	def test_payload_trailer(self):
+		r = ALHResponse(b"foobar\x01\x02\x03\x04")
+
+		payload = r.get_payload()
+		trailer = r.get_trailer()
+
+		self.assertEqual(payload.tobytes(), b"foobar")
+		self.assertEqual(trailer.tobytes(), b"\x01\x02\x03\x04")
+		# memoryview on Python 2 does not expose the underlying object
+		if hasattr(payload, 'obj'):
+			self.assertIs(payload.obj, r.content)
+			self.assertIs(trailer.obj, r.content)
+
+	def test_payload_trailer_short(self):
+		r = ALHResponse(b"fo")
+
+		self.assertEqual(r.get_payload().tobytes(), b"")
+		self.assertEqual(r.get_trailer().tobytes(), b"fo")
+
 class TestSignalGenerator(unittest.TestCase):
 
 	def test_get_config_list(self):
@@ -115,6 +151,45 @@ class TestGeneratorConfigList(unittest.TestCase):
 from vesna.alh.spectrumsensor import SpectrumSensor, SpectrumSensorResult, SpectrumSensorProgram
 from vesna.spectrumsensor import Device, DeviceConfig, SweepConfig, Sweep
 
+def _decode_struct(program, data):
+	# Reference implementation of SpectrumSensor._decode() that decodes
+	# one value at a time.
+	num_channels = program.sweep_config.num_channels
+	line_bytes = num_channels * 2 + 4
+
+	result = SpectrumSensorResult(program)
+
+	sweep = Sweep()
+	for n in range(0, len(data), 2):
+		datum = data[n:n+2]
+		if len(datum) != 2:
+			continue
+
+		if n % line_bytes == 0:
+			# got a time-stamp
+			t = data[n:n+4]
+			tt = struct.unpack("<i", t)[0]
+			assert not sweep.data
+			sweep.timestamp = tt * 1e-3
+			continue
+
+		if n % line_bytes == 2:
+			# second part of a time-stamp, just ignore
+			assert not sweep.data
+			continue
+
+		dbm = struct.unpack("<h", datum)[0]*1e-2
+		sweep.data.append(dbm)
+
+		if len(sweep.data) >= num_channels:
+			result.sweeps.append(sweep)
+			sweep = Sweep()
+
+	if(sweep.data):
+		result.sweeps.append(sweep)
+
+	return result
+
 class TestSpectrumSensor(unittest.TestCase):
 
 	def test_get_config_list(self):
@@ -173,7 +248,7 @@ class TestSpectrumSensor(unittest.TestCase):
 
 		self.assertRaises(CRCError, s.get_config_list)
 
-	def _get_sc(self):
+	def _get_sc(self, stop_ch=3):
 		d = Device(0, "test")
 
 		dc = DeviceConfig(0, "foo", d)
@@ -182,7 +257,7 @@ class TestSpectrumSensor(unittest.TestCase):
 		dc.num = 1000
 		dc.time = 1
 
-		sc = SweepConfig(dc, 0, 3, 1)
+		sc = SweepConfig(dc, 0, stop_ch, 1)
 
 		return sc
 
@@ -213,11 +288,25 @@ class TestSpectrumSensor(unittest.TestCase):
 
 		self.assertEqual(r.data, [0., .01, .08])
 
+	def test_sweep_raw(self):
+		class MockALH(ALHProtocol):
+			def _post(self, resource, data, *args):
+				return b"\x00\x00\x01\x00\x02\x00D\xa4H;"
+
+		alh = MockALH()
+		ss = SpectrumSensor(alh)
+
+		sc = self._get_sc()
+		r = ss.sweep(sc, raw=True)
+
+		self.assertEqual(r.data.dtype, numpy.int16)
+		self.assertEqual(r.data.tolist(), [0, 1, 2])
+
 	def test_retrieve(self):
 		class MockALH(ALHProtocol):
 			def _get(self, resource, *args):
 				if b"Info" in resource:
-					return b"status=COMPLETE,size=14"
+					return b"status=COMPLETE,size=10"
 				else:
 					return b"\x00\x00\x00\x00\x00\x00\x01\x00\x02\x00\x91m\x00i"
 
@@ -233,6 +322,137 @@ class TestSpectrumSensor(unittest.TestCase):
 		self.assertEqual(r.sweeps[0].data, [0., .01, .02])
 		self.assertEqual(r.sweeps[0].timestamp, 0)
 
+	def _get_slot_alh(self, data, fail_after=None, short_chunk=None):
+		class MockALH(ALHProtocol):
+			def __init__(self):
+				self.chunks = 0
+				self.starts = []
+
+			def _get(self, resource, *args):
+				if b"Info" in resource:
+					return ("status=COMPLETE,size=%d" % (len(data),)).encode('ascii')
+				else:
+					if fail_after is not None and self.chunks >= fail_after:
+						raise TerminalError
+
+					self.chunks += 1
+
+					params = dict(arg.split(b"=") for arg in args[0].split(b"&"))
+					start = int(params[b"start"])
+					size = int(params[b"size"])
+					self.starts.append(start)
+
+					chunk = data[start:start+size]
+					if start == short_chunk:
+						chunk = chunk[:-1]
+					return chunk + struct.pack("<I", SpectrumSensor._crc32(chunk))
+
+		return MockALH()
+
+	def _get_slot_data(self, sc):
+		# sweeps cross chunk boundaries, last sweep is incomplete
+		fmt = "<i%dh" % (sc.num_channels,)
+		data = b"".join(struct.pack(fmt, n, *range(n, n + sc.num_channels))
+				for n in range(20))
+		return data[:-10]
+
+	def test_iter_retrieve(self):
+		sc = self._get_sc(100)
+		p = SpectrumSensorProgram(sc, 0, 10, 1)
+
+		data = self._get_slot_data(sc)
+
+		alh = self._get_slot_alh(data)
+		ss = SpectrumSensor(alh)
+
+		it = ss.iter_retrieve(p)
+		first = next(it)
+		self.assertEqual(alh.chunks, 1)
+
+		sweeps = [first] + list(it)
+		self.assertEqual(alh.chunks, (len(data) + 511) // 512)
+
+		r = ss.retrieve(p)
+
+		self.assertEqual(len(sweeps), 20)
+		self.assertEqual(
+			[ (sweep.timestamp, sweep.data) for sweep in sweeps ],
+			[ (sweep.timestamp, sweep.data) for sweep in r.sweeps ])
+		self.assertEqual(len(sweeps[-1].data), sc.num_channels - 5)
+
+	def test_retrieve_short_chunk(self):
+		sc = self._get_sc(100)
+		p = SpectrumSensorProgram(sc, 0, 10, 1)
+
+		data = self._get_slot_data(sc)
+
+		ss = SpectrumSensor(self._get_slot_alh(data, short_chunk=512))
+		self.assertRaises(CRCError, ss.retrieve, p)
+
+		ss = SpectrumSensor(self._get_slot_alh(data, short_chunk=512))
+		self.assertRaises(CRCError, list, ss.iter_retrieve(p))
+
+	def test_retrieve_spooled(self):
+		sc = self._get_sc(100)
+		p = SpectrumSensorProgram(sc, 0, 10, 1)
+
+		data = self._get_slot_data(sc)
+		num_chunks = (len(data) + 511) // 512
+
+		spool_dir = tempfile.mkdtemp()
+		try:
+			alh = self._get_slot_alh(data, fail_after=3)
+			ss = SpectrumSensor(alh)
+			self.assertRaises(TerminalError, ss.retrieve, p, spool_dir=spool_dir)
+			self.assertEqual(len(os.listdir(spool_dir)), 2)
+
+			alh = self._get_slot_alh(data)
+			ss = SpectrumSensor(alh)
+			r = ss.retrieve(p, spool_dir=spool_dir)
+
+			self.assertEqual(alh.starts, [ n * 512 for n in range(3, num_chunks) ])
+			self.assertEqual(os.listdir(spool_dir), [])
+		finally:
+			shutil.rmtree(spool_dir)
+
+		r0 = SpectrumSensor(self._get_slot_alh(data)).retrieve(p)
+
+		self.assertEqual(len(r.sweeps), 20)
+		self.assertEqual(
+			[ (sweep.timestamp, sweep.data) for sweep in r.sweeps ],
+			[ (sweep.timestamp, sweep.data) for sweep in r0.sweeps ])
+
+	def test_iter_retrieve_empty(self):
+		alh = self._get_slot_alh(b"")
+		ss = SpectrumSensor(alh)
+
+		p = SpectrumSensorProgram(self._get_sc(), 0, 10, 1)
+
+		self.assertEqual(list(ss.iter_retrieve(p)), [])
+
+	def test_decode_parity(self):
+		sc = self._get_sc()
+		p = SpectrumSensorProgram(sc, 0, 10, 1)
+
+		line = struct.pack("<i%dh" % (sc.num_channels,), 1234, -10000, 1, 32767)
+		data = line * 10
+
+		# full sweeps and a trailing partial sweep
+		for size in (0, len(line), len(data), len(data) - 1, len(data) - 2, len(data) - 5):
+			r1 = _decode_struct(p, data[:size])
+			r2 = SpectrumSensor._decode(p, data[:size])
+
+			self.assertEqual(
+				[ (sweep.timestamp, sweep.data) for sweep in r1.sweeps ],
+				[ (sweep.timestamp, sweep.data) for sweep in r2.sweeps ])
+
+		r = SpectrumSensor._decode(p, data[:-2])
+		self.assertEqual(len(r.sweeps), 10)
+		self.assertEqual(r.sweeps[-1].timestamp, 1.234)
+		self.assertEqual(r.sweeps[-2].data, [-100., .01, 327.67])
+		self.assertEqual(r.sweeps[-1].data, [-100., .01])
+		self.assertIsInstance(r.sweeps[-1].data[0], float)
+
 import tempfile
 
 class TestSpectrumSensorResult(unittest.TestCase):
@@ -302,12 +522,122 @@ class TestALHProtocol(unittest.TestCase):
 	def test_is_printable_3(self):
 		self.assertEqual(ALHProtocol._is_printable(u"\x8f".encode('latin2')), False)
 
+	def _get_log(self, alh, func, *args):
+		import logging
+
+		records = []
+
+		class Handler(logging.Handler):
+			def emit(self, record):
+				records.append(record.getMessage())
+
+		logger = logging.getLogger("vesna.alh")
+		handler = Handler()
+
+		old_level = logger.level
+		logger.addHandler(handler)
+		logger.setLevel(logging.INFO)
+		try:
+			func(*args)
+		finally:
+			logger.removeHandler(handler)
+			logger.setLevel(old_level)
+
+		return records
+
+	def test_log_response(self):
+		alh = ALHProtocol()
+
+		self.assertEqual(self._get_log(alh, alh._log_response, b"foo\r\n"),
+				["response: foo"])
+		self.assertEqual(self._get_log(alh, alh._log_response, b"\x00foo"),
+				["unprintable response (4 bytes)"])
+
+	def test_log_response_limit(self):
+		alh = ALHProtocol()
+		alh.LOG_PAYLOAD_LIMIT = 3
+
+		self.assertEqual(self._get_log(alh, alh._log_response, b"foobar"),
+				["response: foo... (6 bytes)"])
+
+	def test_log_response_sample(self):
+		alh = ALHProtocol()
+		alh.LOG_PAYLOAD_SAMPLE = 0.0
+
+		self.assertEqual(self._get_log(alh, alh._log_response, b"foobar"),
+				["response: (6 bytes)"])
+
+	def test_log_request(self):
+		alh = ALHProtocol()
+
+		self.assertEqual(self._get_log(alh, alh._log_request, "POST", b"foo", [b"bar"], b"data1"), [
+			"    POST: foo?bar",
+			"    DATA: data1"])
+
+	def test_log_disabled(self):
+		alh = ALHProtocol()
+
+		def is_printable(data):
+			self.fail()
+
+		alh._is_printable = is_printable
+
+		import logging
+
+		logger = logging.getLogger("vesna.alh")
+
+		old_level = logger.level
+		logger.setLevel(logging.WARNING)
+		try:
+			alh._log_request("POST", b"foo", [b"bar"], b"data1")
+			alh._log_response(b"foo")
+		finally:
+			logger.setLevel(old_level)
+
+	def test_sneaky_error(self):
+		alh = ALHProtocol()
+
+		self.assertRaises(ALHRandomError, alh._check_for_sneaky_error, b"foo\r\nERROR")
+		self.assertRaises(ALHRandomError, alh._check_for_sneaky_error, b"Warning: foo")
+		alh._check_for_sneaky_error(b"foo")
+
+	def test_sneaky_error_ignore(self):
+		alh = ALHProtocol()
+
+		alh._check_for_sneaky_error(b"Temperature  : 40 C\r\nBus errors  : 0\r\n")
+		alh._check_for_sneaky_error(b"Status   : 0 (error)\r\n")
+		self.assertRaises(ALHRandomError, alh._check_for_sneaky_error,
+				b"Bus errors  : 0\r\nERROR")
+
+	def test_sneaky_error_binary(self):
+		alh = ALHProtocol()
+
+		data = b"\x00\xffERROR\x01\x02"
+		self.assertRaises(ALHRandomError, alh._check_for_sneaky_error, data)
+		alh._check_for_sneaky_error(data, binary=True)
+
+		self.assertRaises(ALHRandomError, alh._check_for_sneaky_error,
+				b"NODES:Node 5 parser is in junk state\r\nERROR", binary=True)
+
+		# only the trailer is checked in binary responses
+		data = b"\x00ERROR\x00" + b"a" * alh.BINARY_TRAILER_SIZE
+		alh._check_for_sneaky_error(data, binary=True)
+
+	def test_is_binary_resource(self):
+		alh = ALHProtocol()
+
+		self.assertTrue(alh._is_binary_resource(b"sensing/slotDataBinary", (b"id=1",)))
+		self.assertTrue(alh._is_binary_resource(b"nodes", (b"5/sensing/quickSweepBin?",)))
+		self.assertFalse(alh._is_binary_resource(b"nodes", (b"5/hello?",)))
+		self.assertFalse(alh._is_binary_resource(b"hello", ()))
+
 try:
 	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 except ImportError:
 	from http.server import HTTPServer, BaseHTTPRequestHandler
 
 import threading
+import time
 from vesna.alh import ALHWeb
 
 class TestALHWeb(unittest.TestCase):
@@ -358,7 +688,143 @@ class TestALHWeb(unittest.TestCase):
 
 		self.assertEqual(r.content, self.srv_response[0])
 
-from vesna.alh import ALHTerminal
+	def test_shared_pool(self):
+		alh1 = ALHWeb("http://localhost:12345", "id1")
+		alh2 = ALHWeb("http://localhost:12345", "id2")
+		alh3 = ALHWeb("http://example.com", "id1")
+
+		self.assertIs(alh1.session_pool, alh2.session_pool)
+		self.assertIsNot(alh1.session_pool, alh3.session_pool)
+
+try:
+	from SocketServer import ThreadingMixIn
+except ImportError:
+	from socketserver import ThreadingMixIn
+
+from vesna.alh import ALHSessionPool
+
+class TestALHSessionPool(unittest.TestCase):
+	def setUp(self):
+
+		self.clients = clients = set()
+
+		class MockHTTPRequestHandler(BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+
+			def do_GET(self):
+				clients.add(self.client_address)
+
+				self.send_response(200)
+				self.send_header("Content-Length", "3")
+				self.end_headers()
+
+				self.wfile.write(b"bar")
+
+			def log_message(self, format, *args):
+				pass
+
+		class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+			daemon_threads = True
+
+		server_address = ('localhost', 12346)
+		self.httpd = ThreadingHTTPServer(server_address, MockHTTPRequestHandler)
+		self.t = threading.Thread(target=self.httpd.serve_forever)
+		self.t.start()
+
+	def tearDown(self):
+		self.httpd.shutdown()
+		self.t.join()
+		self.httpd.server_close()
+
+	def test_keep_alive(self):
+		pool = ALHSessionPool()
+		alh = ALHWeb("http://localhost:12346", "id", session_pool=pool)
+
+		for n in range(3):
+			r = alh.get("foo")
+			self.assertEqual(r.text, "bar")
+
+		pool.close()
+
+		self.assertEqual(len(self.clients), 1)
+
+	def test_idle_timeout(self):
+		pool = ALHSessionPool(idle_timeout=0.0)
+		alh = ALHWeb("http://localhost:12346", "id", session_pool=pool)
+
+		for n in range(3):
+			time.sleep(.01)
+			alh.get("foo")
+
+		pool.close()
+
+		self.assertEqual(len(self.clients), 3)
+
+	def test_get_shared(self):
+		pool1 = ALHSessionPool.get_shared("test-key", pool_size=2)
+		pool2 = ALHSessionPool.get_shared("test-key")
+
+		self.assertIs(pool1, pool2)
+		self.assertEqual(pool1.pool_size, 2)
+
+from vesna.alh import ALHBackoff, CommunicatorBusy
+
+class TestALHWebBusy(unittest.TestCase):
+	def _get_alh(self, responses, **kwargs):
+		class MockALHWeb(ALHWeb):
+			def _send(self, params):
+				return responses.pop(0)
+
+		return MockALHWeb("http://localhost", "id",
+				backoff=ALHBackoff(initial_delay=.01, **kwargs))
+
+	def test_busy(self):
+		alh = self._get_alh([
+			b"ERROR: Communication in progress",
+			b"ERROR: Communication in progress\r\n",
+			b"bar"])
+
+		r = alh.get("foo")
+
+		self.assertEqual(r.text, "bar")
+		self.assertEqual(alh.busy_requests, 1)
+		self.assertGreaterEqual(alh.busy_time, .02)
+
+	def test_not_busy(self):
+		alh = self._get_alh([b"bar"])
+
+		alh.get("foo")
+
+		self.assertEqual(alh.busy_requests, 0)
+		self.assertEqual(alh.busy_time, 0.)
+
+	def test_deadline(self):
+		alh = self._get_alh([b"ERROR: Communication in progress"] * 10,
+				factor=1., jitter=0., deadline=.035)
+
+		self.assertRaises(CommunicatorBusy, alh.get, "foo")
+		self.assertEqual(alh.busy_requests, 1)
+
+class TestALHBackoff(unittest.TestCase):
+	def test_delays(self):
+		backoff = ALHBackoff(initial_delay=1., factor=2., max_delay=5., jitter=0.)
+		state = backoff.start()
+
+		delays = [ state.next_delay() for n in range(5) ]
+
+		self.assertEqual(delays, [1., 2., 4., 5., 5.])
+		self.assertEqual(state.retries, 5)
+
+	def test_jitter(self):
+		backoff = ALHBackoff(initial_delay=1., jitter=.5)
+		state = backoff.start()
+
+		for n in range(100):
+			delay = state.next_delay()
+			self.assertGreaterEqual(delay, .5)
+			self.assertLessEqual(delay, 7.5)
+
+from vesna.alh import ALHTerminal, TerminalError
 
 class TestALHTerminal(unittest.TestCase):
 	def setUp(self):
@@ -421,3 +887,258 @@ class TestALHTerminal(unittest.TestCase):
 				[b"post foo?arg1\r\nlength=8\r\ndatadata\r\ncrc=417676333\r\n",
 				 b"\r\n\r\n\r\n\r\n\r\n",
 				 b"post foo?arg1\r\nlength=8\r\ndatadata\r\ncrc=417676333\r\n"])
+
+	def test_get_split_terminator(self):
+		self.serial.reads.append(b"bar\r\n")
+		self.serial.reads.append(b"O")
+		self.serial.reads.append(b"K\r\nbaz\r\nOK\r\n")
+
+		r = self.alh.get("foo")
+		self.assertEqual(r.text, "bar")
+
+		r = self.alh.get("foo")
+		self.assertEqual(r.text, "baz")
+
+	def test_get_closed(self):
+		self.serial.reads.append(b"bar\r\n")
+		self.serial.reads.append(b"")
+
+		self.assertRaises(TerminalError, self.alh.get, "foo")
+
+	def test_write_error(self):
+		write = self.serial.write
+
+		def write_error(d):
+			self.serial.write = write
+			raise IOError
+
+		self.serial.write = write_error
+		self.serial.reads.append(b"bar\r\nOK\r\n")
+
+		self.assertRaises(IOError, self.alh.get, "foo")
+
+		# must not wait for a response to the failed request
+		t = threading.Thread(target=self.alh.get, args=("foo",))
+		t.daemon = True
+		t.start()
+		t.join(5.)
+
+		self.assertFalse(t.is_alive())
+		self.assertEqual(self.serial.writes, [b"get foo?\r\n"])
+
+class TestALHTerminalBuffered(unittest.TestCase):
+	def setUp(self):
+
+		class MockSerial(object):
+			def __init__(self):
+				self.buf = b""
+				self.read_sizes = []
+
+			@property
+			def in_waiting(self):
+				return len(self.buf)
+
+			def read(self, size=1):
+				self.read_sizes.append(size)
+
+				r = self.buf[:size]
+				self.buf = self.buf[size:]
+				return r
+
+			def write(self, d):
+				pass
+
+		self.serial = MockSerial()
+
+	def test_get(self):
+		alh = ALHTerminal(self.serial, recv_buffer_size=16)
+
+		resp = b"x" * 40
+		self.serial.buf = resp + b"\r\nOK\r\n"
+
+		r = alh.get("foo")
+
+		self.assertEqual(r.content, resp)
+		self.assertEqual(self.serial.read_sizes, [16, 16, 14])
+
+	def test_get_empty(self):
+		alh = ALHTerminal(self.serial)
+
+		self.assertRaises(TerminalError, alh.get, "foo")
+		self.assertEqual(self.serial.read_sizes, [1])
+
+class MockPipelinedDevice(object):
+	"""Serial device that answers requests as soon as they are written and
+	goes into junk state on the first request containing "bad"."""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.buf = b""
+		self.junk = False
+		self.junk_triggered = False
+		self.recoveries = 0
+
+	@property
+	def in_waiting(self):
+		with self.lock:
+			return len(self.buf)
+
+	def read(self, size=1):
+		with self.lock:
+			r = self.buf[:size]
+			self.buf = self.buf[size:]
+			return r
+
+	def write(self, d):
+		with self.lock:
+			if d == b"\r\n" * 5:
+				self.junk = False
+				self.recoveries += 1
+				resp = b""
+			elif self.junk:
+				resp = b"JUNK-INPUT\r\n"
+			elif b"bad" in d and not self.junk_triggered:
+				self.junk = True
+				self.junk_triggered = True
+				resp = b"JUNK-INPUT\r\n"
+			else:
+				resp = d.split(b"?")[1].strip()
+
+			self.buf += resp + b"\r\nOK\r\n"
+
+class TestALHTerminalPipelined(unittest.TestCase):
+	def setUp(self):
+		self.device = MockPipelinedDevice()
+		self.alh = ALHTerminal(self.device, pipeline_depth=4)
+
+		self.errors = []
+
+	def _worker(self, name):
+		try:
+			for n in range(20):
+				arg = "%s-%d" % (name, n)
+				r = self.alh.get("foo", arg)
+				assert r.text == arg
+		except Exception as e:
+			self.errors.append(e)
+
+	def _run(self, names):
+		threads = [ threading.Thread(target=self._worker, args=(name,)) for name in names ]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(self.errors, [])
+
+	def test_get(self):
+		self._run([ "t%d" % (n,) for n in range(8) ])
+
+		self.assertEqual(self.alh._tx_seq, 160)
+		self.assertEqual(self.alh._rx_seq, 160)
+
+	def test_recover(self):
+		self._run([ "t%d" % (n,) for n in range(4) ] + [ "bad" ])
+
+		self.assertTrue(self.device.junk_triggered)
+		self.assertGreaterEqual(self.device.recoveries, 1)
+
+from vesna.alh import ALHProxy, ALHCircuitBreaker, NodeUnavailable
+from vesna.alh import JunkInput, CorruptedData
+
+class TestALHCircuitBreaker(unittest.TestCase):
+	def setUp(self):
+		self.now = [0.]
+		self.breaker = ALHCircuitBreaker(failure_threshold=2, cooldown=10.,
+				clock=lambda: self.now[0])
+
+		self.responses = responses = []
+		self.requests = requests = []
+
+		class MockCoordinator(ALHProtocol):
+			def _get(self, resource, *args):
+				requests.append(args[0])
+
+				r = responses.pop(0)
+				if isinstance(r, Exception):
+					raise r
+				else:
+					return r
+
+		self.coor = MockCoordinator()
+		self.node = ALHProxy(self.coor, 5, circuit_breaker=self.breaker)
+
+	def test_open(self):
+		self.responses.extend([ALHRandomError(b"timeout")] * 2)
+
+		for n in range(2):
+			self.assertRaises(ALHRandomError, self.node.get, "foo")
+
+		self.assertEqual(self.breaker.state, "open")
+
+		self.assertRaises(NodeUnavailable, self.node.get, "foo")
+		self.assertEqual(len(self.requests), 2)
+
+	def test_success_resets(self):
+		self.responses.extend([ALHRandomError(b"timeout"), b"bar", ALHRandomError(b"timeout")])
+
+		self.assertRaises(ALHRandomError, self.node.get, "foo")
+		self.node.get("foo")
+		self.assertRaises(ALHRandomError, self.node.get, "foo")
+
+		self.assertEqual(self.breaker.state, "closed")
+		self.assertEqual(self.breaker.get_state()['failures'], 1)
+
+	def test_other_errors(self):
+		self.responses.extend([TerminalError("oops")] * 2)
+
+		for n in range(2):
+			self.assertRaises(TerminalError, self.node.get, "foo")
+
+		self.assertEqual(self.breaker.state, "closed")
+
+	def test_half_open(self):
+		self.responses.extend([ALHRandomError(b"timeout")] * 3 + [b"bar"])
+
+		for n in range(2):
+			self.assertRaises(ALHRandomError, self.node.get, "foo")
+
+		self.now[0] = 10.
+		self.assertEqual(self.breaker.state, "half-open")
+
+		# failed trial request opens the breaker again
+		self.assertRaises(ALHRandomError, self.node.get, "foo")
+		self.assertEqual(self.breaker.state, "open")
+		self.assertRaises(NodeUnavailable, self.node.get, "foo")
+
+		self.now[0] = 20.
+		self.assertEqual(self.node.get("foo").text, "bar")
+		self.assertEqual(self.breaker.state, "closed")
+
+	def test_protocol_errors(self):
+		self.responses.extend([JunkInput(b"junk"), CorruptedData(b"corrupt")] * 2)
+
+		self.assertRaises(JunkInput, self.node.get, "foo")
+		self.assertRaises(CorruptedData, self.node.get, "foo")
+		self.assertRaises(JunkInput, self.node.get, "foo")
+
+		self.assertEqual(self.breaker.state, "closed")
+		self.assertEqual(self.breaker.get_state()['failures'], 0)
+
+	def test_shared(self):
+		node1 = ALHProxy(self.coor, 5, circuit_breaker=True)
+		node2 = ALHProxy(self.coor, 5, circuit_breaker=True)
+		node3 = ALHProxy(self.coor, 6, circuit_breaker=True)
+
+		self.assertIs(node1.circuit_breaker, node2.circuit_breaker)
+		self.assertIsNot(node1.circuit_breaker, node3.circuit_breaker)
+
+		breakers = ALHCircuitBreaker.get_all_shared(self.coor)
+		self.assertEqual(sorted(breakers), [5, 6])
+
+	def test_disabled(self):
+		node = ALHProxy(self.coor, 5)
+		self.assertIsNone(node.circuit_breaker)
+
+		self.responses.extend([ALHRandomError(b"timeout")] * 5)
+		for n in range(5):
+			self.assertRaises(ALHRandomError, node.get, "foo")
@@ -0,0 +1,112 @@
+import unittest
+
+from vesna.alh import ALHProtocol, ALHProxy
+from vesna.alh.cache import ALHCache, TTLCache
+
+class MockALH(ALHProtocol):
+	def __init__(self):
+		self.requests = []
+
+	def _get(self, resource, *args):
+		self.requests.append(("get", resource) + args)
+		return b"response %d" % (len(self.requests),)
+
+	def _post(self, resource, data, *args):
+		self.requests.append(("post", resource) + args)
+		return b"ok"
+
+class TestTTLCache(unittest.TestCase):
+	def setUp(self):
+		self.now = [0.]
+		self.cache = TTLCache(max_entries=2, clock=lambda: self.now[0])
+
+	def test_expiry(self):
+		self.cache.set("foo", 1, 10)
+
+		self.now[0] = 9.
+		self.assertEqual(self.cache.get("foo"), 1)
+
+		self.now[0] = 10.
+		self.assertEqual(self.cache.get("foo"), None)
+
+		self.assertEqual(self.cache.hits, 1)
+		self.assertEqual(self.cache.misses, 1)
+
+	def test_lru(self):
+		self.cache.set("foo", 1, 10)
+		self.cache.set("bar", 2, 10)
+		self.cache.get("foo")
+		self.cache.set("baz", 3, 10)
+
+		self.assertEqual(self.cache.get("foo"), 1)
+		self.assertEqual(self.cache.get("bar"), None)
+		self.assertEqual(self.cache.get("baz"), 3)
+		self.assertEqual(self.cache.evictions, 1)
+
+	def test_invalidate(self):
+		self.cache.set("foo", 1, 10)
+		self.cache.set("bar", 2, 10)
+
+		self.cache.invalidate(lambda key: key == "foo")
+
+		self.assertEqual(self.cache.get("foo"), None)
+		self.assertEqual(self.cache.get("bar"), 2)
+		self.assertEqual(self.cache.invalidations, 1)
+
+class TestALHCache(unittest.TestCase):
+	def setUp(self):
+		self.alh = MockALH()
+		self.cache = ALHCache(self.alh)
+
+	def test_get_cached(self):
+		r1 = self.cache.get("hello")
+		r2 = self.cache.get("hello")
+
+		self.assertEqual(r1.text, "response 1")
+		self.assertEqual(r2.text, "response 1")
+		self.assertEqual(len(self.alh.requests), 1)
+
+		stats = self.cache.get_stats()
+		self.assertEqual(stats['hits'], 1)
+		self.assertEqual(stats['misses'], 1)
+
+	def test_get_not_cached(self):
+		self.cache.get("sensing/slotInformation", "id=1")
+		self.cache.get("sensing/slotInformation", "id=1")
+
+		self.assertEqual(len(self.alh.requests), 2)
+
+	def test_proxy(self):
+		node1 = ALHProxy(self.cache, 1)
+		node2 = ALHProxy(self.cache, 2)
+
+		self.assertEqual(node1.get("hello").text, "response 1")
+		self.assertEqual(node2.get("hello").text, "response 2")
+		self.assertEqual(node1.get("hello").text, "response 1")
+
+		node1.post("prog/doRestart", "1")
+
+		self.assertEqual(node1.get("hello").text, "response 4")
+		self.assertEqual(node2.get("hello").text, "response 2")
+
+	def test_invalidate_same_resource(self):
+		self.cache.get("radio/settings")
+		self.cache.get("hello")
+
+		self.cache.post("radio/settings", "ch=1")
+
+		self.cache.get("radio/settings")
+		self.cache.get("hello")
+
+		self.assertEqual(self.alh.requests, [
+			("get", b"radio/settings"),
+			("get", b"hello"),
+			("post", b"radio/settings"),
+			("get", b"radio/settings")])
+
+	def test_invalidate(self):
+		self.cache.get("hello")
+		self.cache.invalidate("hello")
+		self.cache.get("hello")
+
+		self.assertEqual(len(self.alh.requests), 2)
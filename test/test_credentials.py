@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from vesna.alh.credentials import ALHRCCredentials
+
+class TestALHRCCredentials(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path1 = os.path.join(self.dir, "alhrc1")
+		self.path2 = os.path.join(self.dir, "alhrc2")
+
+		self._write(self.path1,
+				"# comment\n"
+				"Host example.com\n"
+				"User foo\n"
+				"Password bar\n"
+				"Host example.org\n"
+				"User baz\n")
+
+		self._write(self.path2,
+				"Host example.com\n"
+				"User foo2\n"
+				"Password bar2\n"
+				"Host example.org\n"
+				"User baz\n"
+				"Password quux\n")
+
+		self.creds = ALHRCCredentials([self.path1, self.path2], check_interval=0)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def _write(self, path, contents, mtime=None):
+		with open(path, "w") as f:
+			f.write(contents)
+
+		if mtime is not None:
+			os.utime(path, (mtime, mtime))
+
+	def test_get(self):
+		self.assertEqual(self.creds.get("example.com"), ("foo", "bar"))
+		self.assertEqual(self.creds.get("example.org"), ("baz", "quux"))
+		self.assertEqual(self.creds.get("example.net"), None)
+
+	def test_missing_file(self):
+		creds = ALHRCCredentials([os.path.join(self.dir, "missing"), self.path1])
+
+		self.assertEqual(creds.get("example.com"), ("foo", "bar"))
+
+	def test_cached(self):
+		self.creds.get("example.com")
+
+		calls = [0]
+		orig_parse_all = self.creds._parse_all
+		def parse_all():
+			calls[0] += 1
+			return orig_parse_all()
+		self.creds._parse_all = parse_all
+
+		for n in range(10):
+			self.creds.get("example.com")
+
+		self.assertEqual(calls[0], 0)
+
+	def test_reload_on_change(self):
+		self.assertEqual(self.creds.get("example.com"), ("foo", "bar"))
+
+		self._write(self.path1,
+				"Host example.com\n"
+				"User foo3\n"
+				"Password bar3\n", mtime=1000000)
+
+		self.assertEqual(self.creds.get("example.com"), ("foo3", "bar3"))
+
+	def test_set(self):
+		self.creds.set("example.com", "user", "passwd")
+		self.assertEqual(self.creds.get("example.com"), ("user", "passwd"))
+
+		self.creds.remove("example.com")
+		self.assertEqual(self.creds.get("example.com"), ("foo", "bar"))
@@ -0,0 +1,129 @@
+import threading
+import time
+import unittest
+
+from vesna.alh import ALHProxy, ALHWeb, ALHBackoff, ALHRandomError
+from vesna.alh.emulator import EmulatedNode, EmulatedCoordinator, EmulatorServer
+from vesna.alh.spectrumsensor import SpectrumSensor, SpectrumSensorProgram
+from vesna.alh.signalgenerator import SignalGenerator
+
+class TestEmulatedCoordinator(unittest.TestCase):
+	def setUp(self):
+		self.now = [1000.]
+		clock = lambda: self.now[0]
+
+		self.coor = EmulatedCoordinator([
+			EmulatedNode(2, neighbors=[3], clock=clock),
+			EmulatedNode(3, hops=2, neighbors=[2], clock=clock)])
+		self.node = ALHProxy(self.coor, 2)
+
+	def test_hello(self):
+		self.assertEqual(self.coor.get("hello").text, "EmulatedCoordinator version 2.50")
+		self.assertEqual(self.node.get("hello").text, "EmulatedNode version 2.50")
+
+	def test_uptime(self):
+		self.now[0] += 10
+		self.assertEqual(self.node.get("uptime").text, "10")
+
+	def test_neighbors(self):
+		resp = self.node.get("radio/neighbors").text
+
+		addrs = []
+		for line in resp.split("\r\n"):
+			fields = line.split(" | ")
+			self.assertEqual(len(fields), 6)
+			try:
+				addrs.append(int(fields[3]))
+			except ValueError:
+				pass
+
+		self.assertEqual(addrs, [3])
+
+	def test_post(self):
+		self.assertEqual(self.node.post("prog/firstCall", "1").text, "OK")
+
+	def test_unknown_resource(self):
+		self.node.RETRIES = 1
+		self.assertRaises(ALHRandomError, self.node.get, "foo")
+
+	def test_unknown_node(self):
+		self.coor.loss_timeout = 0.
+		self.assertRaises(ALHRandomError, ALHProxy(self.coor, 4).get, "hello")
+
+	def test_loss(self):
+		self.coor.loss = 1.
+		self.coor.loss_timeout = 0.
+
+		self.assertRaises(ALHRandomError, self.node.get, "hello")
+		self.assertEqual(self.coor.lost_requests, self.coor.RETRIES)
+
+	def test_hop_latency(self):
+		self.coor.hop_latency = .01
+
+		time_start = time.time()
+		ALHProxy(self.coor, 3).get("hello")
+
+		self.assertGreaterEqual(time.time() - time_start, .02)
+
+	def test_spectrum_sensor(self):
+		sensor = SpectrumSensor(self.node)
+
+		config_list = sensor.get_config_list()
+		sweep_config = config_list.get_sweep_config(2400e6, 2410e6, 1e6)
+
+		sweep = sensor.sweep(sweep_config)
+		self.assertEqual(len(sweep.data), sweep_config.num_channels)
+
+		program = SpectrumSensorProgram(sweep_config, time.time() + 5, 1, 1)
+		sensor.program(program)
+
+		self.now[0] += 10
+
+		result = sensor.retrieve(program)
+
+		self.assertEqual(len(result.sweeps), 91)
+		self.assertEqual(result.sweeps[1].timestamp, .011)
+		for sweep in result.sweeps:
+			self.assertEqual(len(sweep.data), sweep_config.num_channels)
+
+	def test_signal_generator(self):
+		generator = SignalGenerator(self.node)
+
+		config_list = generator.get_config_list()
+		self.assertEqual(len(config_list.configs), 1)
+
+class TestEmulatorServer(unittest.TestCase):
+	def setUp(self):
+		self.coor = EmulatedCoordinator([EmulatedNode(2)], hop_latency=.01)
+		self.server = EmulatorServer(self.coor)
+		self.server.start()
+
+	def tearDown(self):
+		self.server.stop()
+
+	def _get_alh(self):
+		return ALHWeb(self.server.url, 10001,
+				backoff=ALHBackoff(initial_delay=.01))
+
+	def test_get(self):
+		node = ALHProxy(self._get_alh(), 2)
+
+		self.assertEqual(node.get("hello").text, "EmulatedNode version 2.50")
+		self.assertEqual(node.post("prog/firstCall", "1").text, "OK")
+
+	def test_busy(self):
+		coor = self._get_alh()
+		node = ALHProxy(coor, 2)
+
+		def get():
+			node.get("hello")
+
+		threads = [ threading.Thread(target=get) for n in range(4) ]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(self.coor.requests, 4)
+		self.assertGreater(self.coor.busy_responses, 0)
+		self.assertGreater(coor.busy_requests, 0)
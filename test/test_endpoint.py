@@ -0,0 +1,274 @@
+import asyncio
+import socket
+import unittest
+
+from vesna.alh import TerminalError
+from vesna.alh.aio import AsyncALHWeb
+from vesna.alh.endpoint import ALHEndpoint, serve, get_ssl_context
+
+def run(coro):
+	loop = asyncio.new_event_loop()
+	asyncio.set_event_loop(loop)
+	try:
+		return loop.run_until_complete(coro)
+	finally:
+		asyncio.set_event_loop(None)
+		loop.close()
+
+class MockCoordinator:
+	"""Coordinator that connects to the tunnel port and answers each
+	request with the requested resource and arguments."""
+	def __init__(self, delay=.001):
+		self.delay = delay
+		self.requests = []
+		self.in_progress = 0
+		self.max_in_progress = 0
+
+	async def run(self, port):
+		reader, writer = await asyncio.open_connection("localhost", port)
+
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+
+				line = line.strip()
+				if not line:
+					continue
+
+				self.requests.append(line)
+
+				if line.startswith(b"post"):
+					length = int((await reader.readline()).split(b"=")[1])
+					await reader.readexactly(length + 2)
+					await reader.readline()
+
+				self.in_progress += 1
+				self.max_in_progress = max(self.max_in_progress, self.in_progress)
+				await asyncio.sleep(self.delay)
+				self.in_progress -= 1
+
+				writer.write(line.split(b" ", 1)[1] + b"\r\nOK\r\n")
+		finally:
+			writer.close()
+
+class TestALHEndpoint(unittest.TestCase):
+
+	def _run(self, f, connect=True, **kwargs):
+		async def g():
+			endpoint = self.endpoint = ALHEndpoint(10001, **kwargs)
+			servers = await serve(endpoint, 0, 0, None, host="localhost")
+
+			http_port = servers[0].sockets[0].getsockname()[1]
+			tunnel_port = servers[1].sockets[0].getsockname()[1]
+
+			coordinator = MockCoordinator()
+			if connect:
+				task = asyncio.ensure_future(coordinator.run(tunnel_port))
+				while endpoint.alh is None:
+					await asyncio.sleep(.001)
+
+			try:
+				return await f(http_port, coordinator)
+			finally:
+				endpoint.close()
+				for server in servers:
+					server.close()
+					await server.wait_closed()
+				if connect:
+					await task
+
+		return run(g())
+
+	def test_concurrent(self):
+		async def f(port, coordinator):
+			alh = AsyncALHWeb("http://localhost:%d/communicator" % (port,), 10001)
+			rs = await asyncio.gather(*[ alh.get("foo", "n=%d" % (n,)) for n in range(10) ])
+			r = await alh.post("bar", "data", "x")
+			alh.close()
+
+			return rs, r
+
+		rs, r = self._run(f)
+
+		self.assertEqual([ r.text for r in rs ], [ "foo?n=%d" % (n,) for n in range(10) ])
+		self.assertEqual(r.text, "bar?x")
+
+	def test_serialized(self):
+		async def f(port, coordinator):
+			alh = AsyncALHWeb("http://localhost:%d/communicator" % (port,), 10001)
+			await asyncio.gather(*[ alh.get("foo", "n=%d" % (n,)) for n in range(10) ])
+			alh.close()
+
+			return coordinator
+
+		coordinator = self._run(f)
+
+		self.assertEqual(len(coordinator.requests), 10)
+		self.assertEqual(coordinator.max_in_progress, 1)
+
+	def test_keep_alive(self):
+		async def f(port, coordinator):
+			reader, writer = await asyncio.open_connection("localhost", port)
+
+			responses = []
+			for n in range(2):
+				writer.write(b"GET /communicator?method=get&resource=foo%3Fn=" +
+						str(n).encode('ascii') +
+						b"&cluster=10001 HTTP/1.1\r\nHost: localhost\r\n\r\n")
+
+				status = await reader.readline()
+				head = await reader.readuntil(b"\r\n\r\n")
+				length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+				body = await reader.readexactly(length)
+
+				responses.append((status.strip(), body))
+
+			writer.close()
+			return responses
+
+		responses = self._run(f)
+
+		self.assertEqual(responses, [
+			(b"HTTP/1.1 200 OK", b"foo?n=0"),
+			(b"HTTP/1.1 200 OK", b"foo?n=1")])
+
+	def test_invalid_cluster(self):
+		async def f(port, coordinator):
+			alh = AsyncALHWeb("http://localhost:%d/communicator" % (port,), 10002)
+			try:
+				await alh.get("foo")
+			finally:
+				alh.close()
+
+		self.assertRaises(TerminalError, self._run, f)
+
+	def test_not_connected(self):
+		async def f(port, coordinator):
+			alh = AsyncALHWeb("http://localhost:%d/communicator" % (port,), 10001)
+			try:
+				await alh.get("foo")
+			finally:
+				alh.close()
+
+		self.assertRaises(TerminalError, self._run, f, connect=False)
+
+	def test_coalesce(self):
+		async def f(port, coordinator):
+			coordinator.delay = .05
+
+			alh = AsyncALHWeb("http://localhost:%d/communicator" % (port,), 10001,
+					pool_size=6)
+			rs = await asyncio.gather(*([ alh.get("nodes", "5/hello?") for n in range(5) ] +
+					[ alh.get("nodes", "6/hello?") ]))
+			alh.close()
+
+			return rs, coordinator
+
+		rs, coordinator = self._run(f)
+
+		self.assertEqual([ r.text for r in rs ], ["nodes?5/hello?"] * 5 + ["nodes?6/hello?"])
+		self.assertEqual(len(coordinator.requests), 2)
+		self.assertEqual(self.endpoint.coalesced_requests, 4)
+		self.assertEqual(self.endpoint.saved_round_trips, 4)
+
+	def test_cache(self):
+		async def f(port, coordinator):
+			alh = AsyncALHWeb("http://localhost:%d/communicator" % (port,), 10001)
+			for n in range(3):
+				await alh.get("nodes", "5/hello?")
+			await alh.get("nodes", "5/uptime?")
+			await alh.get("nodes", "5/uptime?")
+
+			await alh.post("nodes", "1", "5/prog/firstCall?")
+			await alh.get("nodes", "5/hello?")
+			alh.close()
+
+			return coordinator
+
+		coordinator = self._run(f, cache_ttls={"hello": 10.})
+
+		self.assertEqual(coordinator.requests, [
+			b"get nodes?5/hello?",
+			b"get nodes?5/uptime?",
+			b"get nodes?5/uptime?",
+			b"post nodes?5/prog/firstCall?",
+			b"get nodes?5/hello?"])
+
+		stats = self.endpoint.get_stats()
+		self.assertEqual(stats['requests'], 7)
+		self.assertEqual(stats['cache_hits'], 2)
+
+	def test_priority(self):
+		async def f(port, coordinator):
+			coordinator.delay = .01
+
+			e = self.endpoint
+			tasks = [ asyncio.ensure_future(e.request("get", b"hello", b"")) ]
+			await asyncio.sleep(.005)
+
+			tasks += [ asyncio.ensure_future(e.request("get", b"nodes",
+				b"5/sensing/slotDataBinary?id=1&start=%d" % (n,))) for n in range(3) ]
+			tasks.append(asyncio.ensure_future(e.request("get", b"nodes", b"6/hello?")))
+			tasks.append(asyncio.ensure_future(e.request("post", b"nodes", b"6/sensing/program?", b"in 1 sec")))
+
+			await asyncio.gather(*tasks)
+
+			return coordinator
+
+		coordinator = self._run(f)
+
+		self.assertEqual(coordinator.requests, [
+			b"get hello?",
+			b"post nodes?6/sensing/program?",
+			b"get nodes?6/hello?",
+			b"get nodes?5/sensing/slotDataBinary?id=1&start=0",
+			b"get nodes?5/sensing/slotDataBinary?id=1&start=1",
+			b"get nodes?5/sensing/slotDataBinary?id=1&start=2"])
+
+	def test_metrics(self):
+		async def f(port, coordinator):
+			alh = AsyncALHWeb("http://localhost:%d/communicator" % (port,), 10001)
+			await alh.get("nodes", "5/hello?")
+			await alh.get("nodes", "6/hello?")
+			await alh.post("nodes", "1", "5/prog/firstCall?")
+			alh.close()
+
+			reader, writer = await asyncio.open_connection("localhost", port)
+			writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+			resp = await reader.read()
+			writer.close()
+
+			return resp
+
+		resp = self._run(f)
+
+		head, sep, body = resp.partition(b"\r\n\r\n")
+		self.assertTrue(head.startswith(b"HTTP/1.1 200 OK"))
+		self.assertIn(b"Content-Type: text/plain; version=0.0.4", head)
+
+		lines = body.decode('utf-8').split("\n")
+
+		self.assertIn('alh_endpoint_requests_total{method="get",resource="hello"} 2', lines)
+		self.assertIn('alh_endpoint_requests_total{method="post",resource="prog/firstCall"} 1', lines)
+		self.assertIn('alh_endpoint_coordinator_latency_seconds_bucket{method="get",resource="hello",le="+Inf"} 2', lines)
+		self.assertIn('alh_endpoint_coordinator_latency_seconds_count{method="post",resource="prog/firstCall"} 1', lines)
+		self.assertIn('alh_endpoint_tunnel_connections_total 1', lines)
+		self.assertIn('alh_endpoint_tunnel_connected 1', lines)
+		self.assertIn('alh_endpoint_terminal_errors_total 0', lines)
+		self.assertIn('alh_endpoint_queue_depth 0', lines)
+
+		stats = self.endpoint.get_stats()
+		self.assertIn('alh_endpoint_sent_bytes_total %d' % (stats['bytes_sent'],), lines)
+		self.assertEqual(stats['bytes_received'], len(b"nodes?5/hello?") * 2 + len(b"nodes?5/prog/firstCall?"))
+
+	def test_tunnel_nodelay(self):
+		async def f(port, coordinator):
+			sock = self.endpoint.alh.writer.get_extra_info('socket')
+			return sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+
+		self.assertTrue(self._run(f))
+
+	def test_ssl_context_invalid_version(self):
+		self.assertRaises(ValueError, get_ssl_context, "cert.pem", "key.pem", "SSLv3")
@@ -0,0 +1,117 @@
+import json
+import unittest
+
+try:
+	from StringIO import StringIO
+except ImportError:
+	from io import StringIO
+
+from vesna.alh import ALHWeb, ALHProxy, ALHBackoff, ALHRandomError
+from vesna.alh.instrument import ALHInstrument, Histogram
+
+class TestHistogram(unittest.TestCase):
+	def test_observe(self):
+		h = Histogram([1, 10])
+
+		for v in [0, 1, 2, 10, 11, 100]:
+			h.observe(v)
+
+		d = h.to_dict()
+
+		self.assertEqual(d['count'], 6)
+		self.assertEqual(d['sum'], 124)
+		self.assertEqual(d['buckets'], [[1, 2], [10, 4], ["+Inf", 6]])
+
+class TestALHInstrument(unittest.TestCase):
+	def setUp(self):
+		self.responses = responses = []
+
+		class MockALHWeb(ALHWeb):
+			def _send(self, params):
+				return responses.pop(0)
+
+		self.instrument = ALHInstrument()
+
+		self.coor = MockALHWeb("http://localhost", "id",
+				backoff=ALHBackoff(initial_delay=.01))
+		self.coor.HOOKS = [self.instrument]
+
+	def test_coordinator(self):
+		self.responses.extend([b"bar"])
+
+		self.coor.get("foo", "arg")
+
+		stats = self.instrument.get_stats()
+
+		self.assertEqual(len(stats), 1)
+		self.assertEqual(stats[0]['node'], None)
+		self.assertEqual(stats[0]['resource'], "foo")
+		self.assertEqual(stats[0]['requests'], 1)
+		self.assertEqual(stats[0]['bytes_out']['sum'], 6)
+		self.assertEqual(stats[0]['bytes_in']['sum'], 3)
+
+	def test_proxy(self):
+		self.responses.extend([
+			b"ERROR: Communication in progress",
+			b"ERROR: something bad happened",
+			b"bar"])
+
+		node = ALHProxy(self.coor, 5)
+		node.HOOKS = [self.instrument]
+
+		node.get("foo")
+
+		stats = self.instrument.get_stats()
+
+		self.assertEqual(len(stats), 1)
+		self.assertEqual(stats[0]['node'], 5)
+		self.assertEqual(stats[0]['resource'], "foo")
+		self.assertEqual(stats[0]['requests'], 1)
+		self.assertEqual(stats[0]['retries'], 1)
+		self.assertGreater(stats[0]['busy_time'], 0.)
+		self.assertEqual(stats[0]['errors'], {})
+
+	def test_forwarded(self):
+		self.responses.extend([b"bar"])
+
+		node = ALHProxy(self.coor, 5)
+		node.get("foo")
+
+		stats = self.instrument.get_stats()
+
+		self.assertEqual(stats[0]['node'], 5)
+		self.assertEqual(stats[0]['resource'], "foo")
+
+	def test_error(self):
+		self.coor.RETRIES = 1
+		self.responses.extend([b"ERROR: something bad happened"])
+
+		self.assertRaises(ALHRandomError, self.coor.get, "foo")
+
+		stats = self.instrument.get_stats()
+
+		self.assertEqual(stats[0]['errors'], {"ALHRandomError": 1})
+		self.assertEqual(stats[0]['bytes_in']['sum'], 0)
+
+	def test_dump_json(self):
+		self.responses.extend([b"bar", b"baz"])
+
+		self.coor.get("foo")
+		self.coor.post("bar", "data")
+
+		f = StringIO()
+		self.instrument.dump_json(f)
+
+		stats = json.loads(f.getvalue())
+
+		self.assertEqual([ s['resource'] for s in stats ], ["bar", "foo"])
+
+	def test_hook_error(self):
+		def hook(event):
+			raise Exception
+
+		self.coor.HOOKS = [hook, self.instrument]
+		self.responses.extend([b"bar"])
+
+		self.assertEqual(self.coor.get("foo").text, "bar")
+		self.assertEqual(len(self.instrument.get_stats()), 1)
@@ -0,0 +1,176 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from vesna.alh import ALHProtocol, ALHProxy, CRCError, TerminalError
+from vesna.alh.replay import ALHRecorder, ALHReplay, ALHReplayError
+from vesna.alh.spectrumsensor import SpectrumSensor, SpectrumSensorProgram
+from vesna.spectrumsensor import Device, DeviceConfig, SweepConfig
+
+class MockALH(ALHProtocol):
+	def __init__(self, responses):
+		self.responses = responses
+
+	def _get(self, resource, *args):
+		return self._next()
+
+	def _post(self, resource, data, *args):
+		return self._next()
+
+	def _next(self):
+		r = self.responses.pop(0)
+		if isinstance(r, Exception):
+			raise r
+		else:
+			return r
+
+class TestALHReplay(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def _record(self, responses, f, requests):
+		rec = ALHRecorder(MockALH(responses), f)
+		for method, args in requests:
+			try:
+				getattr(rec, method)(*args)
+			except Exception:
+				pass
+		rec.close()
+
+	def test_replay(self):
+		path = os.path.join(self.dir, "trace.jsonl.gz")
+
+		self._record([b"foo", b"\x00\xff", b"bar"], path, [
+			("get", ("hello",)),
+			("post", ("sensing/program", "data\x00", "arg")),
+			("get", ("hello",))])
+
+		alh = ALHReplay(path)
+
+		self.assertEqual(alh.remaining, 3)
+		self.assertEqual(alh.get("hello").text, "foo")
+		self.assertEqual(alh.get("hello").text, "bar")
+		self.assertEqual(alh.post("sensing/program", "data\x00", "arg").content, b"\x00\xff")
+		self.assertEqual(alh.remaining, 0)
+
+		self.assertRaises(ALHReplayError, alh.get, "hello")
+
+	def test_data_mismatch(self):
+		f = io.BytesIO()
+
+		self._record([b"foo", b"bar", b"baz"], f, [
+			("post", ("foo", "data1")),
+			("post", ("foo", "data2")),
+			("post", ("foo", "data3"))])
+
+		f.seek(0)
+		alh = ALHReplay(f)
+
+		self.assertEqual(alh.post("foo", "data2").text, "bar")
+		self.assertEqual(alh.post("foo", "other").text, "foo")
+		self.assertEqual(alh.post("foo", "data3").text, "baz")
+		self.assertRaises(ALHReplayError, alh.post, "foo", "data1")
+
+	def test_program(self):
+		d = Device(0, "test")
+		dc = DeviceConfig(0, "foo", d)
+		dc.base = 1000
+		dc.spacing = 1
+		dc.num = 1000
+		dc.time = 1
+
+		sc = SweepConfig(dc, 0, 3, 1)
+
+		f = io.BytesIO()
+
+		coor = ALHRecorder(MockALH([b"Node #5 return;ok"] * 2), f)
+		ss = SpectrumSensor(ALHProxy(coor, 5))
+		ss.program(SpectrumSensorProgram(sc, time.time() + 10, 60, 1))
+
+		f.seek(0)
+
+		# replayed later, the relative start time in the program
+		# is different.
+		coor = ALHReplay(f)
+		ss = SpectrumSensor(ALHProxy(coor, 5))
+		ss.program(SpectrumSensorProgram(sc, time.time() + 20, 60, 1))
+
+		self.assertEqual(coor.remaining, 0)
+
+	def test_proxy(self):
+		f = io.BytesIO()
+
+		coor = ALHRecorder(MockALH([b"Node #5 return;bar"]), f)
+		ALHProxy(coor, 5).post("foo", "data")
+
+		f.seek(0)
+
+		coor = ALHReplay(f)
+		self.assertEqual(ALHProxy(coor, 5).post("foo", "data").text, "bar")
+
+	def test_error(self):
+		f = io.BytesIO()
+
+		self._record([CRCError(b"\x00\x01"), TerminalError("oops")], f, [
+			("get", ("foo",)),
+			("get", ("bar",))])
+
+		f.seek(0)
+		alh = ALHReplay(f)
+
+		try:
+			alh.get("foo")
+		except CRCError as e:
+			self.assertEqual(e.args[0], b"\x00\x01")
+		else:
+			self.fail()
+
+		self.assertRaises(TerminalError, alh.get, "bar")
+
+	def test_speed(self):
+		class SlowALH(MockALH):
+			def _get(self, resource, *args):
+				time.sleep(.05)
+				return MockALH._get(self, resource, *args)
+
+		f = io.BytesIO()
+
+		rec = ALHRecorder(SlowALH([b"foo", b"foo"]), f)
+		rec.get("foo")
+		rec.get("foo")
+
+		f.seek(0)
+		alh = ALHReplay(f, speed=10.)
+
+		time_start = time.time()
+		alh.get("foo")
+		alh.get("foo")
+		t = time.time() - time_start
+
+		self.assertGreaterEqual(t, .01)
+		self.assertLess(t, .05)
+
+	def test_speed_pauses(self):
+		f = io.BytesIO()
+
+		rec = ALHRecorder(MockALH([b"foo", b"bar"]), f)
+		rec.get("foo")
+		time.sleep(.2)
+		rec.get("bar")
+
+		f.seek(0)
+		alh = ALHReplay(f, speed=2.)
+
+		time_start = time.time()
+		alh.get("foo")
+		alh.get("bar")
+		t = time.time() - time_start
+
+		self.assertGreaterEqual(t, .1)
+		self.assertLess(t, .2)
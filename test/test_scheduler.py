@@ -0,0 +1,120 @@
+import threading
+import time
+import unittest
+
+from vesna.alh import ALHProtocol, ALHProxy
+from vesna.alh.scheduler import ALHScheduler
+
+class MockCoordinator(ALHProtocol):
+	def __init__(self):
+		self.requests = []
+		self.active = 0
+		self.max_active = 0
+		self.block = threading.Event()
+		self.block.set()
+
+	def _get(self, resource, *args):
+		self.active += 1
+		self.max_active = max(self.max_active, self.active)
+
+		self.requests.append(b"".join((resource,) + args))
+		self.block.wait()
+		time.sleep(.001)
+
+		self.active -= 1
+		return b"ok"
+
+	def _post(self, resource, data, *args):
+		return self._get(resource, *args)
+
+class TestALHScheduler(unittest.TestCase):
+	def setUp(self):
+		self.coor = MockCoordinator()
+		self.sched = ALHScheduler(self.coor)
+
+	def _start(self, func, *args):
+		t = threading.Thread(target=func, args=args)
+		t.start()
+		return t
+
+	def _wait_for_depth(self, depth):
+		for n in range(1000):
+			if self.sched.queue_depth == depth:
+				return
+			time.sleep(.001)
+
+		self.fail()
+
+	def test_serialize(self):
+		nodes = [ ALHProxy(self.sched, addr) for addr in range(5) ]
+
+		def worker(node):
+			for n in range(10):
+				self.assertEqual(node.get("hello").text, "ok")
+
+		threads = [ self._start(worker, node) for node in nodes ]
+		for t in threads:
+			t.join()
+
+		self.assertEqual(len(self.coor.requests), 50)
+		self.assertEqual(self.coor.max_active, 1)
+
+		stats = self.sched.get_stats()
+		self.assertEqual(sorted(stats.keys()), list(range(5)))
+		self.assertEqual(stats[0]['requests'], 10)
+
+	def test_fairness(self):
+		node1 = ALHProxy(self.sched, 1)
+		node2 = ALHProxy(self.sched, 2)
+
+		self.coor.block.clear()
+		threads = [ self._start(self.sched.get, "hello") ]
+		self._wait_for_depth(0)
+
+		for n, node in enumerate([node1, node1, node1, node2]):
+			threads.append(self._start(node.get, "hello"))
+			self._wait_for_depth(n + 1)
+
+		self.assertEqual(self.sched.get_queue_depths(), {1: 3, 2: 1})
+
+		self.coor.block.set()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(self.coor.requests, [
+			b"hello",
+			b"nodes1/hello?", b"nodes2/hello?",
+			b"nodes1/hello?", b"nodes1/hello?"])
+
+		self.assertEqual(self.sched.queue_depth, 0)
+		self.assertGreater(self.sched.get_stats()[1]['wait_time_max'], 0)
+
+	def test_priority(self):
+		node1 = ALHProxy(self.sched, 1)
+		node2 = ALHProxy(self.sched, 2)
+
+		self.coor.block.clear()
+		threads = [ self._start(self.sched.get, "hello") ]
+		self._wait_for_depth(0)
+
+		requests = [
+			(node1.get, "sensing/slotDataBinary", "id=1"),
+			(node1.get, "sensing/slotDataBinary", "id=1"),
+			(node2.get, "hello"),
+			(node2.post, "sensing/program", "in 1 sec"),
+		]
+
+		for n, args in enumerate(requests):
+			threads.append(self._start(*args))
+			self._wait_for_depth(n + 1)
+
+		self.coor.block.set()
+		for t in threads:
+			t.join()
+
+		self.assertEqual(self.coor.requests, [
+			b"hello",
+			b"nodes2/sensing/program?",
+			b"nodes2/hello?",
+			b"nodes1/sensing/slotDataBinary?id=1",
+			b"nodes1/sensing/slotDataBinary?id=1"])
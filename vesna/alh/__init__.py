@@ -1,14 +1,20 @@
 import binascii
+import contextlib
 import logging
-import os
+import random
 import re
 import string
 import sys
+import threading
 import time
 import ssl
+import weakref
 import requests
+from requests.adapters import HTTPAdapter
 from functools import wraps
 
+from vesna.alh.credentials import ALHRCCredentials
+
 try:
 	# Python 2.x
 	from urlparse import urlparse
@@ -50,16 +56,50 @@ class ALHResponse(object):
 
 	.. py:attribute:: text
 
-	   Text form of the response (ASCII).
+	   Text form of the response (ASCII). It is decoded on first access.
 
 	.. py:attribute:: content
 
 	   Binary form of the response (:py:class:`bytes` object on Python 3).
 	"""
+	__slots__ = ('content', '_text')
+
 	def __init__(self, content):
 		assert isinstance(content, bytes)
-		self.text = content.decode('ascii', errors='replace').replace(u'\ufffd', '?')
 		self.content = content
+		self._text = None
+
+	@property
+	def text(self):
+		if self._text is None:
+			self._text = self.content.decode('ascii', errors='replace').replace(u'\ufffd', '?')
+
+		return self._text
+
+	def get_payload(self, trailer_size=4):
+		"""Return the response without the trailer.
+
+		Many binary responses end with a fixed-size trailer, usually a
+		CRC32 checksum. The returned object refers to the same memory as
+		:py:attr:`content` and no data is copied.
+
+		:param trailer_size: size of the trailer in bytes
+		:return: a :py:class:`memoryview` object
+		"""
+		n = max(len(self.content) - trailer_size, 0)
+		return memoryview(self.content)[:n]
+
+	def get_trailer(self, trailer_size=4):
+		"""Return the trailer at the end of the response.
+
+		The returned object refers to the same memory as
+		:py:attr:`content` and no data is copied.
+
+		:param trailer_size: size of the trailer in bytes
+		:return: a :py:class:`memoryview` object
+		"""
+		n = max(len(self.content) - trailer_size, 0)
+		return memoryview(self.content)[n:]
 
 	def __str__(self):
 		return self.text
@@ -89,19 +129,157 @@ class CorruptedData(ALHProtocolException):
 
 class ALHRandomError(ALHException): pass
 
+class NodeUnavailable(ALHException):
+	"""Raised instead of sending a request to a node that recently failed
+	to respond (see :py:class:`vesna.alh.ALHCircuitBreaker`).
+	"""
+	pass
+
 class CRCError(ALHException): pass
 
 class TerminalError(IOError): pass
 
+class CommunicatorBusy(TerminalError): pass
+
+class ALHRequestEvent(object):
+	"""Information about a completed request, passed to instrumentation
+	hooks.
+
+	.. py:attribute:: method
+
+	   Request method (`"get"` or `"post"`).
+
+	.. py:attribute:: node
+
+	   Address of the node the request was sent to, or `None` for
+	   requests that were not forwarded through a coordinator.
+
+	.. py:attribute:: resource
+
+	   Resource name on the node (:py:class:`bytes` object).
+
+	.. py:attribute:: latency
+
+	   Time in seconds from the start of the request until the response
+	   or an error.
+
+	.. py:attribute:: bytes_out
+
+	   Size of the request (resource, arguments and data) in bytes.
+
+	.. py:attribute:: bytes_in
+
+	   Size of the response in bytes (0 if the request failed).
+
+	.. py:attribute:: retries
+
+	   Number of times the request was retried after an error.
+
+	.. py:attribute:: busy_time
+
+	   Time in seconds spent waiting for a busy communicator.
+
+	.. py:attribute:: error
+
+	   Name of the exception class if the request failed, `None` otherwise.
+	"""
+	__slots__ = ('method', 'node', 'resource', 'latency', 'bytes_out',
+			'bytes_in', 'retries', 'busy_time', 'error')
+
+	def __init__(self, method, node, resource):
+		self.method = method
+		self.node = node
+		self.resource = resource
+		self.latency = 0.0
+		self.bytes_out = 0
+		self.bytes_in = 0
+		self.retries = 0
+		self.busy_time = 0.0
+		self.error = None
+
+	def __repr__(self):
+		return "ALHRequestEvent(%s %r on node %r, %.3f s)" % (
+				self.method, self.resource, self.node, self.latency)
+
+# Event for the request currently in progress in this thread. Nested
+# requests (for example from ALHProxy to the coordinator) add their
+# retries and busy time to the outermost request.
+_request_context = threading.local()
+
+def _get_current_event():
+	return getattr(_request_context, 'event', None)
+
+@contextlib.contextmanager
+def _null_guard():
+	yield
+
+_PRINTABLE = string.printable.encode('ascii')
+
+_NODES_RESOURCE_RE = re.compile(b"([0-9]+)/([^?]*)")
+
+_SNEAKY_ERROR_RE = re.compile(b"error|warning", re.IGNORECASE)
+_SNEAKY_ERROR_IGNORE_RE = re.compile(b"bus errors  :|   : 0 \\(error\\)", re.IGNORECASE)
+
 class ALHProtocol:
 	"""Base class for an ALH protocol service.
 
 	This is an abstract class with some useful private methods.
 
 	Implementations of this interface should override _get() and _post() methods.
+
+	Responses are checked for text that looks like an error message. For
+	resources listed in `BINARY_RESOURCES`, only the last
+	`BINARY_TRAILER_SIZE` bytes are checked, and only if they are printable
+	text.
+
+	Requests and responses are logged at the INFO level. To reduce the
+	amount of logging in production, set `LOG_PAYLOAD_LIMIT` to log at
+	most that many bytes of each payload, or set `LOG_PAYLOAD_SAMPLE` to
+	the fraction of payloads that should be logged (others are logged
+	only with their length). Both can be set on the class or on
+	individual instances.
+
+	Each request can be passed to instrumentation hooks. Set `HOOKS` to a
+	list of callables to have each of them called with a
+	:py:class:`vesna.alh.ALHRequestEvent` object after every request. Set
+	it on :py:class:`vesna.alh.ALHProtocol` to instrument all
+	implementations, or on individual instances. Only the outermost
+	request is reported when requests are forwarded through another ALH
+	implementation (for example from :py:class:`vesna.alh.ALHProxy` to
+	the coordinator). See :py:class:`vesna.alh.instrument.ALHInstrument`
+	for a hook that collects latency histograms.
 	"""
 	RETRIES = 5
 
+	HOOKS = ()
+
+	LOG_PAYLOAD_LIMIT = None
+	LOG_PAYLOAD_SAMPLE = 1.0
+
+	BINARY_RESOURCES = frozenset([
+		b"sensing/quickSweepBin",
+		b"sensing/slotDataBinary",
+	])
+
+	BINARY_TRAILER_SIZE = 64
+
+	# Priority classes for queued requests (lower number is served first)
+	PRIORITY_HIGH = 0
+	PRIORITY_NORMAL = 1
+	PRIORITY_LOW = 2
+
+	# POST requests that must be delivered quickly (programming a node
+	# checks the time it took against MAX_TIME_ERROR)
+	HIGH_PRIORITY_RESOURCES = frozenset([
+		b"sensing/program",
+		b"generator/program",
+	])
+
+	# GET requests for bulk data
+	LOW_PRIORITY_RESOURCES = frozenset([
+		b"sensing/slotDataBinary",
+	])
+
 	@cast_args_to_bytes
 	def get(self, resource, *args):
 		"""Issue a GET request to the service.
@@ -113,7 +291,11 @@ class ALHProtocol:
 
 		:return: :py:class:`vesna.alh.ALHResponse` object
 		"""
-		rv = self._get(resource, *args)
+		if self.HOOKS:
+			rv = self._instrument("get", resource, args, None,
+					lambda: self._get(resource, *args))
+		else:
+			rv = self._get(resource, *args)
 		return ALHResponse(rv)
 
 	@cast_args_to_bytes
@@ -128,57 +310,158 @@ class ALHProtocol:
 
 		:return: :py:class:`vesna.alh.ALHResponse` object
 		"""
-		rv = self._post(resource, data, *args)
+		if self.HOOKS:
+			rv = self._instrument("post", resource, args, data,
+					lambda: self._post(resource, data, *args))
+		else:
+			rv = self._post(resource, data, *args)
 		return ALHResponse(rv)
 
+	def _get_destination(self, resource, args):
+		return self._split_resource(resource, args)
+
+	_get_current_event = staticmethod(_get_current_event)
+
+	def _instrument(self, method, resource, args, data, call):
+		if self._get_current_event() is not None:
+			# nested request, reported by the outer one
+			return call()
+
+		node, name = self._get_destination(resource, args)
+
+		event = ALHRequestEvent(method, node, name)
+		event.bytes_out = len(resource) + sum(len(arg) for arg in args)
+		if data is not None:
+			event.bytes_out += len(data)
+
+		_request_context.event = event
+		time_start = time.time()
+		try:
+			rv = call()
+			event.bytes_in = len(rv)
+			return rv
+		except Exception as e:
+			event.error = e.__class__.__name__
+			raise
+		finally:
+			event.latency = time.time() - time_start
+			_request_context.event = None
+			self._run_hooks(event)
+
+	def _run_hooks(self, event):
+		for hook in self.HOOKS:
+			try:
+				hook(event)
+			except Exception:
+				log.exception("instrumentation hook failed")
+
 	def _log_request(self, method, resource, args, data=None):
+		if not log.isEnabledFor(logging.INFO):
+			return
+
 		msg = b"%s?%s" % (resource, b"".join(args))
-		log.info("%8s: %s" % (method, msg.decode("ascii", "ignore")))
+		log.info("%8s: %s", method, msg.decode("ascii", "ignore"))
 
 		if data is not None and len(data) > 4:
-			if self._is_printable(data):
-				data_ascii = data.decode("ascii", "ignore")
-			else:
-				data_ascii = "(unprintable)"
-			log.info("    DATA: %s" % (data_ascii,))
+			log.info("    DATA: %s", self._format_payload(data))
 
 	@staticmethod
 	def _is_printable(resp):
-		try:
-			resp_ascii = resp.decode('ascii')
-		except UnicodeDecodeError:
-			return False
+		return not resp.translate(None, _PRINTABLE)
+
+	def _format_payload(self, data):
+		if self.LOG_PAYLOAD_SAMPLE < 1.0 and random.random() >= self.LOG_PAYLOAD_SAMPLE:
+			return "(%d bytes)" % (len(data),)
 
-		return all(c in string.printable for c in resp_ascii)
+		limit = self.LOG_PAYLOAD_LIMIT
+		if limit is not None and len(data) > limit:
+			suffix = "... (%d bytes)" % (len(data),)
+			data = data[:limit]
+		else:
+			suffix = ""
+
+		if self._is_printable(data):
+			return data.decode("ascii", "ignore") + suffix
+		else:
+			return "(unprintable)" + suffix
 
 	def _log_response(self, resp):
-		if self._is_printable(resp):
-			resp_ascii = resp.decode("ascii", "ignore").strip()
-			log.info("response: %s" % (resp_ascii,))
+		if not log.isEnabledFor(logging.INFO):
+			return
+
+		if self.LOG_PAYLOAD_SAMPLE >= 1.0 and self.LOG_PAYLOAD_LIMIT is None and \
+				not self._is_printable(resp):
+			log.info("unprintable response (%d bytes)", len(resp))
 		else:
-			log.info("unprintable response (%d bytes)" % (len(resp),))
+			log.info("response: %s", self._format_payload(resp.strip()))
 
-	def _send_with_retry(self, data):
+	def _send_with_retry(self, data, binary=False):
 
 		for retry in range(self.RETRIES):
 			try:
-				return self._send_with_error(data)
+				return self._send_with_error(data, binary)
 			except ALHException as e:
 				if retry == self.RETRIES - 1:
 					raise e
 				else:
 					log.exception("retrying (%d)" % (retry+1,))
 
-	def _check_for_sneaky_error(self, resp):
+					event = self._get_current_event()
+					if event is not None:
+						event.retries += 1
+
+	@staticmethod
+	def _split_resource(resource, args):
+		# Requests forwarded through the "nodes" resource start with the
+		# address of the destination node and the resource on that node.
+		#
+		# Returns the node address (None for requests that are not
+		# forwarded) and the resource name on that node.
+		if resource == b"nodes" and args:
+			g = _NODES_RESOURCE_RE.match(args[0])
+			if g:
+				return int(g.group(1)), g.group(2)
+
+		return None, resource
+
+	@classmethod
+	def _get_priority(cls, method, resource, args):
+		# Returns the priority class of a request when it is queued
+		# behind other requests (see vesna.alh.scheduler and
+		# vesna.alh.endpoint).
+		addr, resource = cls._split_resource(resource, args)
+
+		if method == "post" and resource in cls.HIGH_PRIORITY_RESOURCES:
+			return cls.PRIORITY_HIGH
+		elif method == "get" and resource in cls.LOW_PRIORITY_RESOURCES:
+			return cls.PRIORITY_LOW
+		else:
+			return cls.PRIORITY_NORMAL
+
+	def _is_binary_resource(self, resource, args):
+		addr, resource = self._split_resource(resource, args)
+		return resource in self.BINARY_RESOURCES
+
+	def _check_for_sneaky_error(self, resp, binary=False):
 		# This is extremely ugly. But since we don't have
 		# currently any consistent way of specifying whether
 		# a request failed or not, we check if the response
 		# contains any strings that look like error messages.
 
-		r = resp.decode('unicode_escape').lower()
-		r = r.replace("bus errors  :", "")
-		r = r.replace("   : 0 (error)", "")
-		if "error" in r or "warning" in r:
+		text = resp
+		if binary:
+			# Binary data can contain anything. Error messages are
+			# text, so only look for them at the end of the
+			# response and only if it looks like text.
+			text = resp[-self.BINARY_TRAILER_SIZE:]
+			if not self._is_printable(text):
+				return
+
+		if _SNEAKY_ERROR_RE.search(text) is None:
+			return
+
+		r = _SNEAKY_ERROR_IGNORE_RE.sub(b"", text)
+		if _SNEAKY_ERROR_RE.search(r) is not None:
 			raise ALHRandomError(resp)
 
 
@@ -188,34 +471,129 @@ class ALHTerminal(ALHProtocol):
 	This implementation is used for testing and debugging when a sensor
 	node is connected directly to a computer over a serial line.
 
+	Responses are read in blocks of up to `recv_buffer_size` bytes. On a
+	:py:class:`serial.Serial` object, all bytes that are waiting in the
+	input buffer are read at once. Sockets (for example an SSL tunnel from
+	the coordinator) are read with `recv()`. Other file-like objects are
+	read with `read()` without arguments.
+
+	Requests from several threads can be sent through the same terminal.
+	By default, a request is only sent after the response to the previous
+	request has been received. If `pipeline_depth` is larger than 1, up to
+	that many requests from different threads can be in flight at once.
+	The line then does not sit idle while the node processes a request.
+	Responses are matched to requests in the order requests were sent.
+	After a JUNK-INPUT response, no new requests are sent until the
+	parser on the node has been reset. Requests that were already in
+	flight are retried by their callers as usual.
+
 	:param f: path to the character device of the terminal (usually an
 	          instance of the :py:class:`serial.Serial` class)
+	:param recv_buffer_size: maximum number of bytes to read at once
+	:param pipeline_depth: maximum number of requests in flight
 	"""
 	RESPONSE_TERMINATOR = b"\r\nOK\r\n"
 
-	def __init__(self, f):
+	def __init__(self, f, recv_buffer_size=4096, pipeline_depth=1):
 		self.f = f
+		self.recv_buffer_size = recv_buffer_size
+		self.pipeline_depth = pipeline_depth
+
+		# bytes received, but not yet returned as part of a response
+		self._rxbuf = bytearray()
+
+		self._cond = threading.Condition()
+		# sequence number of the next request to be sent
+		self._tx_seq = 0
+		# sequence number of the next response to be received
+		self._rx_seq = 0
+		# number of recoveries from junk state in progress
+		self._recovering = 0
+
+	def _read(self):
+		in_waiting = getattr(self.f, 'in_waiting', None)
+		if in_waiting is not None:
+			# block for at least one byte if nothing is waiting.
+			size = min(max(in_waiting, 1), self.recv_buffer_size)
+			return self.f.read(size)
+		elif hasattr(self.f, 'recv'):
+			return self.f.recv(self.recv_buffer_size)
+		else:
+			return self.f.read()
+
+	def _read_response(self):
+		buf = self._rxbuf
+		term = self.RESPONSE_TERMINATOR
+
+		start = 0
+		while True:
+			i = buf.find(term, start)
+			if i != -1:
+				break
 
-	def _send(self, data):
-		self.f.write(data)
+			# terminator can start in the part we already
+			# scanned, but not before that.
+			start = max(0, len(buf) - len(term) + 1)
 
-		resp = b""
-		while not resp.endswith(self.RESPONSE_TERMINATOR):
-			d = self.f.read()
+			d = self._read()
 			if d:
-				resp += d
+				buf += d
 			else:
 				raise TerminalError
 
-		return resp[:-len(self.RESPONSE_TERMINATOR)]
+		resp = bytes(buf[:i])
+		del buf[:i+len(term)]
+
+		return resp
+
+	def _send(self, data, recovery=False):
+		with self._cond:
+			while (self._tx_seq - self._rx_seq >= self.pipeline_depth) or \
+					(self._recovering and not recovery):
+				self._cond.wait()
+
+			seq = self._tx_seq
+			self._tx_seq += 1
+
+			try:
+				self.f.write(data)
+			except:
+				# No response will come for this request. The
+				# lock is held, so no other request was sent
+				# after it.
+				self._tx_seq -= 1
+				self._cond.notify_all()
+				raise
+
+			while self._rx_seq != seq:
+				self._cond.wait()
+
+		# Only the thread whose response is next in line gets here, so
+		# reading can proceed without the lock while other threads send
+		# requests.
+		try:
+			return self._read_response()
+		finally:
+			with self._cond:
+				self._rx_seq += 1
+				self._cond.notify_all()
 
 	def _recover(self):
-		self._send(b"\r\n" * 5)
+		with self._cond:
+			self._recovering += 1
 
-	def _crc(self, data):
+		try:
+			self._send(b"\r\n" * 5, recovery=True)
+		finally:
+			with self._cond:
+				self._recovering -= 1
+				self._cond.notify_all()
+
+	@staticmethod
+	def _crc(data):
 		return binascii.crc32(data)
 
-	def _send_with_error(self, data):
+	def _send_with_error(self, data, binary=False):
 		resp = self._send(data)
 		if resp.endswith(JunkInput.TERMINATOR):
 			self._recover()
@@ -223,30 +601,199 @@ class ALHTerminal(ALHProtocol):
 		if resp.endswith(CorruptedData.TERMINATOR):
 			raise CorruptedData(resp)
 
-		self._check_for_sneaky_error(resp)
+		self._check_for_sneaky_error(resp, binary)
 		self._log_response(resp)
 
 		return resp
 
+	@staticmethod
+	def _format_get(resource, args):
+		arg = b"".join(args)
+		return b"get %s?%s\r\n" % (resource, arg)
+
+	@classmethod
+	def _format_post(cls, resource, data, args):
+		arg = b"".join(args)
+
+		req = b"post %s?%s\r\nlength=%d\r\n%s\r\n" % (
+				resource, arg, len(data), data)
+
+		crc = cls._crc(req)
+
+		req += b"crc=%d\r\n" % crc
+
+		return req
+
 	def _get(self, resource, *args):
 		self._log_request("GET", resource, args)
 
-		arg = b"".join(args)
-		return self._send_with_retry(b"get %s?%s\r\n" % (resource, arg))
+		return self._send_with_retry(self._format_get(resource, args),
+				self._is_binary_resource(resource, args))
 
 	def _post(self, resource, data, *args):
 		self._log_request("POST", resource, args, data)
 
-		arg = b"".join(args)
+		return self._send_with_retry(self._format_post(resource, data, args),
+				self._is_binary_resource(resource, args))
+
+class ALHBackoff(object):
+	"""Exponential back-off policy for waiting on a busy communicator.
+
+	The first retry is made after `initial_delay` seconds. Each following
+	delay is `factor` times longer, up to `max_delay`. Each delay is
+	randomly lengthened or shortened by up to `jitter` (a fraction of the
+	delay), so that clients that were turned away at the same time do not
+	retry at the same time.
+
+	:param initial_delay: delay before the first retry in seconds
+	:param factor: factor by which the delay grows with each retry
+	:param max_delay: maximum delay between retries in seconds
+	:param jitter: maximum relative random change of each delay
+	:param deadline: give up with :py:class:`CommunicatorBusy` if the
+	                 communicator is still busy after this many seconds (by
+	                 default, wait indefinitely)
+	"""
+	def __init__(self, initial_delay=0.25, factor=2.0, max_delay=5.0, jitter=0.25, deadline=None):
+		self.initial_delay = initial_delay
+		self.factor = factor
+		self.max_delay = max_delay
+		self.jitter = jitter
+		self.deadline = deadline
+
+	def _delays(self):
+		delay = self.initial_delay
+		while True:
+			yield delay * (1.0 + random.uniform(-self.jitter, self.jitter))
+			delay = min(delay * self.factor, self.max_delay)
 
-		req = b"post %s?%s\r\nlength=%d\r\n%s\r\n" % (
-				resource, arg, len(data), data)
+	def start(self):
+		"""Start waiting for a single request.
 
-		crc = self._crc(req)
+		:return: a :py:class:`ALHBackoffState` object
+		"""
+		return ALHBackoffState(self)
 
-		req += b"crc=%d\r\n" % crc
+class ALHBackoffState(object):
+	"""State of a back-off for a single request.
+
+	.. py:attribute:: busy_time
+
+	   Time in seconds between the start of the first attempt and the start
+	   of the next attempt.
+
+	.. py:attribute:: retries
+
+	   Number of times the request had to be retried.
+	"""
+	def __init__(self, backoff):
+		self.backoff = backoff
+		self.time_start = time.time()
+		self.busy_time = 0.0
+		self.retries = 0
+
+		self._delays = backoff._delays()
+
+	def next_delay(self):
+		"""Return the time to wait before the next attempt.
+
+		Raises :py:class:`CommunicatorBusy` if the next attempt would start
+		after the deadline.
+		"""
+		elapsed = time.time() - self.time_start
+		delay = next(self._delays)
+
+		deadline = self.backoff.deadline
+		if deadline is not None and elapsed + delay > deadline:
+			raise CommunicatorBusy("communicator was busy for %.1f s" % (elapsed,))
+
+		self.busy_time = elapsed + delay
+		self.retries += 1
+
+		return delay
+
+class ALHSessionPool(object):
+	"""Pool of persistent HTTP connections used by :py:class:`ALHWeb`.
+
+	Connections are kept alive between requests, so that consecutive
+	requests to the same host do not need to repeat the TCP and TLS
+	handshake. The pool can be safely used from several threads at once.
+
+	Connections that have been idle for longer than `idle_timeout` are
+	closed and re-established on the next request. Servers usually drop
+	idle connections on their own, and a stale connection would otherwise
+	only be detected after a failed request.
+
+	:param pool_size: maximum number of connections kept open to a host
+	:param idle_timeout: time in seconds after which idle connections are closed
+	"""
+
+	_shared = {}
+	_shared_lock = threading.Lock()
+
+	def __init__(self, pool_size=4, idle_timeout=60.0):
+		self.pool_size = pool_size
+		self.idle_timeout = idle_timeout
+
+		self._lock = threading.Lock()
+		self._session = None
+		self._last_used = None
+
+	@classmethod
+	def get_shared(cls, key, **kwargs):
+		"""Return a pool shared between all users of the same key.
+
+		A new pool is created on the first call for the given key. Keyword
+		arguments are passed to the constructor in that case and ignored
+		otherwise.
+
+		:param key: key identifying the pool (usually scheme and host name)
+		"""
+		with cls._shared_lock:
+			pool = cls._shared.get(key)
+			if pool is None:
+				pool = cls(**kwargs)
+				cls._shared[key] = pool
+
+			return pool
+
+	def _new_session(self):
+		session = requests.Session()
+
+		adapter = HTTPAdapter(
+				pool_connections=1,
+				pool_maxsize=self.pool_size)
 
-		return self._send_with_retry(req)
+		session.mount('http://', adapter)
+		session.mount('https://', adapter)
+
+		return session
+
+	def get_session(self):
+		"""Return a :py:class:`requests.Session` object to issue requests with.
+		"""
+		with self._lock:
+			now = time.time()
+
+			if self._session is not None and self.idle_timeout is not None:
+				if now - self._last_used > self.idle_timeout:
+					log.debug("closing idle HTTP connections")
+					self._session.close()
+					self._session = None
+
+			if self._session is None:
+				self._session = self._new_session()
+
+			self._last_used = now
+
+			return self._session
+
+	def close(self):
+		"""Close all connections in the pool.
+		"""
+		with self._lock:
+			if self._session is not None:
+				self._session.close()
+				self._session = None
 
 class ALHWeb(ALHProtocol):
 	"""ALH protocol implementation through the HTTP infrastructure server.
@@ -265,65 +812,68 @@ class ALHWeb(ALHProtocol):
 	    Password <password>
 	    # more Host, User, Password lines can follow
 
+	Files are only read again when they change. See
+	:py:class:`vesna.alh.credentials.ALHRCCredentials` for details.
+
+	HTTP connections are kept alive between requests. By default, all
+	instances pointing to the same host share one connection pool.
+
 	:param base_url: base URL of the HTTP API (e.g. `https://crn.log-a-tec.eu/communicator`)
 	:param cluster_id: numerical cluster id
+	:param session_pool: optional :py:class:`ALHSessionPool` object to use
+	                     instead of the pool shared by the host
+	:param credentials: optional :py:class:`vesna.alh.credentials.ALHRCCredentials`
+	                    object to use instead of the shared one
+	:param backoff: optional :py:class:`ALHBackoff` object that defines how
+	                to wait for a busy communicator
+
+	.. py:attribute:: busy_time
+
+	   Total time in seconds that requests spent waiting for a busy
+	   communicator.
+
+	.. py:attribute:: busy_requests
+
+	   Number of requests that found the communicator busy.
 	"""
 
 	UA = "vesna-alh-tools/1.1"
 
-	def __init__(self, base_url, cluster_id):
+	BUSY_RESPONSE = b"ERROR: Communication in progress"
+
+	def __init__(self, base_url, cluster_id, session_pool=None, credentials=None, backoff=None):
 		self.base_url = base_url
 		self.cluster_id = cluster_id
 
 		o = urlparse(base_url)
 		self.host = o.netloc
 
-	def _get_passwd(self):
+		if session_pool is None:
+			session_pool = ALHSessionPool.get_shared((o.scheme, o.netloc))
 
-		paths = [
-				'alhrc',
-				'/etc/alhrc',
-			]
+		self.session_pool = session_pool
 
-		home = os.environ.get('HOME')
-		if home is not None:
-			paths.append(os.path.join(home, '.alhrc'))
+		if credentials is None:
+			credentials = ALHRCCredentials.get_default()
 
-		for path in paths:
-			try:
-				with open(path) as f:
-					match = False
-					user = None
-					passwd = None
+		self.credentials = credentials
 
-					for line in f:
-						if line.startswith('#'):
-							continue
+		if backoff is None:
+			backoff = ALHBackoff()
 
-						try:
-							key, value = line.strip().split()
-						except ValueError:
-							continue
+		self.backoff = backoff
 
-						if (key == 'Host'):
-							match = (value == self.host)
-							user = None
-							passwd = None
-						elif match and (key == 'User'):
-							user = value
-						elif match and (key == 'Password'):
-							passwd = value
+		self._busy_lock = threading.Lock()
+		self.busy_time = 0.0
+		self.busy_requests = 0
 
-						if match and user and passwd:
-							return (user, passwd)
-
-			except IOError:
-				pass
-
-		return None
+	def _get_passwd(self):
+		return self.credentials.get(self.host)
 
 	def _send(self, params):
-		r = requests.get(	self.base_url,
+		session = self.session_pool.get_session()
+
+		r = session.get(	self.base_url,
 					params=params,
 					headers={'user-agent': self.UA},
 					verify=False,
@@ -336,21 +886,43 @@ class ALHWeb(ALHProtocol):
 
 		return r.content
 
-	def _send_with_error(self, params):
+	def _is_busy(self, resp):
+		return resp.startswith(self.BUSY_RESPONSE)
+
+	def _record_busy_time(self, state):
+		if state.retries:
+			log.info("waited %.1f s for busy communicator (%d retries)" % (
+				state.busy_time, state.retries))
+
+		with self._busy_lock:
+			self.busy_time += state.busy_time
+			if state.retries:
+				self.busy_requests += 1
+
+		event = self._get_current_event()
+		if event is not None:
+			event.busy_time += state.busy_time
+
+	def _send_with_error(self, params, binary=False):
 		# loop until communication channel is free and our request
 		# goes through.
-		time_start = time.time()
-		while True:
-			resp = self._send(params)
-			if resp != "ERROR: Communication in progress":
-				break
+		state = self.backoff.start()
+		try:
+			while True:
+				resp = self._send(params)
+				if not self._is_busy(resp):
+					break
 
-			log.info("communicator is busy (have been waiting for %d s)" %
-					(time.time() - time_start))
+				delay = state.next_delay()
 
-			time.sleep(1)
+				log.info("communicator is busy (have been waiting for %.1f s)" %
+						(time.time() - state.time_start))
 
-		self._check_for_sneaky_error(resp)
+				time.sleep(delay)
+		finally:
+			self._record_busy_time(state)
+
+		self._check_for_sneaky_error(resp, binary)
 		
 		self._log_response(resp)
 		return resp
@@ -365,7 +937,7 @@ class ALHWeb(ALHProtocol):
 				('cluster', str(self.cluster_id)),
 		)
 
-		return self._send_with_retry(params)
+		return self._send_with_retry(params, self._is_binary_resource(resource, args))
 
 	def _post(self, resource, data, *args):
 		self._log_request("POST", resource, args, data)
@@ -378,7 +950,171 @@ class ALHWeb(ALHProtocol):
 				('cluster', str(self.cluster_id)),
 		)
 
-		return self._send_with_retry(params)
+		return self._send_with_retry(params, self._is_binary_resource(resource, args))
+
+class ALHCircuitBreaker(object):
+	"""Circuit breaker for requests to a single node behind a coordinator.
+
+	The breaker starts in the `closed` state, in which requests are sent
+	as usual. After `failure_threshold` consecutive requests fail with an
+	:py:class:`vesna.alh.ALHException`, the breaker opens. While it is
+	`open`, requests immediately raise :py:class:`vesna.alh.NodeUnavailable`
+	instead of spending time on retries through the coordinator.
+
+	After `cooldown` seconds, the breaker becomes `half-open` and lets one
+	trial request through. If the trial succeeds, the breaker closes. If
+	it fails, the breaker opens for another cool-down period. Other
+	errors say nothing about the node and do not change the state. These
+	include a failed connection to the coordinator and corrupted
+	requests between the client and the coordinator (JUNK-INPUT and
+	CORRUPTED-DATA responses).
+
+	Note that the coordinator reports most errors from a node, including
+	a node that does not respond, with the same kind of response. A
+	node that returns errors for other reasons can therefore also open
+	the breaker. For this reason breakers are not used unless enabled
+	(see :py:class:`vesna.alh.ALHProxy`).
+
+	:param failure_threshold: number of consecutive failures that open the breaker
+	:param cooldown: time in seconds before a request is tried again
+	:param clock: function returning current time in seconds
+	"""
+
+	CLOSED = "closed"
+	OPEN = "open"
+	HALF_OPEN = "half-open"
+
+	_shared = weakref.WeakKeyDictionary()
+	_shared_lock = threading.Lock()
+
+	def __init__(self, failure_threshold=3, cooldown=60.0, clock=time.time):
+		self.failure_threshold = failure_threshold
+		self.cooldown = cooldown
+		self.clock = clock
+
+		self._lock = threading.Lock()
+		self._state = self.CLOSED
+		self._failures = 0
+		self._time_opened = None
+		self._trial = False
+
+	@classmethod
+	def get_shared(cls, coordinator, addr, **kwargs):
+		"""Return a breaker shared between all proxies for the same node.
+
+		A new breaker is created on the first call for the given
+		coordinator and address. Keyword arguments are passed to the
+		constructor in that case and ignored otherwise.
+
+		:param coordinator: ALH implementation used as a proxy
+		:param addr: address of the node
+		"""
+		with cls._shared_lock:
+			breakers = cls._shared.get(coordinator)
+			if breakers is None:
+				breakers = cls._shared[coordinator] = {}
+
+			breaker = breakers.get(addr)
+			if breaker is None:
+				breaker = breakers[addr] = cls(**kwargs)
+
+			return breaker
+
+	@classmethod
+	def get_all_shared(cls, coordinator):
+		"""Return shared breakers for all nodes behind a coordinator.
+
+		:param coordinator: ALH implementation used as a proxy
+		:return: dictionary with node addresses as keys
+		"""
+		with cls._shared_lock:
+			return dict(cls._shared.get(coordinator, {}))
+
+	def _update(self):
+		if self._state == self.OPEN and \
+				self.clock() >= self._time_opened + self.cooldown:
+			self._state = self.HALF_OPEN
+
+	@property
+	def state(self):
+		"""Current state: `"closed"`, `"open"` or `"half-open"`.
+		"""
+		with self._lock:
+			self._update()
+			return self._state
+
+	def get_state(self):
+		"""Return a dictionary with the current state, the number of
+		consecutive failures and the time when the breaker opened.
+		"""
+		with self._lock:
+			self._update()
+			return {
+				'state': self._state,
+				'failures': self._failures,
+				'time_opened': self._time_opened,
+			}
+
+	def reset(self):
+		"""Close the breaker and forget past failures.
+		"""
+		with self._lock:
+			self._state = self.CLOSED
+			self._failures = 0
+			self._time_opened = None
+			self._trial = False
+
+	def _before_request(self):
+		with self._lock:
+			self._update()
+
+			if self._state == self.CLOSED:
+				return False
+
+			if self._state == self.HALF_OPEN and not self._trial:
+				self._trial = True
+				return True
+
+			raise NodeUnavailable("node did not respond to last %d requests" % (
+				self._failures,))
+
+	def _after_request(self, trial, failed):
+		with self._lock:
+			if trial:
+				self._trial = False
+
+			if failed is None:
+				return
+			elif failed:
+				self._failures += 1
+				if trial or self._failures >= self.failure_threshold:
+					self._state = self.OPEN
+					self._time_opened = self.clock()
+			else:
+				self._state = self.CLOSED
+				self._failures = 0
+				self._time_opened = None
+
+	@contextlib.contextmanager
+	def guard(self):
+		"""Context manager for a single request through the breaker.
+
+		Raises :py:class:`vesna.alh.NodeUnavailable` if the breaker is open.
+		"""
+		trial = self._before_request()
+		try:
+			yield
+		except ALHProtocolException:
+			self._after_request(trial, None)
+			raise
+		except ALHException:
+			self._after_request(trial, True)
+			raise
+		except BaseException:
+			self._after_request(trial, None)
+			raise
+		else:
+			self._after_request(trial, False)
 
 class ALHProxy(ALHProtocol):
 	"""ALH protocol implementation through an ALH proxy.
@@ -389,42 +1125,75 @@ class ALHProxy(ALHProtocol):
 	ALHProxy is typically used to access nodes on the ZigBee mesh network behind
 	the coordinator.
 
+	With a :py:class:`vesna.alh.ALHCircuitBreaker`, requests to a node
+	that stopped responding fail fast with
+	:py:class:`vesna.alh.NodeUnavailable`. If `circuit_breaker` is True,
+	all proxies for the same node on the same coordinator share a
+	breaker. Use :py:meth:`vesna.alh.ALHCircuitBreaker.get_all_shared` to
+	inspect the state of the nodes behind a coordinator.
+
 	:param alhproxy: ALH implementation used as a proxy
 	:param addr: ZigBee address of the node to forward requests to
+	:param circuit_breaker: :py:class:`vesna.alh.ALHCircuitBreaker` object to
+	                        use, `True` to use the breaker shared for this node,
+	                        or `None` to always send requests (default)
 	"""
-	def __init__(self, alhproxy, addr):
+	def __init__(self, alhproxy, addr, circuit_breaker=None):
 		self.alhproxy = alhproxy
 		self.addr = addr
 
+		if circuit_breaker is True:
+			circuit_breaker = ALHCircuitBreaker.get_shared(alhproxy, addr)
+		self.circuit_breaker = circuit_breaker
+
+	def _guard(self):
+		if self.circuit_breaker:
+			return self.circuit_breaker.guard()
+		else:
+			return _null_guard()
+
+	def _get_destination(self, resource, args):
+		return self.addr, resource
+
 	def _recover_remote(self):
 		self.alhproxy.post("radio/noderesetparser", "1", "%d" % (self.addr,))
 
-	def _check_for_junk_state(self, message):
-		g = re.search("NODES:Node ([0-9]+) parser is in junk state\r\nERROR", message)
+	def _is_junk_state(self, e):
+		g = re.search(b"NODES:Node ([0-9]+) parser is in junk state\r\nERROR", e.args[0])
 		if g:
 			assert(int(g.group(1)) == self.addr)
+			return True
+		else:
+			return False
+
+	def _check_for_junk_state(self, e):
+		if self._is_junk_state(e):
 			self._recover_remote()
 
+	def _clean_post_response(self, content):
+		# For POST requests, coordinator adds some string at the start
+		# of the response.
+
+		# Clean it up here, so that responses via proxy are identical
+		# to responses with direct connection.
+		return re.sub(b"^Node #%d return;" % (self.addr,), b"", content)
+
 	def _get(self, resource, *args):
-		try:
-			response = self.alhproxy.get("nodes", b"%d/%s?" % (self.addr, resource), *args)
-		except ALHRandomError as e:
-			self._check_for_junk_state(str(e))
-			raise
+		with self._guard():
+			try:
+				response = self.alhproxy.get("nodes", b"%d/%s?" % (self.addr, resource), *args)
+			except ALHRandomError as e:
+				self._check_for_junk_state(e)
+				raise
 
 		return response.content
 
 	def _post(self, resource, data, *args):
-		try:
-			response = self.alhproxy.post("nodes", data, b"%d/%s?" % (self.addr, resource), *args)
-		except ALHRandomError as e:
-			self._check_for_junk_state(str(e))
-			raise
-
-		# For POST requests, coordinator adds some string at the start
-		# of the response.
+		with self._guard():
+			try:
+				response = self.alhproxy.post("nodes", data, b"%d/%s?" % (self.addr, resource), *args)
+			except ALHRandomError as e:
+				self._check_for_junk_state(e)
+				raise
 
-		# Clean it up here, so that responses via proxy are identical
-		# to responses with direct connection.
-		content = re.sub(b"^Node #%d return;" % (self.addr,), b"", response.content)
-		return content
+		return self._clean_post_response(response.content)
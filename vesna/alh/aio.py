@@ -0,0 +1,533 @@
+"""Implementation of the ALH protocol for asyncio.
+
+Classes in this module mirror the blocking implementations in
+:py:mod:`vesna.alh`, except that their :py:meth:`get` and :py:meth:`post`
+methods are coroutines. This allows one event loop to talk to many
+coordinators and nodes at once::
+
+    coor = AsyncALHWeb("https://crn.log-a-tec.eu/communicator", 10001)
+    nodes = [ AsyncALHProxy(coor, addr) for addr in (17, 19, 25) ]
+
+    responses = await asyncio.gather(*[ node.get("hello") for node in nodes ])
+
+This module requires Python 3.5 or newer.
+"""
+import asyncio
+import base64
+import logging
+import ssl
+import threading
+import time
+import weakref
+from urllib.parse import urlparse, urlencode
+
+from vesna.alh import ALHProtocol, ALHWeb, ALHProxy, ALHTerminal, ALHResponse, \
+		ALHException, ALHRandomError, JunkInput, CorruptedData, TerminalError, \
+		ALHBackoff, ALHCircuitBreaker, ALHRequestEvent, cast_args_to_bytes
+from vesna.alh.credentials import ALHRCCredentials
+
+log = logging.getLogger(__name__)
+
+try:
+	_current_task = asyncio.current_task
+except AttributeError:
+	# Python < 3.7
+	_current_task = asyncio.Task.current_task
+
+# Event for the request currently in progress in each task. Requests from
+# concurrent tasks interleave in one thread, so the thread-local context
+# used by the blocking implementations can't be used here.
+_task_events = weakref.WeakKeyDictionary()
+
+def _get_current_event():
+	task = _current_task()
+	if task is None:
+		return None
+	return _task_events.get(task)
+
+class AsyncALHProtocol(ALHProtocol):
+	"""Base class for an asyncio ALH protocol service.
+
+	Implementations of this interface should override _get() and _post()
+	coroutines.
+
+	Requests are passed to instrumentation hooks in `HOOKS` the same way as
+	in :py:class:`vesna.alh.ALHProtocol`.
+	"""
+
+	@cast_args_to_bytes
+	async def get(self, resource, *args):
+		"""Issue a GET request to the service.
+
+		Raises an ALHException in case of an error.
+
+		:param resource: resource to issue request to
+		:param args: arbitrary string arguments for the request
+
+		:return: :py:class:`vesna.alh.ALHResponse` object
+		"""
+		if self.HOOKS:
+			rv = await self._instrument("get", resource, args, None,
+					lambda: self._get(resource, *args))
+		else:
+			rv = await self._get(resource, *args)
+		return ALHResponse(rv)
+
+	@cast_args_to_bytes
+	async def post(self, resource, data, *args):
+		"""Issue a POST request to the service
+
+		Raises an ALHException in case of an error.
+
+		:param resource: resource to issue request to
+		:param data: POST data to attach to the request
+		:param args: arbitrary string arguments for the request
+
+		:return: :py:class:`vesna.alh.ALHResponse` object
+		"""
+		if self.HOOKS:
+			rv = await self._instrument("post", resource, args, data,
+					lambda: self._post(resource, data, *args))
+		else:
+			rv = await self._post(resource, data, *args)
+		return ALHResponse(rv)
+
+	_get_current_event = staticmethod(_get_current_event)
+
+	async def _instrument(self, method, resource, args, data, call):
+		if self._get_current_event() is not None:
+			# nested request, reported by the outer one
+			return await call()
+
+		node, name = self._get_destination(resource, args)
+
+		event = ALHRequestEvent(method, node, name)
+		event.bytes_out = len(resource) + sum(len(arg) for arg in args)
+		if data is not None:
+			event.bytes_out += len(data)
+
+		task = _current_task()
+		_task_events[task] = event
+		time_start = time.time()
+		try:
+			rv = await call()
+			event.bytes_in = len(rv)
+			return rv
+		except Exception as e:
+			event.error = e.__class__.__name__
+			raise
+		finally:
+			event.latency = time.time() - time_start
+			del _task_events[task]
+			self._run_hooks(event)
+
+	async def _send_with_retry(self, data, binary=False):
+
+		for retry in range(self.RETRIES):
+			try:
+				return await self._send_with_error(data, binary)
+			except ALHException as e:
+				if retry == self.RETRIES - 1:
+					raise e
+				else:
+					log.exception("retrying (%d)" % (retry+1,))
+
+					event = self._get_current_event()
+					if event is not None:
+						event.retries += 1
+
+class AsyncALHTerminal(AsyncALHProtocol):
+	"""ALH protocol implementation through a stream.
+
+	This is the asyncio counterpart of :py:class:`vesna.alh.ALHTerminal`. It
+	can be used with any pair of asyncio streams, for example a TCP or SSL
+	connection from a coordinator, or a serial line opened with the
+	`pyserial-asyncio` package.
+
+	Requests from concurrent tasks are serialized.
+
+	:param reader: a :py:class:`asyncio.StreamReader` object
+	:param writer: a :py:class:`asyncio.StreamWriter` object
+	"""
+	RESPONSE_TERMINATOR = ALHTerminal.RESPONSE_TERMINATOR
+
+	def __init__(self, reader, writer):
+		self.reader = reader
+		self.writer = writer
+
+		self._lock = None
+
+	async def _send(self, data):
+		self.writer.write(data)
+		await self.writer.drain()
+
+		try:
+			resp = await self.reader.readuntil(self.RESPONSE_TERMINATOR)
+		except asyncio.IncompleteReadError:
+			raise TerminalError
+		except asyncio.LimitOverrunError:
+			raise TerminalError("response too long")
+
+		return resp[:-len(self.RESPONSE_TERMINATOR)]
+
+	async def _recover(self):
+		await self._send(b"\r\n" * 5)
+
+	async def _send_with_error(self, data, binary=False):
+		if self._lock is None:
+			self._lock = asyncio.Lock()
+
+		# Hold the lock over the recovery, so that requests from other
+		# tasks don't end up in a parser that is in junk state.
+		async with self._lock:
+			resp = await self._send(data)
+			if resp.endswith(JunkInput.TERMINATOR):
+				await self._recover()
+				raise JunkInput(resp)
+
+		if resp.endswith(CorruptedData.TERMINATOR):
+			raise CorruptedData(resp)
+
+		self._check_for_sneaky_error(resp, binary)
+		self._log_response(resp)
+
+		return resp
+
+	async def _get(self, resource, *args):
+		self._log_request("GET", resource, args)
+
+		return await self._send_with_retry(ALHTerminal._format_get(resource, args),
+				self._is_binary_resource(resource, args))
+
+	async def _post(self, resource, data, *args):
+		self._log_request("POST", resource, args, data)
+
+		return await self._send_with_retry(ALHTerminal._format_post(resource, data, args),
+				self._is_binary_resource(resource, args))
+
+	def close(self):
+		"""Close the underlying stream.
+		"""
+		self.writer.close()
+
+class _NoResponse(TerminalError):
+	# Connection was closed before any part of the response arrived.
+	pass
+
+class _HTTPConnection:
+	def __init__(self, reader, writer):
+		self.reader = reader
+		self.writer = writer
+		self.last_used = time.time()
+
+	def close(self):
+		self.writer.close()
+
+class AsyncALHWeb(AsyncALHProtocol):
+	"""ALH protocol implementation through the HTTP infrastructure server.
+
+	This is the asyncio counterpart of :py:class:`vesna.alh.ALHWeb`. It
+	implements a minimal HTTP/1.1 client with persistent connections on top
+	of asyncio streams.
+
+	Credentials for basic authentication are read from `alhrc` files in
+	the same way as for :py:class:`vesna.alh.ALHWeb`.
+
+	:param base_url: base URL of the HTTP API (e.g. `https://crn.log-a-tec.eu/communicator`)
+	:param cluster_id: numerical cluster id
+	:param pool_size: maximum number of concurrent connections to the host
+	:param idle_timeout: time in seconds after which idle connections are closed
+	:param credentials: optional :py:class:`vesna.alh.credentials.ALHRCCredentials`
+	                    object to use instead of the shared one
+	:param backoff: optional :py:class:`vesna.alh.ALHBackoff` object that
+	                defines how to wait for a busy communicator
+	"""
+
+	UA = ALHWeb.UA
+
+	BUSY_RESPONSE = ALHWeb.BUSY_RESPONSE
+
+	def __init__(self, base_url, cluster_id, pool_size=4, idle_timeout=60.0, credentials=None,
+			backoff=None):
+		self.base_url = base_url
+		self.cluster_id = cluster_id
+
+		o = urlparse(base_url)
+		self.host = o.netloc
+		self.path = o.path or '/'
+
+		if o.scheme == 'https':
+			self._port = o.port or 443
+
+			self._ssl = ssl.create_default_context()
+			self._ssl.check_hostname = False
+			self._ssl.verify_mode = ssl.CERT_NONE
+		else:
+			self._port = o.port or 80
+			self._ssl = None
+
+		self._hostname = o.hostname
+
+		self.pool_size = pool_size
+		self.idle_timeout = idle_timeout
+
+		if credentials is None:
+			credentials = ALHRCCredentials.get_default()
+
+		self.credentials = credentials
+
+		if backoff is None:
+			backoff = ALHBackoff()
+
+		self.backoff = backoff
+
+		self._busy_lock = threading.Lock()
+		self.busy_time = 0.0
+		self.busy_requests = 0
+
+		self._idle = []
+		self._semaphore = None
+
+	async def _connect(self):
+		while self._idle:
+			conn = self._idle.pop()
+			if self.idle_timeout is not None and \
+					time.time() - conn.last_used > self.idle_timeout:
+				conn.close()
+			else:
+				return conn, True
+
+		try:
+			reader, writer = await asyncio.open_connection(
+					self._hostname, self._port, ssl=self._ssl)
+		except OSError as e:
+			raise TerminalError("connection failed: %s" % (e,))
+
+		return _HTTPConnection(reader, writer), False
+
+	def _release(self, conn):
+		conn.last_used = time.time()
+		self._idle.append(conn)
+
+	def _format_request(self, params):
+		lines = [
+			"GET %s?%s HTTP/1.1" % (self.path, urlencode(params)),
+			"Host: %s" % (self.host,),
+			"User-Agent: %s" % (self.UA,),
+			"Connection: keep-alive",
+		]
+
+		auth = self.credentials.get(self.host)
+		if auth is not None:
+			token = base64.b64encode(("%s:%s" % auth).encode('utf-8'))
+			lines.append("Authorization: Basic %s" % (token.decode('ascii'),))
+
+		return ("\r\n".join(lines) + "\r\n\r\n").encode('ascii')
+
+	@staticmethod
+	async def _read_response(reader):
+		try:
+			status_line = await reader.readline()
+		except OSError:
+			status_line = b""
+
+		if not status_line:
+			raise _NoResponse("connection closed")
+
+		fields = status_line.split(None, 2)
+		version = fields[0]
+		status = int(fields[1])
+
+		headers = {}
+		while True:
+			line = await reader.readline()
+			if line in (b"\r\n", b"\n", b""):
+				break
+
+			key, value = line.decode('latin1').split(':', 1)
+			headers[key.strip().lower()] = value.strip()
+
+		if headers.get('transfer-encoding', '').lower() == 'chunked':
+			chunks = []
+			while True:
+				size = int((await reader.readline()).split(b';')[0], 16)
+				if size == 0:
+					await reader.readline()
+					break
+
+				chunks.append(await reader.readexactly(size))
+				await reader.readline()
+
+			body = b"".join(chunks)
+			keep_alive = True
+		elif 'content-length' in headers:
+			body = await reader.readexactly(int(headers['content-length']))
+			keep_alive = True
+		else:
+			body = await reader.read()
+			keep_alive = False
+
+		connection = headers.get('connection', '').lower()
+		if connection == 'close' or (version == b'HTTP/1.0' and connection != 'keep-alive'):
+			keep_alive = False
+
+		return status, body, keep_alive
+
+	async def _send(self, params):
+		if self._semaphore is None:
+			self._semaphore = asyncio.Semaphore(self.pool_size)
+
+		req = self._format_request(params)
+
+		async with self._semaphore:
+			while True:
+				conn, reused = await self._connect()
+
+				# Server might have closed an idle connection in
+				# the mean time. In that case try again with a new
+				# one. Once the server might have seen the request,
+				# it must not be sent again: POST requests are
+				# not idempotent.
+				try:
+					conn.writer.write(req)
+					await conn.writer.drain()
+				except OSError:
+					conn.close()
+					if reused:
+						continue
+					else:
+						raise TerminalError("connection closed")
+
+				try:
+					status, body, keep_alive = await self._read_response(conn.reader)
+				except _NoResponse:
+					conn.close()
+					if reused:
+						continue
+					else:
+						raise
+				except (OSError, asyncio.IncompleteReadError, TerminalError):
+					conn.close()
+					raise TerminalError("connection closed")
+
+				break
+
+			if keep_alive:
+				self._release(conn)
+			else:
+				conn.close()
+
+		# Raise an exception if we got anything else than a 200 OK
+		if status != 200:
+			raise TerminalError(body.decode('ascii', 'replace'))
+
+		return body
+
+	_is_busy = ALHWeb._is_busy
+	_record_busy_time = ALHWeb._record_busy_time
+
+	async def _send_with_error(self, params, binary=False):
+		# loop until communication channel is free and our request
+		# goes through.
+		state = self.backoff.start()
+		try:
+			while True:
+				resp = await self._send(params)
+				if not self._is_busy(resp):
+					break
+
+				delay = state.next_delay()
+
+				log.info("communicator is busy (have been waiting for %.1f s)" %
+						(time.time() - state.time_start))
+
+				await asyncio.sleep(delay)
+		finally:
+			self._record_busy_time(state)
+
+		self._check_for_sneaky_error(resp, binary)
+
+		self._log_response(resp)
+		return resp
+
+	async def _get(self, resource, *args):
+		self._log_request("GET", resource, args)
+
+		arg = b"".join(args)
+		params = (
+				('method', 'get'),
+				('resource', b'%s?%s' % (resource, arg)),
+				('cluster', str(self.cluster_id)),
+		)
+
+		return await self._send_with_retry(params, self._is_binary_resource(resource, args))
+
+	async def _post(self, resource, data, *args):
+		self._log_request("POST", resource, args, data)
+
+		arg = b"".join(args)
+		params = (
+				('method', 'post'),
+				('resource', b'%s?%s' % (resource, arg)),
+				('content', data),
+				('cluster', str(self.cluster_id)),
+		)
+
+		return await self._send_with_retry(params, self._is_binary_resource(resource, args))
+
+	def close(self):
+		"""Close all idle connections.
+		"""
+		while self._idle:
+			self._idle.pop().close()
+
+class AsyncALHProxy(AsyncALHProtocol):
+	"""ALH protocol implementation through an ALH proxy.
+
+	This is the asyncio counterpart of :py:class:`vesna.alh.ALHProxy`.
+
+	:param alhproxy: asyncio ALH implementation used as a proxy
+	:param addr: ZigBee address of the node to forward requests to
+	:param circuit_breaker: :py:class:`vesna.alh.ALHCircuitBreaker` object to
+	                        use, `True` to use the breaker shared for this node,
+	                        or `None` to always send requests (default)
+	"""
+	def __init__(self, alhproxy, addr, circuit_breaker=None):
+		self.alhproxy = alhproxy
+		self.addr = addr
+
+		if circuit_breaker is True:
+			circuit_breaker = ALHCircuitBreaker.get_shared(alhproxy, addr)
+		self.circuit_breaker = circuit_breaker
+
+	_guard = ALHProxy._guard
+	_get_destination = ALHProxy._get_destination
+	_is_junk_state = ALHProxy._is_junk_state
+	_clean_post_response = ALHProxy._clean_post_response
+
+	async def _recover_remote(self):
+		await self.alhproxy.post("radio/noderesetparser", "1", "%d" % (self.addr,))
+
+	async def _check_for_junk_state(self, e):
+		if self._is_junk_state(e):
+			await self._recover_remote()
+
+	async def _get(self, resource, *args):
+		with self._guard():
+			try:
+				response = await self.alhproxy.get("nodes", b"%d/%s?" % (self.addr, resource), *args)
+			except ALHRandomError as e:
+				await self._check_for_junk_state(e)
+				raise
+
+		return response.content
+
+	async def _post(self, resource, data, *args):
+		with self._guard():
+			try:
+				response = await self.alhproxy.post("nodes", data, b"%d/%s?" % (self.addr, resource), *args)
+			except ALHRandomError as e:
+				await self._check_for_junk_state(e)
+				raise
+
+		return self._clean_post_response(response.content)
@@ -0,0 +1,201 @@
+import collections
+import threading
+import time
+
+from vesna.alh import ALHProtocol, cast_args_to_bytes, cast_to_bytes
+
+class TTLCache(object):
+	"""Least-recently-used cache with an expiry time for each entry.
+
+	:param max_entries: maximum number of entries kept in the cache
+	:param clock: function returning current time in seconds
+	"""
+	def __init__(self, max_entries=128, clock=time.time):
+		self.max_entries = max_entries
+		self.clock = clock
+
+		self._lock = threading.Lock()
+		# key -> (expiry time, value), least recently used first
+		self._entries = collections.OrderedDict()
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+	def get(self, key, default=None):
+		"""Return the cached value for the key.
+
+		:param key: key to look up
+		:param default: value to return if key is not in the cache or has expired
+		"""
+		with self._lock:
+			entry = self._entries.pop(key, None)
+			if entry is None or entry[0] <= self.clock():
+				self.misses += 1
+				return default
+
+			self._entries[key] = entry
+			self.hits += 1
+
+			return entry[1]
+
+	def set(self, key, value, ttl):
+		"""Store a value in the cache.
+
+		:param key: key to store the value under
+		:param value: value to store
+		:param ttl: time in seconds after which the entry expires
+		"""
+		with self._lock:
+			self._entries.pop(key, None)
+			self._entries[key] = (self.clock() + ttl, value)
+
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+
+	def invalidate(self, predicate=None):
+		"""Remove entries from the cache.
+
+		:param predicate: function that is called with the key of each
+		                  entry and returns True if the entry should be
+		                  removed (by default, remove all entries)
+		"""
+		with self._lock:
+			if predicate is None:
+				keys = list(self._entries)
+			else:
+				keys = [ key for key in self._entries if predicate(key) ]
+
+			for key in keys:
+				del self._entries[key]
+
+			self.invalidations += len(keys)
+
+	def __len__(self):
+		with self._lock:
+			return len(self._entries)
+
+	def get_stats(self):
+		"""Return a dictionary with hit, miss, eviction and invalidation counters.
+		"""
+		with self._lock:
+			return {
+				'entries': len(self._entries),
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'invalidations': self.invalidations,
+			}
+
+class ALHCache(ALHProtocol):
+	"""Caching wrapper for an ALH implementation.
+
+	Responses to GET requests for resources listed in `ttls` are cached
+	for the given time. All other requests are passed through. Requests
+	forwarded through the `nodes` resource are cached separately for
+	each node, so the wrapper can be used either around a single node or
+	around a coordinator::
+
+	    coor = ALHCache(ALHWeb("https://crn.log-a-tec.eu/communicator", 10001))
+	    node = ALHProxy(coor, 19)
+
+	A POST request removes cached responses that it might have changed.
+	By default, a POST invalidates GET responses from the same resource on
+	the same node. The `invalidations` dictionary can map a POST resource
+	to a list of GET resources it invalidates, or to None to invalidate
+	all responses from the node (for example after a restart).
+
+	:param alh: ALH implementation to wrap
+	:param ttls: dictionary mapping resource names to time to live in seconds
+	             (by default, `DEFAULT_TTLS`)
+	:param invalidations: dictionary mapping POST resource names to GET resources
+	                      they invalidate (by default, `DEFAULT_INVALIDATIONS`)
+	:param max_entries: maximum number of cached responses
+	"""
+
+	DEFAULT_TTLS = {
+		b"hello": 300.0,
+		b"sensing/deviceConfigList": 300.0,
+		b"generator/deviceConfigList": 300.0,
+		b"radio/settings": 60.0,
+	}
+
+	DEFAULT_INVALIDATIONS = {
+		b"prog/doRestart": None,
+		b"prog/nextFirmwareImage": None,
+	}
+
+	def __init__(self, alh, ttls=None, invalidations=None, max_entries=128):
+		self.alh = alh
+
+		if ttls is None:
+			ttls = self.DEFAULT_TTLS
+		if invalidations is None:
+			invalidations = self.DEFAULT_INVALIDATIONS
+
+		self.ttls = dict((cast_to_bytes(k), v) for k, v in ttls.items())
+		self.invalidations = dict((cast_to_bytes(k), v) for k, v in invalidations.items())
+
+		self.cache = TTLCache(max_entries)
+
+	@cast_args_to_bytes
+	def get(self, resource, *args):
+		addr, name = self._split_resource(resource, args)
+
+		ttl = self.ttls.get(name)
+		if ttl is None:
+			return self.alh.get(resource, *args)
+
+		key = (addr, name, resource, args)
+
+		response = self.cache.get(key)
+		if response is None:
+			response = self.alh.get(resource, *args)
+			self.cache.set(key, response, ttl)
+
+		return response
+
+	@cast_args_to_bytes
+	def post(self, resource, data, *args):
+		addr, name = self._split_resource(resource, args)
+
+		try:
+			return self.alh.post(resource, data, *args)
+		finally:
+			# Invalidate even if the request failed, since we
+			# don't know whether the node processed it.
+			self._invalidate_after_post(addr, name)
+
+	def _invalidate_after_post(self, addr, name):
+		if name in self.invalidations:
+			names = self.invalidations[name]
+		else:
+			names = (name,)
+
+		if names is None:
+			self.cache.invalidate(lambda key: key[0] == addr)
+		else:
+			names = set(cast_to_bytes(n) for n in names)
+			self.cache.invalidate(lambda key: key[0] == addr and key[1] in names)
+
+	def invalidate(self, resource=None, addr=None):
+		"""Remove cached responses.
+
+		:param resource: only remove responses from this resource
+		:param addr: only remove responses from the node with this address
+		"""
+		if resource is not None:
+			resource = cast_to_bytes(resource)
+
+		def predicate(key):
+			return (resource is None or key[1] == resource) and \
+				(addr is None or key[0] == addr)
+
+		self.cache.invalidate(predicate)
+
+	def get_stats(self):
+		"""Return a dictionary with cache hit and miss counters.
+		"""
+		return self.cache.get_stats()
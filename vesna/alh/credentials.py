@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+class ALHRCCredentials(object):
+	"""Credentials for HTTP basic authentication, as used by :py:class:`vesna.alh.ALHWeb`.
+
+	Credentials are read from `alhrc` files. Format of the file is as in
+	the following example::
+
+	    Host example.com
+	    User <username>
+	    Password <password>
+	    # more Host, User, Password lines can follow
+
+	Files are parsed only once and the result is cached. Modification
+	times of files are checked at most once every `check_interval`
+	seconds and the cache is refreshed if any of the files changed.
+
+	If the same host appears in several files, the file that comes first
+	in the list of paths takes precedence.
+
+	Credentials can also be set programmatically with :py:meth:`set`. These
+	take precedence over the ones read from files.
+
+	:param paths: list of paths to read (by default, `alhrc` in the current
+	              directory, `/etc/alhrc` and `.alhrc` in the home directory)
+	:param check_interval: minimum time in seconds between checks for modified files
+	"""
+
+	_default = None
+	_default_lock = threading.Lock()
+
+	def __init__(self, paths=None, check_interval=1.0):
+		if paths is None:
+			paths = self.get_default_paths()
+
+		self.paths = paths
+		self.check_interval = check_interval
+
+		self._lock = threading.Lock()
+		self._injected = {}
+		self._parsed = None
+		self._mtimes = None
+		self._last_check = None
+
+	@classmethod
+	def get_default(cls):
+		"""Return the instance shared by all :py:class:`vesna.alh.ALHWeb` objects
+		that were not given explicit credentials.
+		"""
+		with cls._default_lock:
+			if cls._default is None:
+				cls._default = cls()
+
+			return cls._default
+
+	@staticmethod
+	def get_default_paths():
+		paths = [
+				'alhrc',
+				'/etc/alhrc',
+			]
+
+		home = os.environ.get('HOME')
+		if home is not None:
+			paths.append(os.path.join(home, '.alhrc'))
+
+		return paths
+
+	def set(self, host, user, passwd):
+		"""Set credentials to use for the given host.
+
+		:param host: host name (and port, if not default)
+		:param user: user name
+		:param passwd: password
+		"""
+		with self._lock:
+			self._injected[host] = (user, passwd)
+
+	def remove(self, host):
+		"""Remove credentials for the given host previously set with :py:meth:`set`.
+
+		:param host: host name (and port, if not default)
+		"""
+		with self._lock:
+			self._injected.pop(host, None)
+
+	def invalidate(self):
+		"""Discard cached contents of files, forcing them to be read again
+		on next use.
+		"""
+		with self._lock:
+			self._parsed = None
+
+	def get(self, host):
+		"""Return credentials for the given host.
+
+		:param host: host name (and port, if not default)
+		:return: tuple of user name and password or None if no credentials are known
+		"""
+		with self._lock:
+			creds = self._injected.get(host)
+			if creds is not None:
+				return creds
+
+			now = time.time()
+			if self._parsed is None or self._last_check is None or \
+					now - self._last_check >= self.check_interval:
+				mtimes = self._get_mtimes()
+				if self._parsed is None or mtimes != self._mtimes:
+					self._parsed = self._parse_all()
+					self._mtimes = mtimes
+
+				self._last_check = now
+
+			return self._parsed.get(host)
+
+	def _get_mtimes(self):
+		mtimes = []
+		for path in self.paths:
+			try:
+				st = os.stat(path)
+			except OSError:
+				mtimes.append(None)
+			else:
+				mtimes.append((st.st_mtime, st.st_size))
+
+		return mtimes
+
+	def _parse_all(self):
+		log.debug("reading credentials from %s" % (', '.join(self.paths),))
+
+		parsed = {}
+
+		for path in self.paths:
+			try:
+				with open(path) as f:
+					for host, creds in self._parse(f):
+						if host not in parsed:
+							parsed[host] = creds
+			except IOError:
+				pass
+
+		return parsed
+
+	@staticmethod
+	def _parse(f):
+		host = None
+		user = None
+		passwd = None
+
+		for line in f:
+			if line.startswith('#'):
+				continue
+
+			try:
+				key, value = line.strip().split()
+			except ValueError:
+				continue
+
+			if (key == 'Host'):
+				host = value
+				user = None
+				passwd = None
+			elif host and (key == 'User'):
+				user = value
+			elif host and (key == 'Password'):
+				passwd = value
+
+			if host and user and passwd:
+				yield host, (user, passwd)
+				host = None
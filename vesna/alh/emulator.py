@@ -0,0 +1,507 @@
+"""Emulated VESNA sensor network.
+
+The classes in this module implement the ALH resources used by this
+library on emulated nodes, so that experiment code can be tested and
+load-tested without hardware::
+
+    nodes = [ EmulatedNode(addr, hops=2) for addr in range(2, 202) ]
+    coor = EmulatedCoordinator(nodes, hop_latency=.05, loss=.01)
+
+    node = ALHProxy(coor, 17)
+    node.get("hello")
+
+:py:class:`EmulatedCoordinator` can be used directly as an ALH
+implementation. :py:class:`EmulatorServer` serves it over HTTP on
+localhost, so that it can be accessed through
+:py:class:`vesna.alh.ALHWeb`.
+"""
+import binascii
+import logging
+import random
+import re
+import struct
+import threading
+import time
+
+try:
+	# Python 2.x
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import ThreadingMixIn
+	from urllib import unquote as _unquote
+except ImportError:
+	# Python 3.x
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+	from socketserver import ThreadingMixIn
+	from urllib.parse import unquote_to_bytes as _unquote
+
+from vesna.alh import ALHProtocol, ALHWeb
+
+log = logging.getLogger(__name__)
+
+_NODES_ARG_RE = re.compile(b"([0-9]+)/([^?]*)\\?(.*)", re.DOTALL)
+
+def _crc32(data):
+	return binascii.crc32(data) & 0xffffffff
+
+def _parse_args(arg):
+	args = {}
+	for field in arg.split(b"&"):
+		if b"=" in field:
+			name, value = field.split(b"=", 1)
+			args[name] = value
+	return args
+
+class _SensingSlot(object):
+	def __init__(self, time_start, time_duration, config, start_ch, step_ch, stop_ch):
+		self.time_start = time_start
+		self.time_duration = time_duration
+		self.config = config
+		self.start_ch = start_ch
+		self.step_ch = step_ch
+		self.stop_ch = stop_ch
+
+		self.data = None
+
+class EmulatedNode(object):
+	"""Emulated sensor node.
+
+	The node emulates a spectrum sensor and a signal generator with the
+	devices described in `SENSING_DEVICES` and `GENERATOR_DEVICES`.
+	Spectrum sensing programs are executed in emulated time: results
+	become available after the programmed time has passed, but no
+	actual work is done in the meantime. Measurements are random noise.
+
+	:param addr: address of the node
+	:param hops: number of radio hops between the coordinator and the node
+	:param neighbors: list of addresses reported by `radio/neighbors`
+	:param seed: seed for generated measurements
+	:param clock: function returning current time in seconds
+	"""
+
+	APPLICATION = "EmulatedNode"
+	VERSION = "2.50"
+
+	# device id -> (device name, list of configs). Each config is a
+	# tuple (name, base Hz, spacing Hz, bandwidth Hz, channels, time ms).
+	SENSING_DEVICES = {
+		0: ("Emulated spectrum sensor", [
+			("2.4 GHz ISM, 1 MHz channels", 2400000000, 1000000, 1000000, 100, 1),
+			("UHF, 8 MHz channels", 470000000, 8000000, 8000000, 49, 5),
+		]),
+	}
+
+	# device id -> (device name, list of configs). Each config is a
+	# tuple (name, base Hz, spacing Hz, bandwidth Hz, channels, min
+	# power dBm, max power dBm, time ms).
+	GENERATOR_DEVICES = {
+		0: ("Emulated signal generator", [
+			("2.4 GHz ISM, 1 MHz channels", 2400000000, 1000000, 1000000, 100, -55, 0, 1),
+		]),
+	}
+
+	def __init__(self, addr, hops=1, neighbors=(), seed=None, clock=time.time):
+		self.addr = addr
+		self.hops = hops
+		self.neighbors = list(neighbors)
+		self.clock = clock
+
+		if seed is None:
+			seed = addr
+		self._seed = seed
+
+		self._lock = threading.Lock()
+		self._time_boot = clock()
+		self._slots = {}
+		self.generator_programs = []
+
+		self._handlers = {
+			(b"get", b"hello"): self._get_hello,
+			(b"get", b"uptime"): self._get_uptime,
+			(b"get", b"radio/neighbors"): self._get_neighbors,
+			(b"get", b"sensing/deviceConfigList"): self._get_sensing_config_list,
+			(b"post", b"sensing/freeUpDataSlot"): self._post_free_slot,
+			(b"post", b"sensing/program"): self._post_sensing_program,
+			(b"get", b"sensing/slotInformation"): self._get_slot_information,
+			(b"get", b"sensing/slotDataBinary"): self._get_slot_data,
+			(b"post", b"sensing/quickSweepBin"): self._post_quick_sweep,
+			(b"get", b"generator/deviceConfigList"): self._get_generator_config_list,
+			(b"post", b"generator/program"): self._post_generator_program,
+		}
+
+	def handle(self, method, resource, arg, data=None):
+		"""Handle a request and return the response.
+
+		:param method: `b"get"` or `b"post"`
+		:param resource: resource name
+		:param arg: request arguments (part of the request after `?`)
+		:param data: POST data
+		:return: response as a :py:class:`bytes` object
+		"""
+		handler = self._handlers.get((method, resource))
+		if handler is not None:
+			with self._lock:
+				return handler(arg, data)
+		elif method == b"post" and resource.startswith(b"prog/"):
+			return b"OK"
+		else:
+			return b"ERROR: Resource not found: " + resource
+
+	def _get_hello(self, arg, data):
+		return ("%s version %s" % (self.APPLICATION, self.VERSION)).encode('ascii')
+
+	def _get_uptime(self, arg, data):
+		return ("%.0f" % (self.clock() - self._time_boot,)).encode('ascii')
+
+	def _get_neighbors(self, arg, data):
+		lines = [ "Nr | MAC address | Network address | Address | LQI | RSSI" ]
+		for n, addr in enumerate(self.neighbors):
+			lines.append("%d | 00:00:00:00:00:00:%02x:%02x | %04x | %d | 255 | -50" % (
+				n, addr >> 8, addr & 0xff, addr, addr))
+		return "\r\n".join(lines).encode('ascii')
+
+	@staticmethod
+	def _format_config_list(devices, config_format):
+		lines = []
+		for dev_id in sorted(devices):
+			name, configs = devices[dev_id]
+			lines.append("dev #%d, %s, %d configs:" % (dev_id, name, len(configs)))
+			for cfg_id, config in enumerate(configs):
+				lines.append("  cfg #%d: %s:" % (cfg_id, config[0]))
+				lines.append(config_format % config[1:])
+		return "\n".join(lines).encode('ascii')
+
+	def _get_sensing_config_list(self, arg, data):
+		return self._format_config_list(self.SENSING_DEVICES,
+				"     base: %d Hz, spacing: %d Hz, bw: %d Hz, channels: %d, time: %d ms")
+
+	def _get_generator_config_list(self, arg, data):
+		return self._format_config_list(self.GENERATOR_DEVICES,
+				"     base: %d Hz, spacing: %d Hz, bw: %d Hz, channels: %d, "
+				"min power: %d dBm, max power: %d dBm, time: %d ms")
+
+	def _get_sensing_config(self, dev_id, cfg_id):
+		try:
+			return self.SENSING_DEVICES[dev_id][1][cfg_id]
+		except (KeyError, IndexError):
+			return None
+
+	def _get_slot_id(self, arg):
+		try:
+			return int(_parse_args(arg)[b"id"])
+		except (KeyError, ValueError):
+			return None
+
+	def _post_free_slot(self, arg, data):
+		slot_id = self._get_slot_id(arg)
+		if slot_id is None:
+			return b"ERROR: Invalid slot id"
+
+		self._slots.pop(slot_id, None)
+		return b"OK"
+
+	def _post_sensing_program(self, arg, data):
+		g = re.match(b"in ([0-9]+) sec for ([0-9]+) sec with dev ([0-9]+) conf ([0-9]+) "
+				b"ch ([0-9]+):([0-9]+):([0-9]+) to slot ([0-9]+)", data)
+		if g is None:
+			return b"ERROR: Invalid program"
+
+		v = [ int(x) for x in g.groups() ]
+
+		config = self._get_sensing_config(v[2], v[3])
+		if config is None or v[5] < 1 or not (v[4] < v[6] <= config[4]):
+			return b"ERROR: Invalid configuration"
+
+		self._slots[v[7]] = _SensingSlot(self.clock() + v[0], v[1], config, v[4], v[5], v[6])
+		return b"OK"
+
+	def _generate_sweep(self, rand, num_channels):
+		return [ int(-10000 + 1000 * rand.random()) for n in range(num_channels) ]
+
+	def _generate_slot_data(self, slot_id, slot):
+		rand = random.Random("%s/%d" % (self._seed, slot_id))
+
+		num_channels = len(range(slot.start_ch, slot.stop_ch, slot.step_ch))
+		sweep_ms = max(num_channels * slot.config[5], 1)
+
+		fmt = "<i%dh" % (num_channels,)
+
+		chunks = []
+		for t in range(0, slot.time_duration * 1000, sweep_ms):
+			chunks.append(struct.pack(fmt, t, *self._generate_sweep(rand, num_channels)))
+
+		return b"".join(chunks)
+
+	def _get_slot_information(self, arg, data):
+		slot_id = self._get_slot_id(arg)
+		if slot_id is None:
+			return b"ERROR: Invalid slot id"
+
+		slot = self._slots.get(slot_id)
+		if slot is None:
+			status = "EMPTY"
+			size = 0
+		elif self.clock() < slot.time_start + slot.time_duration:
+			status = "IN_PROGRESS"
+			size = 0
+		else:
+			if slot.data is None:
+				slot.data = self._generate_slot_data(slot_id, slot)
+			status = "COMPLETE"
+			size = len(slot.data)
+
+		return ("id=%d status=%s size=%d" % (slot_id, status, size)).encode('ascii')
+
+	def _get_slot_data(self, arg, data):
+		args = _parse_args(arg)
+		try:
+			slot = self._slots[int(args[b"id"])]
+			start = int(args[b"start"])
+			size = int(args[b"size"])
+		except (KeyError, ValueError):
+			return b"ERROR: Invalid slot"
+
+		if slot.data is None:
+			return b"ERROR: Slot not complete"
+
+		chunk = slot.data[start:start+size]
+		return chunk + struct.pack("<I", _crc32(chunk))
+
+	def _post_quick_sweep(self, arg, data):
+		g = re.match(b"dev ([0-9]+) conf ([0-9]+) ch ([0-9]+):([0-9]+):([0-9]+)", data)
+		if g is None:
+			return b"ERROR: Invalid sweep"
+
+		dev_id, cfg_id, start_ch, step_ch, stop_ch = [ int(x) for x in g.groups() ]
+
+		config = self._get_sensing_config(dev_id, cfg_id)
+		if config is None or step_ch < 1 or not (start_ch < stop_ch <= config[4]):
+			return b"ERROR: Invalid configuration"
+
+		num_channels = len(range(start_ch, stop_ch, step_ch))
+
+		rand = random.Random()
+		sweep = struct.pack("<%dh" % (num_channels,), *self._generate_sweep(rand, num_channels))
+		return sweep + struct.pack("<I", _crc32(sweep))
+
+	def _post_generator_program(self, arg, data):
+		for line in data.split(b"\n"):
+			g = re.match(b"in ([0-9]+) sec for ([0-9]+) sec with dev ([0-9]+) conf ([0-9]+) "
+					b"channel ([0-9]+) power (-?[0-9]+)", line)
+			if g is None:
+				return b"ERROR: Invalid program"
+
+			self.generator_programs.append(tuple(int(x) for x in g.groups()))
+
+		return b"OK"
+
+class EmulatedCoordinator(ALHProtocol):
+	"""Emulated coordinator of a sensor network.
+
+	Requests to the `nodes` resource are forwarded to emulated nodes.
+	Other requests are handled by the coordinator itself, which behaves
+	like an :py:class:`vesna.alh.emulator.EmulatedNode` with address 0.
+
+	Like the real coordinator, it handles one request at a time. Each
+	forwarded request takes `hop_latency` seconds for every hop between
+	the coordinator and the node. On each hop, a request is lost with
+	probability `loss`. A lost request returns an error after
+	`loss_timeout` seconds.
+
+	When served over HTTP by :py:class:`vesna.alh.emulator.EmulatorServer`,
+	requests that arrive while another request is in progress get a
+	"communication in progress" response. Additionally, a request gets
+	that response with probability `busy`, which emulates other users of
+	the testbed.
+
+	:param nodes: list of :py:class:`vesna.alh.emulator.EmulatedNode` objects
+	:param hop_latency: latency in seconds for each hop
+	:param loss: probability that a request is lost on a hop
+	:param loss_timeout: time in seconds before a lost request returns an error
+	:param busy: probability that a request over HTTP gets a busy response
+	:param seed: seed for the random number generator
+	"""
+	def __init__(self, nodes=(), hop_latency=0.0, loss=0.0, loss_timeout=1.0, busy=0.0, seed=None):
+		self.nodes = {}
+		for node in nodes:
+			self.add_node(node)
+
+		self.hop_latency = hop_latency
+		self.loss = loss
+		self.loss_timeout = loss_timeout
+		self.busy = busy
+
+		self.local = EmulatedNode(0, hops=0)
+		self.local.APPLICATION = "EmulatedCoordinator"
+
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+
+		self.requests = 0
+		self.busy_responses = 0
+		self.lost_requests = 0
+
+	def add_node(self, node):
+		"""Add an emulated node to the network.
+
+		:param node: a :py:class:`vesna.alh.emulator.EmulatedNode` object
+		"""
+		self.nodes[node.addr] = node
+
+	def handle(self, method, resource, arg, data=None, block=True):
+		"""Handle a request and return the response.
+
+		:param method: `b"get"` or `b"post"`
+		:param resource: resource name
+		:param arg: request arguments (part of the request after `?`)
+		:param data: POST data
+		:param block: if `False`, return a busy response instead of waiting
+		              for the request in progress
+		:return: response as a :py:class:`bytes` object
+		"""
+		if not block:
+			if self.busy and self._random.random() < self.busy:
+				self.busy_responses += 1
+				return ALHWeb.BUSY_RESPONSE
+
+			if not self._lock.acquire(False):
+				self.busy_responses += 1
+				return ALHWeb.BUSY_RESPONSE
+		else:
+			self._lock.acquire()
+
+		try:
+			self.requests += 1
+
+			if resource == b"nodes":
+				return self._forward(method, arg, data)
+			else:
+				return self.local.handle(method, resource, arg, data)
+		finally:
+			self._lock.release()
+
+	def _forward(self, method, arg, data):
+		g = _NODES_ARG_RE.match(arg)
+		if g is None:
+			return b"ERROR: Invalid node request"
+
+		addr = int(g.group(1))
+		node = self.nodes.get(addr)
+
+		if node is None:
+			lost = True
+		else:
+			p = 1.0 - (1.0 - self.loss) ** node.hops
+			lost = self._random.random() < p
+
+		if lost:
+			self.lost_requests += 1
+			time.sleep(self.loss_timeout)
+			return b"NODES:Node %d is not responding\r\nERROR" % (addr,)
+
+		time.sleep(self.hop_latency * node.hops)
+
+		resp = node.handle(method, g.group(2), g.group(3), data)
+
+		if method == b"post":
+			resp = b"Node #%d return;" % (addr,) + resp
+
+		return resp
+
+	def _send_with_error(self, req, binary=False):
+		resp = self.handle(*req)
+
+		self._check_for_sneaky_error(resp, binary)
+		self._log_response(resp)
+
+		return resp
+
+	def _get(self, resource, *args):
+		self._log_request("GET", resource, args)
+
+		return self._send_with_retry((b"get", resource, b"".join(args)),
+				self._is_binary_resource(resource, args))
+
+	def _post(self, resource, data, *args):
+		self._log_request("POST", resource, args, data)
+
+		return self._send_with_retry((b"post", resource, b"".join(args), data),
+				self._is_binary_resource(resource, args))
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+class _EmulatorRequestHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def _parse_query(self):
+		query = {}
+		for field in self.path.partition("?")[2].split("&"):
+			name, sep, value = field.partition("=")
+			query[name] = _unquote(value.replace("+", " "))
+		return query
+
+	def do_GET(self):
+		query = self._parse_query()
+
+		method = query.get("method", b"").lower()
+		resource, sep, arg = query.get("resource", b"").partition(b"?")
+
+		resp = self.server.coordinator.handle(method, resource, arg,
+				query.get("content"), block=False)
+
+		self.send_response(200)
+		self.send_header("Content-Type", "application/octet-stream")
+		self.send_header("Content-Length", str(len(resp)))
+		self.end_headers()
+
+		self.wfile.write(resp)
+
+	def log_message(self, format, *args):
+		log.debug(format, *args)
+
+class EmulatorServer(object):
+	"""HTTP server for an emulated coordinator.
+
+	The server implements the same web API as the testbed, so that the
+	emulated network can be accessed through :py:class:`vesna.alh.ALHWeb`::
+
+	    server = EmulatorServer(EmulatedCoordinator(nodes))
+	    server.start()
+
+	    coor = ALHWeb(server.url, 10001)
+
+	:param coordinator: a :py:class:`vesna.alh.emulator.EmulatedCoordinator` object
+	:param server_address: address and port to listen on (by default, a
+	                       random free port on localhost)
+	"""
+	def __init__(self, coordinator, server_address=('localhost', 0)):
+		self.coordinator = coordinator
+
+		self.httpd = _ThreadingHTTPServer(server_address, _EmulatorRequestHandler)
+		self.httpd.coordinator = coordinator
+
+		self._thread = None
+
+	@property
+	def url(self):
+		"""Base URL of the server.
+		"""
+		host, port = self.httpd.server_address[:2]
+		return "http://%s:%d/communicator" % (host, port)
+
+	def start(self):
+		"""Start serving requests in a background thread.
+		"""
+		self._thread = threading.Thread(target=self.httpd.serve_forever)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		"""Stop the server and close the listening socket.
+		"""
+		if self._thread is not None:
+			self.httpd.shutdown()
+			self._thread.join()
+			self._thread = None
+
+		self.httpd.server_close()
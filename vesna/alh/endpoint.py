@@ -0,0 +1,631 @@
+"""ALH-to-HTTP endpoint server for asyncio.
+
+A coordinator with a tunnel firmware connects to the endpoint over an SSL
+connection. The endpoint then makes the coordinator available to HTTP
+clients through the same web API as the testbed, so that it can be
+accessed with :py:class:`vesna.alh.ALHWeb`.
+
+Requests from all HTTP clients are put in a queue and sent to the
+coordinator one by one. Waiting for the coordinator does not block
+accepting and reading new HTTP requests. HTTP/1.1 persistent connections
+are supported.
+
+This module requires Python 3.5 or newer.
+"""
+import asyncio
+import itertools
+import logging
+import socket
+import ssl
+import traceback
+import warnings
+from urllib.parse import unquote_to_bytes
+
+from vesna.alh import ALHProtocol, ALHException, TerminalError
+from vesna.alh.aio import AsyncALHTerminal
+from vesna.alh.cache import TTLCache
+from vesna.alh.instrument import Histogram, DEFAULT_LATENCY_BUCKETS
+
+log = logging.getLogger(__name__)
+
+class _HTTPError(Exception):
+	def __init__(self, status, message):
+		super().__init__(message)
+		self.status = status
+		self.message = message
+
+class _Job:
+	def __init__(self, method, resource, args, data):
+		self.method = method
+		self.resource = resource
+		self.args = args
+		self.data = data
+
+		self.priority = ALHProtocol._get_priority(method, resource, (args,))
+
+		# set if the coordinator returned an error
+		self.failed = False
+
+		self.future = asyncio.get_event_loop().create_future()
+
+class _ResourceMetrics:
+	def __init__(self):
+		self.requests = 0
+		self.errors = 0
+		self.latency = Histogram(DEFAULT_LATENCY_BUCKETS)
+
+def _escape_label(value):
+	return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labels):
+	return ",".join('%s="%s"' % (name, _escape_label(value)) for name, value in labels)
+
+def _parse_query(query):
+	params = {}
+	for field in query.split("&"):
+		name, sep, value = field.partition("=")
+		params[name] = unquote_to_bytes(value.replace("+", " "))
+	return params
+
+class ALHEndpoint:
+	"""Endpoint that serves a coordinator connected over a tunnel to HTTP
+	clients.
+
+	Use :py:meth:`handle_tunnel` and :py:meth:`handle_http` as client
+	connection callbacks for :py:func:`asyncio.start_server`, or use
+	:py:func:`vesna.alh.endpoint.serve` to set up both servers.
+
+	Only one coordinator tunnel is used at a time. A new tunnel connection
+	replaces the old one.
+
+	Queued requests are served in order of their priority class (see
+	`HIGH_PRIORITY_RESOURCES` and `LOW_PRIORITY_RESOURCES` in
+	:py:class:`vesna.alh.ALHProtocol`), so that programming a node does
+	not wait behind bulk data retrieval. Requests in the same class are
+	served in order of arrival.
+
+	A GET request that is identical to one already waiting for the
+	coordinator is not sent again. It gets the response of the request
+	in progress. Responses to GET requests for resources listed in
+	`cache_ttls` are additionally cached for the given time. Requests
+	forwarded through the `nodes` resource are matched by the resource
+	name on the node. A POST request to a node removes all cached
+	responses from that node.
+
+	Metrics in the Prometheus text format are served on `metrics_path`
+	(see :py:meth:`format_metrics`).
+
+	:param cluster_id: cluster ID that HTTP clients must use
+	:param path: path of the web API
+	:param cache_ttls: dictionary mapping resource names to time to live
+	                   of cached responses in seconds
+	:param metrics_path: path of the metrics page, or `None` to disable it
+	"""
+
+	METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+	STATUS_REASONS = {
+		200: "OK",
+		400: "Bad Request",
+		404: "Not Found",
+		500: "Internal Server Error",
+		503: "Service Unavailable",
+	}
+
+	def __init__(self, cluster_id, path="/communicator", cache_ttls=None,
+			metrics_path="/metrics"):
+		self.cluster_id = cluster_id
+		self.path = path
+		self.metrics_path = metrics_path
+
+		self.alh = None
+		self._tunnel_closed = None
+
+		self._queue = None
+		self._worker = None
+		self._seq = itertools.count()
+
+		# (addr, name, resource, args) -> future of the GET request in progress
+		self._in_flight = {}
+
+		if cache_ttls is None:
+			cache_ttls = {}
+		self.cache_ttls = dict(
+			(k if isinstance(k, bytes) else k.encode('ascii'), v)
+			for k, v in cache_ttls.items())
+		self.cache = TTLCache()
+
+		self.requests = 0
+		self.coalesced_requests = 0
+		self.cache_hits = 0
+
+		self.tunnel_connections = 0
+		self.terminal_errors = 0
+		self.bytes_sent = 0
+		self.bytes_received = 0
+
+		# (method, resource name) -> _ResourceMetrics
+		self._resource_metrics = {}
+
+	def _get_queue(self):
+		if self._queue is None:
+			self._queue = asyncio.PriorityQueue()
+			self._worker = asyncio.ensure_future(self._work())
+
+		return self._queue
+
+	def close(self):
+		"""Stop processing requests and close the tunnel.
+		"""
+		if self._worker is not None:
+			self._worker.cancel()
+			self._worker = None
+			self._queue = None
+
+		self._close_tunnel()
+
+	@property
+	def queue_size(self):
+		"""Number of requests waiting to be sent to the coordinator.
+		"""
+		if self._queue is None:
+			return 0
+		else:
+			return self._queue.qsize()
+
+	def _close_tunnel(self):
+		if self.alh is not None:
+			self.alh.close()
+			self.alh = None
+
+		if self._tunnel_closed is not None:
+			if not self._tunnel_closed.done():
+				self._tunnel_closed.set_result(None)
+			self._tunnel_closed = None
+
+	async def handle_tunnel(self, reader, writer):
+		"""Handle a tunnel connection from a coordinator.
+
+		The coroutine returns after the tunnel has been closed.
+		"""
+		log.info("received tunnel connection from %s" % (writer.get_extra_info('peername'),))
+
+		# Requests are small and the coordinator waits for each one,
+		# so they should not be delayed waiting for more data.
+		sock = writer.get_extra_info('socket')
+		if sock is not None:
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+		self._close_tunnel()
+
+		alh = AsyncALHTerminal(reader, writer)
+		alh.RETRIES = 1
+
+		closed = asyncio.get_event_loop().create_future()
+
+		self.alh = alh
+		self._tunnel_closed = closed
+		self.tunnel_connections += 1
+
+		self._get_queue()
+
+		await closed
+
+		log.info("tunnel connection closed")
+
+	async def request(self, method, resource, args, data=None):
+		"""Queue a request for the coordinator and wait for the response.
+
+		:param method: `"get"` or `"post"`
+		:param resource: resource name
+		:param args: request arguments
+		:param data: POST data
+		:return: response as a :py:class:`bytes` object
+		"""
+		self.requests += 1
+
+		addr, name = ALHProtocol._split_resource(resource, (args,))
+		self._get_resource_metrics(method, name).requests += 1
+
+		if method == "post":
+			# Responses from the node might have changed. Later GET
+			# requests should not join the ones already in progress.
+			self.cache.invalidate(lambda key: key[0] == addr)
+			for key in [ key for key in self._in_flight if key[0] == addr ]:
+				del self._in_flight[key]
+
+			return await self._send(method, resource, args, data)
+
+		key = (addr, name, resource, args)
+
+		ttl = self.cache_ttls.get(name)
+		if ttl is not None:
+			resp = self.cache.get(key)
+			if resp is not None:
+				self.cache_hits += 1
+				return resp
+
+		future = self._in_flight.get(key)
+		if future is not None:
+			self.coalesced_requests += 1
+			return await asyncio.shield(future)
+
+		job = _Job(method, resource, args, data)
+
+		self._in_flight[key] = job.future
+		try:
+			await self._put(job)
+			resp = await asyncio.shield(job.future)
+		finally:
+			if self._in_flight.get(key) is job.future:
+				del self._in_flight[key]
+
+		if ttl is not None and not job.failed:
+			self.cache.set(key, resp, ttl)
+
+		return resp
+
+	async def _send(self, method, resource, args, data):
+		job = _Job(method, resource, args, data)
+		await self._put(job)
+		return await job.future
+
+	async def _put(self, job):
+		await self._get_queue().put((job.priority, next(self._seq), job))
+
+	@property
+	def saved_round_trips(self):
+		"""Number of requests that were answered without a round trip
+		to the coordinator, either by joining an identical request in
+		progress or from the cache.
+		"""
+		return self.coalesced_requests + self.cache_hits
+
+	def get_stats(self):
+		"""Return a dictionary with request counters.
+		"""
+		return {
+			'requests': self.requests,
+			'coalesced_requests': self.coalesced_requests,
+			'cache_hits': self.cache_hits,
+			'saved_round_trips': self.saved_round_trips,
+			'tunnel_connections': self.tunnel_connections,
+			'terminal_errors': self.terminal_errors,
+			'bytes_sent': self.bytes_sent,
+			'bytes_received': self.bytes_received,
+		}
+
+	def _get_resource_metrics(self, method, resource):
+		key = (method, resource.decode('ascii', 'replace'))
+
+		metrics = self._resource_metrics.get(key)
+		if metrics is None:
+			metrics = self._resource_metrics[key] = _ResourceMetrics()
+
+		return metrics
+
+	def format_metrics(self):
+		"""Return endpoint metrics in the Prometheus text format.
+
+		Requests, errors and coordinator latency are labeled with the
+		request method and the resource name (on the node, for requests
+		forwarded through the `nodes` resource). Latency is the round
+		trip time over the tunnel and does not include time spent in
+		the queue. Sent and received bytes count request and response
+		payloads.
+		"""
+		lines = []
+
+		def metric(name, type, help, samples):
+			lines.append("# HELP alh_endpoint_%s %s" % (name, help))
+			lines.append("# TYPE alh_endpoint_%s %s" % (name, type))
+			for suffix, labels, value in samples:
+				if labels:
+					lines.append("alh_endpoint_%s%s{%s} %s" % (
+						name, suffix, _format_labels(labels), value))
+				else:
+					lines.append("alh_endpoint_%s%s %s" % (name, suffix, value))
+
+		items = sorted(self._resource_metrics.items())
+
+		metric("requests_total", "counter",
+				"Requests received from HTTP clients.",
+				[ ("", [("method", method), ("resource", resource)], m.requests)
+					for (method, resource), m in items ])
+
+		metric("errors_total", "counter",
+				"Requests that returned an error from the coordinator.",
+				[ ("", [("method", method), ("resource", resource)], m.errors)
+					for (method, resource), m in items ])
+
+		samples = []
+		for (method, resource), m in items:
+			labels = [("method", method), ("resource", resource)]
+
+			h = m.latency.to_dict()
+			for le, count in h['buckets']:
+				samples.append(("_bucket", labels + [("le", str(le))], count))
+			samples.append(("_sum", labels, repr(h['sum'])))
+			samples.append(("_count", labels, h['count']))
+
+		metric("coordinator_latency_seconds", "histogram",
+				"Round trip time of requests sent to the coordinator.",
+				samples)
+
+		metric("coalesced_requests_total", "counter",
+				"GET requests that joined an identical request in progress.",
+				[ ("", None, self.coalesced_requests) ])
+		metric("cache_hits_total", "counter",
+				"GET requests answered from the cache.",
+				[ ("", None, self.cache_hits) ])
+		metric("queue_depth", "gauge",
+				"Requests waiting to be sent to the coordinator.",
+				[ ("", None, self.queue_size) ])
+		metric("tunnel_connected", "gauge",
+				"Whether a coordinator is connected to the tunnel.",
+				[ ("", None, int(self.alh is not None)) ])
+		metric("tunnel_connections_total", "counter",
+				"Tunnel connections accepted from the coordinator.",
+				[ ("", None, self.tunnel_connections) ])
+		metric("terminal_errors_total", "counter",
+				"Requests that failed because the tunnel connection broke.",
+				[ ("", None, self.terminal_errors) ])
+		metric("sent_bytes_total", "counter",
+				"Bytes of resource names, arguments and data sent to the coordinator.",
+				[ ("", None, self.bytes_sent) ])
+		metric("received_bytes_total", "counter",
+				"Bytes of responses received from the coordinator.",
+				[ ("", None, self.bytes_received) ])
+
+		return "\n".join(lines) + "\n"
+
+	async def _work(self):
+		while True:
+			priority, seq, job = await self._queue.get()
+			if job.future.cancelled():
+				continue
+
+			try:
+				resp = await self._process(job)
+			except asyncio.CancelledError:
+				job.future.cancel()
+				raise
+			except Exception as e:
+				if not job.future.cancelled():
+					job.future.set_exception(e)
+			else:
+				if not job.future.cancelled():
+					job.future.set_result(resp)
+
+	async def _process(self, job):
+		alh = self.alh
+		if alh is None:
+			raise _HTTPError(503, "ERROR: coordinator not connected")
+
+		addr, name = ALHProtocol._split_resource(job.resource, (job.args,))
+		metrics = self._get_resource_metrics(job.method, name)
+
+		self.bytes_sent += len(job.resource) + len(job.args)
+		if job.data is not None:
+			self.bytes_sent += len(job.data)
+
+		loop = asyncio.get_event_loop()
+		time_start = loop.time()
+
+		try:
+			if job.method == "get":
+				resp = await alh.get(job.resource, job.args)
+			else:
+				resp = await alh.post(job.resource, job.data, job.args)
+		except ALHException as e:
+			job.failed = True
+			metrics.errors += 1
+
+			msg = e.args[0] if e.args else b""
+			if isinstance(msg, bytes):
+				content = msg
+			else:
+				content = str(msg).encode('ascii', 'replace')
+		except (TerminalError, OSError):
+			self.terminal_errors += 1
+			if self.alh is alh:
+				self._close_tunnel()
+			raise _HTTPError(500, "ERROR: coordinator closed connection")
+		else:
+			content = resp.content
+
+		metrics.latency.observe(loop.time() - time_start)
+		self.bytes_received += len(content)
+
+		return content
+
+	def _parse_request(self, request_line):
+		try:
+			method, target, version = request_line.split(" ")
+		except ValueError:
+			raise _HTTPError(400, "Invalid request line")
+
+		if method != "GET":
+			raise _HTTPError(400, "Invalid HTTP method: %s" % (method,))
+
+		path, sep, query = target.partition("?")
+
+		if path != self.path:
+			raise _HTTPError(404, "Path not found: %s" % (path,))
+
+		params = _parse_query(query)
+
+		try:
+			cluster_id = int(params['cluster'])
+		except (KeyError, ValueError):
+			raise _HTTPError(400, "Invalid cluster ID")
+
+		if cluster_id != self.cluster_id:
+			raise _HTTPError(400, "Invalid cluster ID: %d" % (cluster_id,))
+
+		alh_method = params.get('method', b"").decode('ascii', 'replace').lower()
+		if alh_method not in ("get", "post"):
+			raise _HTTPError(400, "Invalid method: %s" % (alh_method,))
+
+		resource, sep, args = params.get('resource', b"").partition(b"?")
+
+		if alh_method == "post":
+			data = params.get('content', b"")
+		else:
+			data = None
+
+		return alh_method, resource, args, data
+
+	async def _read_request(self, reader):
+		try:
+			head = await reader.readuntil(b"\r\n\r\n")
+		except (asyncio.IncompleteReadError, ConnectionError):
+			return None
+		except asyncio.LimitOverrunError:
+			raise _HTTPError(400, "Request too long")
+
+		lines = head.decode('latin-1').split("\r\n")
+
+		headers = {}
+		for line in lines[1:]:
+			name, sep, value = line.partition(":")
+			if sep:
+				headers[name.strip().lower()] = value.strip()
+
+		return lines[0], headers
+
+	def _is_metrics_request(self, request_line):
+		if self.metrics_path is None:
+			return False
+
+		fields = request_line.split(" ")
+		return len(fields) == 3 and fields[0] == "GET" and \
+				fields[1].partition("?")[0] == self.metrics_path
+
+	def _write_response(self, writer, status, body, keep_alive,
+			content_type="text/plain"):
+		head = "HTTP/1.1 %d %s\r\n" \
+			"Content-Type: %s\r\n" \
+			"Content-Length: %d\r\n" \
+			"Connection: %s\r\n" \
+			"\r\n" % (
+				status,
+				self.STATUS_REASONS.get(status, ""),
+				content_type,
+				len(body),
+				"keep-alive" if keep_alive else "close")
+
+		writer.write(head.encode('ascii') + body)
+
+	async def handle_http(self, reader, writer):
+		"""Handle a connection from an HTTP client.
+		"""
+		try:
+			while True:
+				try:
+					r = await self._read_request(reader)
+					if r is None:
+						break
+
+					request_line, headers = r
+
+					version = request_line.rpartition(" ")[2]
+					connection = headers.get('connection', '').lower()
+					if version == "HTTP/1.1":
+						keep_alive = connection != "close"
+					else:
+						keep_alive = connection == "keep-alive"
+
+					if self._is_metrics_request(request_line):
+						resp = self.format_metrics().encode('utf-8')
+						content_type = self.METRICS_CONTENT_TYPE
+					else:
+						method, resource, args, data = self._parse_request(request_line)
+						resp = await self.request(method, resource, args, data)
+						content_type = "text/plain"
+
+					status = 200
+				except _HTTPError as e:
+					status = e.status
+					resp = e.message.encode('ascii', 'replace')
+					content_type = "text/plain"
+					keep_alive = False
+				except Exception:
+					log.exception("error handling request")
+					status = 500
+					resp = traceback.format_exc().encode('ascii', 'replace')
+					content_type = "text/plain"
+					keep_alive = False
+
+				self._write_response(writer, status, resp, keep_alive,
+						content_type)
+				await writer.drain()
+
+				if not keep_alive:
+					break
+		except ConnectionError:
+			pass
+		finally:
+			writer.close()
+
+TLS_VERSIONS = ("TLSv1", "TLSv1_1", "TLSv1_2", "TLSv1_3")
+
+def get_ssl_context(certfile, keyfile, min_version="TLSv1"):
+	"""Return an SSL context for the tunnel server.
+
+	Coordinators do not present client certificates, so they are not
+	requested.
+
+	Deployed coordinator firmware only supports TLS 1.0, so by default
+	TLS 1.0 and the ciphers it needs are allowed.
+
+	:param certfile: path to the server certificate
+	:param keyfile: path to the private key
+	:param min_version: oldest TLS version to accept, one of `TLS_VERSIONS`
+	"""
+	if min_version not in TLS_VERSIONS:
+		raise ValueError("Unknown TLS version: %r" % (min_version,))
+
+	context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+	context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+	context.verify_mode = ssl.CERT_NONE
+
+	if hasattr(ssl, 'TLSVersion'):
+		with warnings.catch_warnings():
+			# TLS versions before 1.2 are deprecated in Python 3.10
+			warnings.simplefilter("ignore", DeprecationWarning)
+			context.minimum_version = getattr(ssl.TLSVersion, min_version)
+	else:
+		for version in TLS_VERSIONS[:TLS_VERSIONS.index(min_version)]:
+			context.options |= getattr(ssl, "OP_NO_" + version, 0)
+
+	if TLS_VERSIONS.index(min_version) < TLS_VERSIONS.index("TLSv1_2"):
+		# OpenSSL 1.1.1 and later disable ciphers used by older
+		# TLS versions at the default security level.
+		try:
+			context.set_ciphers("DEFAULT:@SECLEVEL=0")
+		except ssl.SSLError:
+			pass
+
+	context.load_cert_chain(certfile, keyfile)
+	return context
+
+async def serve(endpoint, http_port, tunnel_port, ssl_context, host=None):
+	"""Start the HTTP and tunnel servers for an endpoint.
+
+	:param endpoint: a :py:class:`vesna.alh.endpoint.ALHEndpoint` object
+	:param http_port: port to listen on for HTTP clients
+	:param tunnel_port: port to listen on for the SSL tunnel from the coordinator
+	:param ssl_context: SSL context for the tunnel (see :py:func:`get_ssl_context`)
+	:param host: address to listen on (by default, all interfaces)
+	:return: list of :py:class:`asyncio.AbstractServer` objects
+	"""
+	http_server = await asyncio.start_server(endpoint.handle_http,
+			host, http_port)
+	tunnel_server = await asyncio.start_server(endpoint.handle_tunnel,
+			host, tunnel_port, ssl=ssl_context)
+
+	log.info("listening on port %d for HTTP and port %d for tunnel" % (
+		http_port, tunnel_port))
+
+	return [http_server, tunnel_server]
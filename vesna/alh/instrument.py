@@ -0,0 +1,159 @@
+import bisect
+import json
+import threading
+
+# Upper bounds of histogram buckets. The same bounds can be used as
+# "le" labels of a Prometheus histogram.
+DEFAULT_LATENCY_BUCKETS = (
+		0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+		1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+DEFAULT_SIZE_BUCKETS = (
+		16, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+class Histogram(object):
+	"""Histogram with fixed bucket boundaries.
+
+	:param buckets: sorted list of bucket upper bounds. Values larger than
+	                the last bound are counted in an additional bucket.
+	"""
+	def __init__(self, buckets):
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		"""Add a value to the histogram.
+		"""
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def to_dict(self):
+		"""Return the histogram as a dictionary.
+
+		Bucket counts are cumulative: each count includes all values
+		less than or equal to the bucket's upper bound, like in a
+		Prometheus histogram. The last bucket has the bound `"+Inf"`.
+		"""
+		buckets = []
+		n = 0
+		for le, count in zip(self.buckets + ("+Inf",), self.counts):
+			n += count
+			buckets.append([le, n])
+
+		return {
+			'count': self.count,
+			'sum': self.sum,
+			'buckets': buckets,
+		}
+
+class _RequestStats(object):
+	def __init__(self, latency_buckets, size_buckets):
+		self.requests = 0
+		self.retries = 0
+		self.busy_time = 0.0
+		self.errors = {}
+
+		self.latency = Histogram(latency_buckets)
+		self.bytes_out = Histogram(size_buckets)
+		self.bytes_in = Histogram(size_buckets)
+
+	def record(self, event):
+		self.requests += 1
+		self.retries += event.retries
+		self.busy_time += event.busy_time
+
+		if event.error is not None:
+			self.errors[event.error] = self.errors.get(event.error, 0) + 1
+
+		self.latency.observe(event.latency)
+		self.bytes_out.observe(event.bytes_out)
+		self.bytes_in.observe(event.bytes_in)
+
+	def to_dict(self):
+		return {
+			'requests': self.requests,
+			'retries': self.retries,
+			'busy_time': self.busy_time,
+			'errors': dict(self.errors),
+			'latency': self.latency.to_dict(),
+			'bytes_out': self.bytes_out.to_dict(),
+			'bytes_in': self.bytes_in.to_dict(),
+		}
+
+class ALHInstrument(object):
+	"""Instrumentation hook that aggregates requests into histograms.
+
+	Statistics are kept separately for each node and resource. To
+	collect statistics for all requests in a script::
+
+	    instrument = ALHInstrument()
+	    ALHProtocol.HOOKS = [instrument]
+
+	    ...
+
+	    with open("stats.json", "w") as f:
+	        instrument.dump_json(f)
+
+	:param latency_buckets: upper bounds of latency histogram buckets in seconds
+	:param size_buckets: upper bounds of request and response size
+	                     histogram buckets in bytes
+	"""
+	def __init__(self, latency_buckets=DEFAULT_LATENCY_BUCKETS,
+			size_buckets=DEFAULT_SIZE_BUCKETS):
+		self.latency_buckets = latency_buckets
+		self.size_buckets = size_buckets
+
+		self._lock = threading.Lock()
+		# (node, resource) -> _RequestStats
+		self._stats = {}
+
+	def __call__(self, event):
+		key = (event.node, event.resource)
+
+		with self._lock:
+			stats = self._stats.get(key)
+			if stats is None:
+				stats = self._stats[key] = _RequestStats(
+						self.latency_buckets, self.size_buckets)
+
+			stats.record(event)
+
+	def reset(self):
+		"""Discard all collected statistics.
+		"""
+		with self._lock:
+			self._stats = {}
+
+	def get_stats(self):
+		"""Return collected statistics.
+
+		:return: list of dictionaries, one for each combination of node
+		         and resource. Each dictionary contains the node address
+		         (`None` for requests that were not forwarded), resource
+		         name, number of requests and retries, total time spent
+		         waiting for a busy communicator, number of errors for
+		         each exception class and histograms of latency, request
+		         size and response size.
+		"""
+		with self._lock:
+			items = sorted(self._stats.items(),
+					key=lambda item: (item[0][0] is not None, item[0][0] or 0, item[0][1]))
+
+			result = []
+			for (node, resource), stats in items:
+				d = stats.to_dict()
+				d['node'] = node
+				d['resource'] = resource.decode('ascii', 'replace')
+				result.append(d)
+
+			return result
+
+	def dump_json(self, f):
+		"""Write collected statistics to a file in JSON format.
+
+		:param f: file-like object opened for writing text
+		"""
+		json.dump(self.get_stats(), f, indent=1, sort_keys=True)
@@ -0,0 +1,234 @@
+import base64
+import collections
+import gzip
+import json
+import threading
+import time
+
+import vesna.alh
+from vesna.alh import ALHProtocol, ALHException, cast_args_to_bytes
+
+class ALHReplayError(Exception):
+	"""Raised when a replayed request does not match any recorded request.
+	"""
+	pass
+
+def _open(path, mode):
+	if path.endswith(".gz"):
+		return gzip.open(path, mode)
+	else:
+		return open(path, mode)
+
+def _encode(data):
+	return base64.b64encode(data).decode('ascii')
+
+def _decode(data):
+	return base64.b64decode(data.encode('ascii'))
+
+def _encode_error(e):
+	msg = e.args[0] if e.args else ""
+	if isinstance(msg, bytes):
+		return {'class': e.__class__.__name__, 'data': _encode(msg)}
+	else:
+		return {'class': e.__class__.__name__, 'message': str(msg)}
+
+def _decode_error(error):
+	cls = getattr(vesna.alh, error['class'], None)
+	if not (isinstance(cls, type) and issubclass(cls, (ALHException, IOError))):
+		cls = ALHException
+
+	if 'data' in error:
+		return cls(_decode(error['data']))
+	else:
+		return cls(error['message'])
+
+class ALHRecorder(ALHProtocol):
+	"""Recording wrapper for an ALH implementation.
+
+	All requests are passed to the wrapped implementation. Each request,
+	its response (or the error it raised) and the time it took are
+	written to a file that can later be replayed by
+	:py:class:`vesna.alh.replay.ALHReplay`::
+
+	    coor = ALHRecorder(ALHWeb("https://crn.log-a-tec.eu/communicator", 10001), "trace.jsonl.gz")
+	    node = ALHProxy(coor, 19)
+
+	    ...
+
+	    coor.close()
+
+	The file contains one JSON object per line. Binary data is base64
+	encoded. If the path ends in `.gz`, the file is compressed.
+
+	:param alh: ALH implementation to wrap
+	:param f: path to the file to write, or a file-like object opened
+	          for writing in binary mode
+	"""
+	def __init__(self, alh, f):
+		self.alh = alh
+
+		if isinstance(f, str):
+			self.f = _open(f, "wb")
+			self._close_f = True
+		else:
+			self.f = f
+			self._close_f = False
+
+		self._lock = threading.Lock()
+		self._time_start = time.time()
+
+	def _record(self, method, resource, args, data, call):
+		time_start = time.time()
+
+		rec = collections.OrderedDict()
+		rec['time'] = round(time_start - self._time_start, 6)
+		rec['method'] = method
+		rec['resource'] = resource.decode('latin-1')
+		rec['args'] = [ arg.decode('latin-1') for arg in args ]
+		if data is not None:
+			rec['data'] = _encode(data)
+
+		try:
+			response = call()
+		except Exception as e:
+			rec['error'] = _encode_error(e)
+			raise
+		else:
+			rec['response'] = _encode(response.content)
+			return response
+		finally:
+			rec['latency'] = round(time.time() - time_start, 6)
+
+			line = (json.dumps(rec, separators=(',', ':')) + "\n").encode('ascii')
+			with self._lock:
+				self.f.write(line)
+
+	@cast_args_to_bytes
+	def get(self, resource, *args):
+		return self._record("get", resource, args, None,
+				lambda: self.alh.get(resource, *args))
+
+	@cast_args_to_bytes
+	def post(self, resource, data, *args):
+		return self._record("post", resource, args, data,
+				lambda: self.alh.post(resource, data, *args))
+
+	def close(self):
+		"""Flush the recording and close the file.
+		"""
+		with self._lock:
+			if self._close_f:
+				self.f.close()
+			else:
+				self.f.flush()
+
+class ALHReplay(ALHProtocol):
+	"""ALH implementation that replays a recording.
+
+	Responses are served from a file written by
+	:py:class:`vesna.alh.replay.ALHRecorder`. A request gets the
+	response that was recorded for the same method, resource, arguments
+	and data. Identical requests get their recorded responses in the
+	order they were recorded. Recorded errors are raised again.
+
+	Some requests contain data that depends on the time they were sent
+	(for example relative start times in `sensing/program`). If no
+	recorded request has the same data, a request gets the next
+	recorded response for the same method, resource and arguments.
+
+	If `speed` is `None`, responses are returned immediately. Otherwise
+	recorded timing is reproduced, scaled by `speed` (1.0 for the
+	original speed, 10.0 for ten times faster). A request is not answered
+	before its recorded start time, counted from the first replayed
+	request, and then takes its recorded latency. Pauses between the
+	recorded requests are therefore kept even if the client sends its
+	requests sooner.
+
+	:param f: path to the recording, or a file-like object opened for
+	          reading in binary mode
+	:param speed: replay speed, or `None` to replay without delay
+	"""
+	def __init__(self, f, speed=None):
+		self.speed = speed
+
+		self._lock = threading.Lock()
+		# (method, resource, args) -> deque of (data, recorded request)
+		self._recordings = {}
+
+		# recorded time of the first request
+		self._rec_time_start = None
+		# time when the first request was replayed
+		self._time_start = None
+
+		if isinstance(f, str):
+			with _open(f, "rb") as f2:
+				self._load(f2)
+		else:
+			self._load(f)
+
+	def _load(self, f):
+		for line in f:
+			line = line.strip()
+			if not line:
+				continue
+
+			rec = json.loads(line.decode('ascii'))
+
+			key = self._get_key(rec['method'],
+					rec['resource'].encode('latin-1'),
+					tuple(arg.encode('latin-1') for arg in rec['args']))
+			data = _decode(rec['data']) if 'data' in rec else None
+
+			self._recordings.setdefault(key, collections.deque()).append((data, rec))
+
+			if self._rec_time_start is None or rec['time'] < self._rec_time_start:
+				self._rec_time_start = rec['time']
+
+	@staticmethod
+	def _get_key(method, resource, args):
+		return (method, resource, tuple(args))
+
+	def _replay(self, method, resource, args, data):
+		key = self._get_key(method, resource, args)
+
+		with self._lock:
+			recordings = self._recordings.get(key)
+			if not recordings:
+				raise ALHReplayError("no recorded response for %s %r %r" % (
+					method, resource, args))
+
+			for n, (rec_data, rec) in enumerate(recordings):
+				if rec_data == data:
+					del recordings[n]
+					break
+			else:
+				rec_data, rec = recordings.popleft()
+
+			if self._time_start is None:
+				self._time_start = time.time()
+
+		if self.speed is not None:
+			delay = (rec['time'] - self._rec_time_start) / self.speed \
+					- (time.time() - self._time_start)
+			if delay > 0:
+				time.sleep(delay)
+
+			time.sleep(rec['latency'] / self.speed)
+
+		if 'error' in rec:
+			raise _decode_error(rec['error'])
+
+		return _decode(rec['response'])
+
+	def _get(self, resource, *args):
+		return self._replay("get", resource, args, None)
+
+	def _post(self, resource, data, *args):
+		return self._replay("post", resource, args, data)
+
+	@property
+	def remaining(self):
+		"""Number of recorded requests that have not been replayed yet.
+		"""
+		with self._lock:
+			return sum(len(recordings) for recordings in self._recordings.values())
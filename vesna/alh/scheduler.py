@@ -0,0 +1,194 @@
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from vesna.alh import ALHProtocol, cast_args_to_bytes
+
+log = logging.getLogger(__name__)
+
+class _Ticket(object):
+	def __init__(self, node, priority):
+		self.node = node
+		self.priority = priority
+		self.time_queued = time.time()
+		self.event = threading.Event()
+
+class ALHScheduler(ALHProtocol):
+	"""Request scheduler for a coordinator shared by many threads.
+
+	The scheduler owns the coordinator object and serializes all requests
+	to it. It can be used in place of the coordinator when constructing
+	:py:class:`vesna.alh.ALHProxy` objects::
+
+	    coor = ALHScheduler(ALHWeb("https://crn.log-a-tec.eu/communicator", 10001))
+
+	    node1 = ALHProxy(coor, 17)
+	    node2 = ALHProxy(coor, 19)
+
+	Requests that arrive while another request is in progress are queued.
+	Waiting threads block without polling the coordinator. Queued requests
+	are served in a round-robin fashion between nodes, so that a thread
+	issuing many requests to one node does not starve requests to other
+	nodes. Requests for the same node are served in order of arrival.
+
+	Requests are also divided into priority classes (see
+	`HIGH_PRIORITY_RESOURCES` and `LOW_PRIORITY_RESOURCES` in
+	:py:class:`vesna.alh.ALHProtocol`). A queued request in a higher
+	class is always served before requests in lower classes. This way,
+	programming a node is not delayed by bulk data retrieval from other
+	nodes.
+
+	:param alh: ALH implementation used to communicate with the coordinator
+	"""
+	def __init__(self, alh):
+		self.alh = alh
+
+		self._lock = threading.Lock()
+
+		# (priority, node) -> deque of tickets waiting for that node
+		self._queues = {}
+		# priority -> nodes with waiting tickets, in order they will be served
+		self._rotations = {}
+
+		self._active = None
+
+		self._stats = {}
+
+	def _grant_next(self):
+		if not self._rotations:
+			self._active = None
+			return
+
+		priority = min(self._rotations)
+		rotation = self._rotations[priority]
+
+		node = rotation.popleft()
+		queue = self._queues[priority, node]
+
+		ticket = queue.popleft()
+		if queue:
+			rotation.append(node)
+		else:
+			del self._queues[priority, node]
+			if not rotation:
+				del self._rotations[priority]
+
+		self._active = ticket
+		ticket.event.set()
+
+	def _cancel(self, ticket):
+		if self._active is ticket:
+			self._grant_next()
+		else:
+			key = (ticket.priority, ticket.node)
+
+			queue = self._queues[key]
+			queue.remove(ticket)
+			if not queue:
+				del self._queues[key]
+
+				rotation = self._rotations[ticket.priority]
+				rotation.remove(ticket.node)
+				if not rotation:
+					del self._rotations[ticket.priority]
+
+	def _record_wait(self, node, wait_time):
+		stats = self._stats.get(node)
+		if stats is None:
+			stats = self._stats[node] = {
+				'requests': 0,
+				'wait_time_total': 0.0,
+				'wait_time_max': 0.0,
+			}
+
+		stats['requests'] += 1
+		stats['wait_time_total'] += wait_time
+		stats['wait_time_max'] = max(stats['wait_time_max'], wait_time)
+
+	@contextlib.contextmanager
+	def _slot(self, node, priority):
+		ticket = _Ticket(node, priority)
+
+		with self._lock:
+			key = (priority, node)
+
+			queue = self._queues.get(key)
+			if queue is None:
+				queue = self._queues[key] = collections.deque()
+
+				rotation = self._rotations.get(priority)
+				if rotation is None:
+					rotation = self._rotations[priority] = collections.deque()
+				rotation.append(node)
+
+			queue.append(ticket)
+
+			if self._active is None:
+				self._grant_next()
+
+		try:
+			ticket.event.wait()
+		except BaseException:
+			with self._lock:
+				self._cancel(ticket)
+			raise
+
+		wait_time = time.time() - ticket.time_queued
+
+		with self._lock:
+			self._record_wait(node, wait_time)
+
+		try:
+			yield
+		finally:
+			with self._lock:
+				assert self._active is ticket
+				self._grant_next()
+
+	@cast_args_to_bytes
+	def get(self, resource, *args):
+		node = self._split_resource(resource, args)[0]
+		priority = self._get_priority("get", resource, args)
+
+		with self._slot(node, priority):
+			return self.alh.get(resource, *args)
+
+	@cast_args_to_bytes
+	def post(self, resource, data, *args):
+		node = self._split_resource(resource, args)[0]
+		priority = self._get_priority("post", resource, args)
+
+		with self._slot(node, priority):
+			return self.alh.post(resource, data, *args)
+
+	@property
+	def queue_depth(self):
+		"""Number of requests currently waiting in the queue.
+		"""
+		with self._lock:
+			return sum(len(queue) for queue in self._queues.values())
+
+	def get_queue_depths(self):
+		"""Return number of waiting requests for each node.
+
+		:return: dictionary with node addresses as keys. Requests for the
+		         coordinator itself are under the `None` key.
+		"""
+		with self._lock:
+			depths = {}
+			for (priority, node), queue in self._queues.items():
+				depths[node] = depths.get(node, 0) + len(queue)
+
+			return depths
+
+	def get_stats(self):
+		"""Return statistics about time requests spent waiting in the queue.
+
+		:return: dictionary with node addresses as keys (`None` for the
+		         coordinator itself). Values are dictionaries with the number of
+		         requests, total and maximum waiting time in seconds.
+		"""
+		with self._lock:
+			return dict((node, dict(stats)) for node, stats in self._stats.items())
@@ -1,11 +1,15 @@
 import binascii
+import hashlib
 try:
 	from itertools import zip_longest
 except ImportError:
 	from itertools import izip_longest as zip_longest
 import logging
+import numpy as np
+import os
 import re
 import struct
+import sys
 import time
 
 from vesna.spectrumsensor import Device, DeviceConfig, ConfigList, SweepConfig, Sweep
@@ -13,6 +17,13 @@ from vesna.alh import CRCError, ALHException
 
 log = logging.getLogger(__name__)
 
+def _frombuffer(data, dtype, count=-1, offset=0):
+	# NumPy on Python 2 does not accept memoryview objects.
+	if sys.version_info[0] < 3 and isinstance(data, memoryview):
+		data = data.tobytes()
+
+	return np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+
 class ALHProgrammingTimeError(ALHException): pass
 
 class SpectrumSensorProgram:
@@ -117,6 +128,7 @@ class SpectrumSensor:
 	"""
 	MAX_TIME_ERROR = 2.0
 	MAX_SINGLE_SWEEP_TIME = 800e-3
+	SLOT_CHUNK_SIZE = 512
 
 	def __init__(self, alh):
 		self.alh = alh
@@ -142,7 +154,7 @@ class SpectrumSensor:
 		v= binascii.crc32(data) & 0xffffffff
 		return v
 
-	def _sweep(self, sweep_config):
+	def _sweep(self, sweep_config, raw=False):
 		response = self.alh.post("sensing/quickSweepBin",
 				"dev %d conf %d ch %d:%d:%d" % (
 				sweep_config.config.device.id,
@@ -151,10 +163,10 @@ class SpectrumSensor:
 				sweep_config.step_ch,
 				sweep_config.stop_ch))
 
-		data = response.content[:-4]
-		crc = response.content[-4:]
+		data = response.get_payload()
+		crc = response.get_trailer()
 
-		their_crc = struct.unpack("<I", crc[-4:])[0]
+		their_crc = struct.unpack("<I", crc)[0]
 		our_crc = self._crc32(data)
 		if their_crc != our_crc:
 			# Firmware versions 2.29 only calculate CRC on the
@@ -168,28 +180,35 @@ class SpectrumSensor:
 
 		assert sweep_config.num_channels * 2 == len(data)
 
-		result = []
-		for n in range(0, len(data), 2):
-			datum = data[n:n+2]
-
-			dbm = struct.unpack("<h", datum)[0]*1e-2
-			result.append(dbm)
-
-		return result
+		values = _frombuffer(data, dtype='<i2')
+		if raw:
+			return values
+		else:
+			return (values * 1e-2).tolist()
 
-	def sweep(self, sweep_config):
+	def sweep(self, sweep_config, raw=False):
 		"""Perform a single frequency sweep and return results
 		immediately
 
+		By default, the sweep data is a list of measurements in dBm. If
+		`raw` is set, the data is instead a NumPy array of 16-bit
+		integers in units of 0.01 dBm, as returned by the node. This
+		avoids the conversion to floating point.
+
 		:param sweep_config: frequency sweep configuration to use, a :py:class:`SweepConfig` object
+		:param raw: return measurements in 0.01 dBm as an integer array
 		"""
 
 		sweep = Sweep()
 		sweep.timestamp = 0
 
-		for sweep_config in self._split_sweep_config(sweep_config):
-			data = self._sweep(sweep_config)
-			sweep.data += data
+		chunks = [ self._sweep(sc, raw) for sc in self._split_sweep_config(sweep_config) ]
+
+		if raw:
+			sweep.data = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+		else:
+			for data in chunks:
+				sweep.data += data
 
 		return sweep
 
@@ -237,91 +256,264 @@ class SpectrumSensor:
 			return "status=COMPLETE" in resp.text
 
 	@staticmethod
-	def _decode(program, data):
-		num_channels = program.sweep_config.num_channels
+	def _decode_sweeps(num_channels, data, offset=0):
+		# Decode complete sweeps from data, starting at offset.
+		# Returns a list of sweeps and the offset after the last one.
 		line_bytes = num_channels * 2 + 4
 
-		result = SpectrumSensorResult(program)
+		# Each line in the slot is a 32-bit time-stamp followed by one
+		# 16-bit value per channel.
+		dtype = np.dtype([
+			('timestamp', '<i4'),
+			('data', '<i2', (num_channels,))])
 
-		sweep = Sweep()
-		for n in range(0, len(data), 2):
-			datum = data[n:n+2]
-			if len(datum) != 2:
-				continue
+		num_sweeps = (len(data) - offset) // line_bytes
+		lines = _frombuffer(data, dtype=dtype, count=num_sweeps, offset=offset)
 
-			if n % line_bytes == 0:
-				# got a time-stamp
-				t = data[n:n+4]
-				tt = struct.unpack("<i", t)[0]
-				assert not sweep.data
-				sweep.timestamp = tt * 1e-3
-				continue
+		timestamps = (lines['timestamp'] * 1e-3).tolist()
+		values = (lines['data'] * 1e-2).tolist()
 
-			if n % line_bytes == 2:
-				# second part of a time-stamp, just ignore
-				assert not sweep.data
-				continue
+		sweeps = []
+		for timestamp, dbm in zip(timestamps, values):
+			sweep = Sweep()
+			sweep.timestamp = timestamp
+			sweep.data = dbm
+			sweeps.append(sweep)
 
-			dbm = struct.unpack("<h", datum)[0]*1e-2
-			sweep.data.append(dbm)
+		return sweeps, offset + num_sweeps * line_bytes
 
-			if len(sweep.data) >= num_channels:
-				result.sweeps.append(sweep)
-				sweep = Sweep()
+	@staticmethod
+	def _decode_partial_sweep(data, offset=0):
+		# Decode a sweep that was cut short at the end of data.
+		# Returns None if there are no measurements after the
+		# time-stamp.
+		num_values = (len(data) - offset - 4) // 2
+		if num_values <= 0:
+			return None
+
+		sweep = Sweep()
+		sweep.timestamp = struct.unpack_from("<i", data, offset)[0] * 1e-3
+		sweep.data = (_frombuffer(data, dtype='<i2', count=num_values,
+			offset=offset+4) * 1e-2).tolist()
 
-		if(sweep.data):
+		return sweep
+
+	@classmethod
+	def _decode(cls, program, data):
+		result = SpectrumSensorResult(program)
+
+		result.sweeps, p = cls._decode_sweeps(program.sweep_config.num_channels, data)
+
+		sweep = cls._decode_partial_sweep(data, p)
+		if sweep is not None:
 			result.sweeps.append(sweep)
 
 		return result
 
-	def retrieve(self, program):
-		"""Retrieve results from the given spectrum sensing program.
-
-		:param program: a :py:class:`SpectrumSensorProgram` object
-		:return: a :py:class:`SpectrumSensorResult` object
-		"""
+	def _get_slot_size(self, program):
 		resp = self.alh.get("sensing/slotInformation", "id=%d" % (program.slot_id,))
 
 		assert "status=COMPLETE" in resp.text
 
 		g = re.search("size=([0-9]+)", resp.text)
-		total_size = int(g.group(1))
-
-		#print "total size:", total_size
+		return int(g.group(1))
 
+	def _iter_chunks(self, program, total_size, skip=()):
+		# Download slot data in chunks. Yields the offset and payload
+		# of each chunk after its CRC and size have been checked.
+		# Chunks starting at offsets in skip are not downloaded.
 		p = 0
-		max_read_size = 512
-		data = b""
+		max_read_size = self.SLOT_CHUNK_SIZE
 
 		while p < total_size:
-			chunk_size = min(max_read_size, total_size - p)
-
-			#if p < total_size - chunk_size*2:
-			#	p += max_read_size
-			#	continue
+			if p in skip:
+				p += max_read_size
+				continue
 
-			#print "start", p
-			#print "size", chunk_size
+			chunk_size = min(max_read_size, total_size - p)
 
 			chunk_data_crc = self.alh.get("sensing/slotDataBinary", "id=%d&start=%d&size=%d" % (
 				program.slot_id, p, chunk_size))
 
-			chunk_data = chunk_data_crc.content[:-4]
+			chunk_data = chunk_data_crc.get_payload()
 
-			#print "len", len(chunk_data)
-			
-			their_crc = struct.unpack("I", chunk_data_crc.content[-4:])[0]
+			their_crc = struct.unpack("I", chunk_data_crc.get_trailer())[0]
 			our_crc = self._crc32(chunk_data)
 
 			if(their_crc != our_crc):
 				raise CRCError
 
-			data += chunk_data
+			if len(chunk_data) != chunk_size:
+				raise CRCError("short slot data chunk at %d: %d of %d bytes" % (
+					p, len(chunk_data), chunk_size))
+
+			yield p, chunk_data
 
 			p += max_read_size
 
+	def _get_spool_path(self, spool_dir, program):
+		sc = program.sweep_config
+		desc = "dev %d conf %d ch %d:%d:%d start %r duration %r slot %d" % (
+				sc.config.device.id,
+				sc.config.id,
+				sc.start_ch,
+				sc.step_ch,
+				sc.stop_ch,
+				program.time_start,
+				program.time_duration,
+				program.slot_id)
+
+		digest = hashlib.sha1(desc.encode('ascii')).hexdigest()[:16]
+
+		addr = getattr(self.alh, 'addr', None)
+		node = "local" if addr is None else "%d" % (addr,)
+
+		name = "slot-%s-%d-%s" % (node, program.slot_id, digest)
+		return os.path.join(spool_dir, name)
+
+	def _read_spool_offsets(self, path, total_size):
+		# Return the set of offsets of chunks that are stored in the
+		# spool file. Ignores a checkpoint for a slot of different size.
+		try:
+			f = open(path)
+		except IOError:
+			return set()
+
+		with f:
+			lines = f.read().split("\n")
+
+		if lines[0] != "size=%d" % (total_size,):
+			return set()
+
+		done = set()
+		for line in lines[1:]:
+			try:
+				p = int(line)
+			except ValueError:
+				continue
+
+			if p % self.SLOT_CHUNK_SIZE == 0 and 0 <= p < total_size:
+				done.add(p)
+
+		return done
+
+	def _retrieve_spooled(self, program, total_size, spool_dir):
+		path = self._get_spool_path(spool_dir, program)
+		data_path = path + ".dat"
+		done_path = path + ".done"
+
+		if os.path.exists(data_path):
+			done = self._read_spool_offsets(done_path, total_size)
+			mode = "r+b"
+		else:
+			done = set()
+			mode = "w+b"
+
+		if done:
+			log.info("resuming retrieval of slot %d: %d of %d bytes in spool" % (
+				program.slot_id,
+				sum(min(self.SLOT_CHUNK_SIZE, total_size - p) for p in done),
+				total_size))
+
+		with open(data_path, mode) as f:
+			# Rewrite the list of stored chunks, in case the last line
+			# was only partially written.
+			with open(done_path, "w") as g:
+				g.write("size=%d\n" % (total_size,))
+				for p in sorted(done):
+					g.write("%d\n" % (p,))
+				g.flush()
+
+				for p, chunk_data in self._iter_chunks(program, total_size, done):
+					f.seek(p)
+					f.write(chunk_data)
+					f.flush()
+					os.fsync(f.fileno())
+
+					# Only mark the chunk as stored after
+					# its data is on disk.
+					g.write("%d\n" % (p,))
+					g.flush()
+
+			f.seek(0)
+			data = f.read(total_size)
+
+		os.unlink(done_path)
+		os.unlink(data_path)
+
+		return data
+
+	def retrieve(self, program, spool_dir=None):
+		"""Retrieve results from the given spectrum sensing program.
+
+		If `spool_dir` is given, downloaded data is saved to a spool file
+		in that directory as it arrives. If the retrieval fails (for
+		example with a :py:class:`vesna.alh.TerminalError`), calling
+		`retrieve` again with the same node, program and spool directory
+		only downloads the data that is still missing. Spool files are
+		removed after a successful retrieval.
+
+		:param program: a :py:class:`SpectrumSensorProgram` object
+		:param spool_dir: path to a directory for resumable retrieval
+		:return: a :py:class:`SpectrumSensorResult` object
+		"""
+		data = self._read_slot(program, spool_dir)
 		return self._decode(program, data)
 
+	def _read_slot(self, program, spool_dir=None):
+		# Download the complete slot. Returns the slot data as a
+		# buffer object.
+		total_size = self._get_slot_size(program)
+
+		if spool_dir is not None:
+			return self._retrieve_spooled(program, total_size, spool_dir)
+
+		# Chunks are copied into a preallocated buffer, so that the
+		# data received so far is not copied again with every chunk.
+		data = bytearray(total_size)
+		view = memoryview(data)
+
+		size = 0
+		for p, chunk_data in self._iter_chunks(program, total_size):
+			end = p + len(chunk_data)
+			view[p:end] = chunk_data
+			size = max(size, end)
+
+		return view[:size]
+
+	def iter_retrieve(self, program):
+		"""Retrieve results from the given spectrum sensing program
+		while they are being downloaded.
+
+		This is a generator that yields each sweep as soon as all of its
+		data has been received. Unlike :py:meth:`retrieve`, it does not
+		keep the whole slot in memory::
+
+		    for sweep in sensor.iter_retrieve(program):
+		        process(sweep.timestamp, sweep.data)
+
+		:param program: a :py:class:`SpectrumSensorProgram` object
+		:return: iterator over :py:class:`Sweep` objects
+		"""
+		num_channels = program.sweep_config.num_channels
+		total_size = self._get_slot_size(program)
+
+		# data received after the last complete sweep
+		buf = bytearray()
+
+		for chunk_start, chunk_data in self._iter_chunks(program, total_size):
+			buf += chunk_data
+
+			sweeps, p = self._decode_sweeps(num_channels, buf)
+			del buf[:p]
+
+			for sweep in sweeps:
+				yield sweep
+
+		sweep = self._decode_partial_sweep(buf)
+		if sweep is not None:
+			yield sweep
+
 	def get_config_list(self):
 		"""Query and return the list of supported device configurations.
 